@@ -1,6 +1,7 @@
 """The wfc3tools package holds Python tasks useful for analyzing WFC3 data."""
 
 # HSTCAL
+from .batch import calwf3_batch
 from .calwf3 import calwf3
 from .wf32d import wf32d
 from .wf3ccd import wf3ccd
@@ -15,7 +16,7 @@ from .pstat import pstat
 from .sampinfo import sampinfo
 from .sub2full import sub2full
 from .util import display_help
-from .wfc3ir_tools import make_flattened_ramp_flt
+from .wfc3ir_tools import make_flattened_ramp_flt, make_flattened_ramp_flt_batch
 
 try:
     from .version import version as __version__
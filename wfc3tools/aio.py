@@ -0,0 +1,101 @@
+"""
+Awaitable versions of the HSTCAL wrappers.
+
+Each function here takes the same arguments as the wrapper of the same name
+(``calwf3_async`` as `~wfc3tools.calwf3.calwf3`, and so on), plus:
+
+- ``timeout``: maximum run time in seconds, after which the executable is
+  killed and `asyncio.TimeoutError` is raised. Default is `None`, no limit.
+
+The executable runs as an `asyncio` subprocess, so many calibrations can be
+driven from a single event loop without a thread per job.  ``log_func`` may
+be an ordinary function or a coroutine function; it is called with each line
+of output.  Cancelling the awaiting task kills the executable.  On success a
+`~wfc3tools.runner.RunResult` is returned; as with the synchronous wrappers,
+a failed run raises `RuntimeError`.
+
+.. code-block:: python
+
+    >>> import asyncio
+    >>> from wfc3tools.aio import calwf3_async
+    >>> async def main(files):
+    ...     limit = asyncio.Semaphore(32)
+    ...     async def one(f):
+    ...         async with limit:
+    ...             return await calwf3_async(f, log_func=None, timeout=3600)
+    ...     return await asyncio.gather(*(one(f) for f in files), return_exceptions=True)
+    >>> results = asyncio.run(main(["iaa012wdq_raw.fits", "ibh719grq_raw.fits"]))
+
+"""
+
+from .calwf3 import _calwf3_call_list
+from .openmp import omp_environ
+from .runner import run_executable_async
+from .wf3ccd import _wf3ccd_call_list
+from .wf3cte import _single_input, _wf3cte_call_list
+from .wf3ir import _wf3ir_call_list
+from .wf3rej import _wf3rej_call_list
+from .wf32d import _wf32d_call_list
+
+__all__ = ["calwf3_async", "wf32d_async", "wf3ccd_async", "wf3cte_async", "wf3ir_async", "wf3rej_async"]
+
+
+def _check(result):
+    """Raise `RuntimeError` if the run in ``result`` failed."""
+    if result.returncode:
+        ec = result.error or result.returncode
+        raise RuntimeError("{} exited with code {}".format(result.command[0], ec))
+    return result
+
+
+async def calwf3_async(input=None, log_func=print, timeout=None, nthreads=None, **kwargs):
+    """Awaitable version of :func:`~wfc3tools.calwf3.calwf3`."""
+    call_list = _calwf3_call_list(input=input, **kwargs)
+    env = omp_environ(nthreads) if nthreads else None
+    version = kwargs.get("version", False)
+    result = await run_executable_async(
+        call_list, input=None if version else input, log_func=log_func, env=env, timeout=timeout
+    )
+    return _check(result)
+
+
+async def wf3cte_async(input, log_func=print, timeout=None, nthreads=None, **kwargs):
+    """Awaitable version of :func:`~wfc3tools.wf3cte.wf3cte`."""
+    call_list = _wf3cte_call_list(input, **kwargs)
+    env = omp_environ(nthreads) if nthreads else None
+    result = await run_executable_async(call_list, input=_single_input(call_list), log_func=log_func, env=env, timeout=timeout)
+    return _check(result)
+
+
+async def wf3ccd_async(input, log_func=print, timeout=None, **kwargs):
+    """Awaitable version of :func:`~wfc3tools.wf3ccd.wf3ccd`."""
+    call_list = _wf3ccd_call_list(input, **kwargs)
+    result = await run_executable_async(
+        call_list, input=input, log_func=log_func, timeout=timeout, output=kwargs.get("output")
+    )
+    return _check(result)
+
+
+async def wf32d_async(input, log_func=print, timeout=None, **kwargs):
+    """Awaitable version of :func:`~wfc3tools.wf32d.wf32d`."""
+    call_list = _wf32d_call_list(input, **kwargs)
+    result = await run_executable_async(
+        call_list, input=input, log_func=log_func, timeout=timeout, output=kwargs.get("output")
+    )
+    return _check(result)
+
+
+async def wf3ir_async(input, log_func=print, timeout=None, **kwargs):
+    """Awaitable version of :func:`~wfc3tools.wf3ir.wf3ir`."""
+    call_list = _wf3ir_call_list(input, **kwargs)
+    result = await run_executable_async(
+        call_list, input=input, log_func=log_func, timeout=timeout, output=kwargs.get("output")
+    )
+    return _check(result)
+
+
+async def wf3rej_async(input, output, log_func=print, timeout=None, **kwargs):
+    """Awaitable version of :func:`~wfc3tools.wf3rej.wf3rej`."""
+    call_list = _wf3rej_call_list(input, output, **kwargs)
+    result = await run_executable_async(call_list, log_func=log_func, timeout=timeout, output=output)
+    return _check(result)
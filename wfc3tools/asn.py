@@ -0,0 +1,367 @@
+"""
+Process an association with its members in parallel.
+
+For an association, ``calwf3.e`` calibrates one member after the other
+within a single process before combining them, so its run time is the sum
+of the run times of the members.  `calwf3_asn` reads the association table
+instead, and builds a graph of single-step tasks:
+
+- UVIS: ``wf3cte`` (if PCTECORR is PERFORM) and ``wf3ccd`` for every member,
+  ``wf3rej`` for every CR-SPLIT or REPEAT-OBS product, and ``wf32d`` for the
+  members and the products, after ``wf3rej`` has flagged the cosmic rays in
+  the DQ arrays of the members;
+- IR: ``wf3ir`` for every member and ``wf3rej`` for every product.
+
+Tasks run as soon as the tasks they depend on are done, with at most
+``max_workers`` at a time, so the members are calibrated concurrently and
+the run time of the association approaches that of its slowest member.  The
+tasks of one member (or product) run one at a time, as they all write the
+same trailer file.
+
+.. code-block:: python
+
+    >>> from wfc3tools.asn import calwf3_asn
+    >>> results = calwf3_asn('iaa012010_asn.fits', max_workers=4)
+    >>> for name, result in results.items():
+    ...     print(name, result.returncode, result.wall_time)
+
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from astropy.io import fits
+
+from .openmp import omp_environ
+from .runner import RunResult, run_executable
+from .wf3ccd import _wf3ccd_call_list
+from .wf3cte import _wf3cte_call_list
+from .wf3ir import _wf3ir_call_list
+from .wf32d import _wf32d_call_list
+
+__all__ = ["TaskGraph", "calwf3_asn", "read_association"]
+
+# Association member types whose exposures are combined by wf3rej
+_REJECTION_TYPES = ("CR", "RP")
+
+
+def read_association(asn_file):
+    """
+    Read the products and members of an association table.
+
+    Parameters
+    ----------
+    asn_file : str
+        Association table (``_asn.fits``).
+
+    Returns
+    -------
+    products : dict
+        Member rootnames of each product, keyed by ``(product rootname,
+        type)``, e.g. ``("iaa012011", "CRJ")``. Only the members present
+        (MEMPRSNT) are listed, in table order.
+    """
+    products = {}
+    members = {}
+    with fits.open(asn_file) as asn:
+        table = asn[1].data
+        present = "MEMPRSNT" in asn[1].columns.names
+        for row in table:
+            memname = row["MEMNAME"].strip().lower()
+            memtype = row["MEMTYPE"].strip().upper()
+            kind, _, suffix = memtype.partition("-")
+            if kind == "PROD":
+                products[suffix] = memname
+            elif kind == "EXP" and (not present or row["MEMPRSNT"]):
+                members.setdefault(suffix, []).append(memname)
+
+    result = {}
+    for suffix, names in members.items():
+        if suffix not in products:
+            raise ValueError("No product for association members of type EXP-{0} in {1}".format(suffix, asn_file))
+        result[(products[suffix], suffix)] = names
+    return result
+
+
+class TaskGraph:
+    """
+    A set of tasks with dependencies, run in a thread pool.
+
+    Each task is a function returning a `~wfc3tools.runner.RunResult`. A task
+    runs once all the tasks it depends on have succeeded; the dependents of a
+    failed task are not run. A task that raises an exception, e.g. `IOError`
+    for a missing input, fails with ``returncode`` 2 and ``error`` the error
+    message.
+
+    Examples
+    --------
+    >>> graph = TaskGraph()
+    >>> graph.add("a", run_a)
+    >>> graph.add("b", run_b, deps=["a"])
+    >>> results = graph.run(max_workers=4)
+
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name, func, deps=()):
+        """Add task ``name``, calling ``func()`` after the tasks in ``deps``."""
+        if name in self.tasks:
+            raise ValueError("Duplicate task: {0}".format(name))
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError("Unknown dependency {0} of task {1}".format(dep, name))
+        self.tasks[name] = (func, tuple(deps))
+
+    def run(self, max_workers=None):
+        """
+        Run all tasks.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Maximum number of tasks running at once. Default is `None`, the
+            `~concurrent.futures.ThreadPoolExecutor` default.
+
+        Returns
+        -------
+        results : dict
+            `~wfc3tools.runner.RunResult` of each task that ran, keyed by
+            task name, in the order the tasks were added.
+        """
+        results = {}
+        waiting = dict(self.tasks)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while waiting or running:
+                for name, (func, deps) in list(waiting.items()):
+                    if any(dep not in results for dep in deps):
+                        # skipped if a dependency was skipped, else not ready yet
+                        pending = set(waiting) | set(running.values())
+                        if any(dep not in pending and dep not in results for dep in deps):
+                            del waiting[name]
+                        continue
+                    if all(results[dep].ok for dep in deps):
+                        running[executor.submit(func)] = name
+                    del waiting[name]
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        # e.g. a missing input, found when the task builds its command line
+                        error = str(e) or type(e).__name__
+                        results[name] = RunResult(input=None, command=[], returncode=2, error=error)
+
+        return {name: results[name] for name in self.tasks if name in results}
+
+
+def _runner(call_list_func, input, log_func, env=None, **kwargs):
+    """Return a task that builds a command line when it starts, and runs it."""
+
+    def task():
+        call_list = call_list_func(input, **kwargs)
+        return run_executable(call_list, input=input, log_func=log_func, env=env, output=kwargs.get("output"))
+
+    return task
+
+
+def _rejection(inputs, output, verbose=False, log_func=None):
+    """
+    Return a ``wf3rej.e`` task.
+
+    The command line is built here rather than with the `~wfc3tools.wf3rej.wf3rej`
+    defaults, which override the CRREJTAB parameters that calwf3.e uses.
+    """
+
+    def task():
+        for image in inputs:
+            if not os.path.exists(image):
+                raise IOError("Input file not found: {0}".format(image))
+        call_list = ["wf3rej.e", ",".join(inputs), output]
+        if verbose:
+            call_list += ["-v", "-t"]
+        return run_executable(call_list, log_func=log_func, output=output)
+
+    return task
+
+
+def calwf3_asn(asn_file, max_workers=None, save_tmp=False, verbose=False, parallel=True, log_func=None, nthreads=None):
+    """
+    Calibrate the members and products of an association concurrently.
+
+    Parameters
+    ----------
+    asn_file : str
+        Association table (``_asn.fits``); the raw files of its members must
+        be in the same directory.
+
+    max_workers : int, optional
+        Maximum number of executables running at once. Default is `None`,
+        the `~concurrent.futures.ThreadPoolExecutor` default.
+
+    save_tmp : bool, optional
+        Keep the intermediate (``_tmp``) files. Default is `False`.
+
+    verbose : bool, optional
+        Print time stamps. Default is `False`.
+
+    parallel : bool, optional
+        Use OpenMP in the UVIS CTE correction. Default is `True`.
+
+    log_func : func, optional
+        Called with every line of output of every task. As the tasks are
+        concurrent, the lines of different tasks are interleaved. Default is
+        `None`, which discards the output; the trailer files still record it.
+
+    nthreads : int, optional
+        Number of OpenMP threads of each CTE correction. Default is `None`,
+        the OpenMP default of one thread per CPU, which oversubscribes the
+        CPUs when several members are corrected at once.
+
+    Returns
+    -------
+    results : dict
+        `~wfc3tools.runner.RunResult` of each task that ran, keyed by names
+        such as ``"wf3ccd:iaa012wdq_blv_tmp"``. Tasks whose inputs failed
+        are not run and have no result.
+
+    Raises
+    ------
+    IOError
+        If the association table or a member raw file does not exist.
+    """
+    if not os.path.exists(asn_file):
+        raise IOError("Input file not found: {0}".format(asn_file))
+    dirname = os.path.dirname(asn_file)
+    env = omp_environ(nthreads) if nthreads else None
+
+    def path(root, suffix):
+        return os.path.join(dirname, "{0}_{1}.fits".format(root, suffix))
+
+    graph = TaskGraph()
+    last = {}  # last task writing the trailer of each rootname
+
+    def add(root, name, func, deps=()):
+        deps = list(deps)
+        if root in last:
+            deps.append(last[root])
+        graph.add(name, func, deps=deps)
+        last[root] = name
+        return name
+
+    products = read_association(asn_file)
+    tmp_files = []
+    for (product, kind), members in products.items():
+        for member in members:
+            if not os.path.exists(path(member, "raw")):
+                raise IOError("Input file not found: {0}".format(path(member, "raw")))
+
+        header = fits.getheader(path(members[0], "raw"))
+        combine = kind.startswith(_REJECTION_TYPES) and len(members) > 1
+        no_switches = dict(dqicorr=None, atodcorr=None, blevcorr=None, biascorr=None, flashcorr=None)
+        d2_switches = dict(dqicorr=None, darkcorr=None, flatcorr=None, shadcorr=None, photcorr=None)
+
+        if header.get("DETECTOR") == "IR":
+            flts = []
+            for member in members:
+                flt = path(member, "flt")
+                add(
+                    member,
+                    "wf3ir:" + member,
+                    _runner(_wf3ir_call_list, path(member, "raw"), log_func, output=flt, verbose=verbose),
+                )
+                flts.append(flt)
+            if combine:
+                deps = [last[member] for member in members]
+                add(
+                    product,
+                    "wf3rej:{0}_crj".format(product),
+                    _rejection(flts, path(product, "crj"), verbose=verbose, log_func=log_func),
+                    deps=deps,
+                )
+            continue
+
+        # UVIS, with a second, CTE-corrected branch when PCTECORR is PERFORM
+        branches = [("blv_tmp", "flt", "crj")]
+        if header.get("PCTECORR") == "PERFORM":
+            branches.append(("blc_tmp", "flc", "crc"))
+
+        for member in members:
+            raw = path(member, "raw")
+            if len(branches) > 1:
+                cte_call = _wf3cte_call_list(raw, parallel=parallel, verbose=verbose)
+                add(
+                    member,
+                    "wf3cte:" + member,
+                    lambda cte_call=cte_call, raw=raw: run_executable(cte_call, input=raw, log_func=log_func, env=env),
+                )
+                tmp_files.append(path(member, "rac_tmp"))
+            for tmp, _, _ in branches:
+                source = raw if tmp == "blv_tmp" else path(member, "rac_tmp")
+                add(
+                    member,
+                    "wf3ccd:{0}_{1}".format(member, tmp),
+                    _runner(_wf3ccd_call_list, source, log_func, output=path(member, tmp), verbose=verbose, **no_switches),
+                )
+                tmp_files.append(path(member, tmp))
+
+        for tmp, single, combined in branches:
+            rejection = []
+            if combine:
+                deps = [last[member] for member in members]
+                rejection = [
+                    add(
+                        product,
+                        "wf3rej:{0}_{1}_tmp".format(product, combined),
+                        _rejection(
+                            [path(member, tmp) for member in members],
+                            path(product, combined + "_tmp"),
+                            verbose=verbose,
+                            log_func=log_func,
+                        ),
+                        deps=deps,
+                    )
+                ]
+                add(
+                    product,
+                    "wf32d:{0}_{1}".format(product, combined),
+                    _runner(
+                        _wf32d_call_list,
+                        path(product, combined + "_tmp"),
+                        log_func,
+                        output=path(product, combined),
+                        verbose=verbose,
+                        **d2_switches,
+                    ),
+                )
+                tmp_files.append(path(product, combined + "_tmp"))
+            # wf3rej flags the cosmic rays in the DQ of the member tmp files, as in calwf3.e
+            for member in members:
+                add(
+                    member,
+                    "wf32d:{0}_{1}".format(member, single),
+                    _runner(
+                        _wf32d_call_list,
+                        path(member, tmp),
+                        log_func,
+                        output=path(member, single),
+                        verbose=verbose,
+                        **d2_switches,
+                    ),
+                    deps=rejection,
+                )
+
+    results = graph.run(max_workers=max_workers)
+
+    if not save_tmp and len(results) == len(graph.tasks) and all(r.ok for r in results.values()):
+        for filename in tmp_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+    return results
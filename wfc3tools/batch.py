@@ -0,0 +1,207 @@
+"""
+Run ``calwf3`` on many exposures at once.
+
+``calwf3`` only accepts a single input per call, so reprocessing a program
+means calling it once per exposure.  `calwf3_batch` expands a list of inputs
+(Python lists, wildcards, and at-files, in any combination), and runs one
+``calwf3.e`` process per input with at most ``max_workers`` of them running
+at the same time.  Every input gets a `~wfc3tools.runner.RunResult`, whether
+or not its calibration succeeded, so one bad exposure does not stop the
+rest of the batch.
+
+.. code-block:: python
+
+    >>> from wfc3tools import calwf3_batch
+    >>> results = calwf3_batch("*_raw.fits", max_workers=16)
+    >>> failed = [r for r in results if not r.ok]
+    >>> for r in failed:
+    ...     print(r.input, r.error)
+
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import ResultCache, cached_run
+from .calwf3 import _calwf3_call_list
+from .executors import executor_context
+from .inputs import expand_inputs, preflight
+from .openmp import ThreadBudget
+from .runner import run_executable
+from .staging import run_staged
+
+__all__ = ["calwf3_batch"]
+
+
+def _expand_inputs(inputs):
+    """Expand lists, wildcards, and at-files into a list of filenames."""
+    missing = []
+    infiles = expand_inputs(inputs, missing=missing)
+    if missing:
+        raise IOError("Input file not found: {0}".format(missing[0]))
+    return infiles
+
+
+def _calwf3_job(image, call_list, env=None, scratch_root=None, products=None, cache=None, cache_options=None, log_func=None):
+    """Run one calwf3 job, staged and cached as requested; also run by worker processes."""
+    if env is not None:
+        env = dict(os.environ, **env)
+
+    def run():
+        if scratch_root is not None:
+            return run_staged(call_list, image, scratch_root=scratch_root, products=products, log_func=log_func, env=env)
+        return run_executable(call_list, input=image, log_func=log_func, env=env)
+
+    if cache is None:
+        return run()
+    return cached_run(cache, image, run, options=cache_options)
+
+
+def calwf3_batch(
+    inputs,
+    max_workers=None,
+    printtime=False,
+    save_tmp=False,
+    verbose=False,
+    debug=False,
+    parallel=True,
+    log_func=None,
+    threads_per_job=None,
+    cpus=None,
+    scratch_root=None,
+    products=None,
+    cache=None,
+    executor="thread",
+    check_headers=True,
+):
+    """
+    Run ``calwf3.e`` on many inputs, several at a time.
+
+    Parameters
+    ----------
+    inputs : str or list
+        Name of input files, such as
+
+        - a single filename (``iaa012wdq_raw.fits``)
+        - a Python list of filenames
+        - a partial filename with wildcards (``*raw.fits``)
+        - filenames of ASN tables (``*asn.fits``)
+        - an at-file (``@input``)
+
+        Each resulting file is processed by its own ``calwf3.e`` run.
+
+    max_workers : int, optional
+        Maximum number of ``calwf3.e`` processes running at once. Defaults to
+        the number of CPUs on the machine.
+
+    printtime, save_tmp, verbose, debug, parallel : bool, optional
+        Passed on to every run, see :func:`~wfc3tools.calwf3.calwf3`.
+        Note that with ``parallel=True`` and no ``threads_per_job``, each UVIS
+        CTE correction uses as many OpenMP threads as there are CPUs.
+
+    log_func : func, optional
+        Called with every line of output of every run. As the runs are
+        concurrent, the lines of different runs are interleaved. Default is
+        `None`, which discards the output; the trailer files still record it.
+
+    threads_per_job : int, optional
+        If given, ``cpus`` are split into disjoint slots of this many CPUs and
+        each run is limited to one slot through its OpenMP environment (see
+        `~wfc3tools.openmp.ThreadBudget`). ``max_workers`` then defaults to,
+        and is capped at, the number of slots. Default is `None`.
+
+    cpus : list of int, optional
+        CPUs shared by the runs when ``threads_per_job`` is given. Default is
+        `None`, which uses all CPUs available to this process.
+
+    scratch_root, products : optional
+        Run each job in its own scratch directory under ``scratch_root`` and
+        move back only ``products``, see :func:`~wfc3tools.calwf3.calwf3`.
+
+    cache : `~wfc3tools.cache.ResultCache` or str, optional
+        Skip inputs whose cached products are still valid, see
+        :func:`~wfc3tools.calwf3.calwf3`. Default is `None`.
+
+    executor : str or executor, optional
+        ``"thread"`` (the default) or ``"process"`` to run the jobs on this
+        node, or an executor such as a ``dask.distributed.Client`` to run them
+        on a cluster; see `wfc3tools.executors`. With anything but
+        ``"thread"``, input names are made absolute, ``threads_per_job`` only
+        sets ``OMP_NUM_THREADS``, and ``log_func`` must be a file name or
+        `None`.
+
+    check_headers : bool, optional
+        Check the primary headers of all inputs with
+        `~wfc3tools.inputs.preflight` before running any of them. Default is
+        `True`.
+
+    Returns
+    -------
+    results : list of `~wfc3tools.runner.RunResult`
+        One result per input file, in input order.
+
+    Raises
+    ------
+    IOError
+        If no input is given, an input file does not exist, or (with
+        ``check_headers``) an input is not a WFC3 file with the calibration
+        switches set. This is checked for all inputs before any processing
+        starts.
+
+    Examples
+    --------
+    >>> from wfc3tools import calwf3_batch
+    >>> results = calwf3_batch(["ibh719grq_raw.fits", "@uvis.lst"], max_workers=8)
+    >>> sum(r.wall_time for r in results)
+
+    """
+    infiles = _expand_inputs(inputs)
+    if len(infiles) == 0:
+        raise IOError("No valid image specified")
+
+    call_lists = [
+        _calwf3_call_list(
+            input=image,
+            printtime=printtime,
+            save_tmp=save_tmp,
+            verbose=verbose,
+            debug=debug,
+            parallel=parallel,
+        )
+        for image in infiles
+    ]
+    if check_headers:
+        preflight(infiles)
+
+    if cache is not None and not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
+
+    # the flags that change the products, trailer included, as in calwf3
+    cache_options = {"save_tmp": save_tmp, "printtime": printtime, "verbose": verbose, "debug": debug, "products": products}
+    options = dict(scratch_root=scratch_root, products=products, cache=cache, cache_options=cache_options, log_func=log_func)
+
+    if executor != "thread":
+        # the workers may be on other nodes: pass absolute names and only the thread count
+        env = {"OMP_NUM_THREADS": str(threads_per_job)} if threads_per_job else None
+        with executor_context(executor, max_workers=max_workers) as pool:
+            futures = []
+            for image, call_list in zip(infiles, call_lists):
+                image = os.path.abspath(image)
+                futures.append(pool.submit(_calwf3_job, image, call_list[:-1] + [image], env=env, **options))
+            return [future.result() for future in futures]
+
+    budget = None
+    if threads_per_job is not None:
+        budget = ThreadBudget(threads_per_job, cpus=cpus)
+        max_workers = budget.max_jobs if max_workers is None else min(max_workers, budget.max_jobs)
+    elif max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    def run(image, call_list):
+        if budget is None:
+            return _calwf3_job(image, call_list, **options)
+        with budget.slot() as env:
+            return _calwf3_job(image, call_list, env=env, **options)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, infiles, call_lists))
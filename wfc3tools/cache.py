@@ -0,0 +1,522 @@
+"""
+Skip calibrations whose inputs have not changed.
+
+A `ResultCache` keeps the products of earlier runs in a directory, under a key
+that is a hash of everything that determines them:
+
+- the contents of the input file and its companion files (association
+  members and SPT files),
+- the calibration switches (``*CORR``) of the input,
+- the names and contents of the reference files named in the input header,
+- the version string reported by the executable,
+- the options that change the products (e.g. ``save_tmp``).
+
+When a run is requested with the same key, its products are restored from
+the cache, or left in place if they are already there and unchanged, and the
+executable is not run.  The cache is bounded in size; the least recently used
+entries are removed first.
+
+A `CTECache` does the same for the output of the pixel-based CTE correction
+alone, the ``_rac_tmp.fits`` intermediate, which depends only on the raw
+pixels, the CTE reference files (PCTETAB, DRKCFILE, BIACFILE), and the CTE
+code.  ``wf3cte`` and ``calwf3`` can then skip the CTE correction, by far
+the most expensive step, when only downstream reference files changed.
+
+.. code-block:: python
+
+    >>> from wfc3tools import calwf3
+    >>> from wfc3tools.cache import ResultCache
+    >>> cache = ResultCache('/scratch/calwf3-cache', max_bytes=500e9)
+    >>> result = calwf3('iaa012wdq_raw.fits', cache=cache)
+    >>> result.cached
+    False
+    >>> result = calwf3('iaa012wdq_raw.fits', cache=cache)
+    >>> result.cached
+    True
+
+    >>> from wfc3tools.cache import CTECache
+    >>> cte_cache = CTECache('/scratch/cte-cache', max_bytes=200e9)
+    >>> calwf3('iaa012wdq_raw.fits', cte_cache=cte_cache)
+
+"""
+
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from .runner import RunResult
+from .staging import staged_inputs
+
+__all__ = [
+    "CTECache",
+    "ResultCache",
+    "cached_run",
+    "calibration_key",
+    "cte_cached_run",
+    "cte_key",
+    "executable_version",
+    "file_digest",
+    "rac_name",
+    "resolve_reference",
+]
+
+# Reference files used by the pixel-based CTE correction
+CTE_REFERENCES = ("PCTETAB", "DRKCFILE", "BIACFILE")
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(filename):
+    """
+    Return the SHA-256 hex digest of a file's contents.
+
+    Digests are remembered for as long as the file's size and modification
+    time do not change, so large reference files are read only once.
+    """
+    stat = os.stat(filename)
+    tag = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if tag in _digests:
+            return _digests[tag]
+
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    with _digests_lock:
+        _digests[tag] = digest
+    return digest
+
+
+def resolve_reference(value, dirname=""):
+    """
+    Return the path of a reference file named in a header, or `None`.
+
+    Parameters
+    ----------
+    value : str
+        Header value, such as ``"iref$w3m18525i_bpx.fits"``.
+
+    dirname : str, optional
+        Directory of the input file, used for reference file names without an
+        environment variable prefix.
+
+    Returns
+    -------
+    path : str or None
+        Path of the reference file, or `None` if ``value`` does not name one
+        (e.g. ``"N/A"``).
+    """
+    value = str(value).strip()
+    if "$" in value:
+        var, name = value.split("$", 1)
+        directory = os.environ.get(var)
+        if directory is None:
+            raise KeyError(f"Environment variable {var} for reference file {value} is not set")
+        return os.path.join(directory, name)
+    if value.lower().endswith((".fits", ".fits.gz")):
+        return os.path.join(dirname, value)
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def executable_version(executable="calwf3.e"):
+    """Return the output of ``<executable> --version``."""
+    proc = subprocess.run([executable, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+    return proc.stdout.decode("utf8", errors="replace").strip()
+
+
+def _switch_header(input):
+    """Return the primary header calwf3 takes its switches from."""
+    files = staged_inputs(input)
+    if input.lower().endswith("_asn.fits") and len(files) > 1:
+        # the first member listed in the association table
+        raws = [f for f in files[1:] if f.endswith("_raw.fits")]
+        if raws:
+            return fits.getheader(raws[0])
+    return fits.getheader(input)
+
+
+def calibration_key(input, options=None, executable="calwf3.e"):
+    """
+    Compute the cache key for calibrating ``input``.
+
+    Parameters
+    ----------
+    input : str
+        Raw, intermediate, or association file.
+
+    options : dict, optional
+        Options of the run that change its products.
+
+    executable : str, optional
+        Executable whose version is part of the key. Default is ``calwf3.e``.
+
+    Returns
+    -------
+    key : str
+        SHA-256 hex digest identifying the run. Reference files under an
+        unset environment variable enter the key by name only.
+    """
+    dirname = os.path.dirname(input)
+    header = _switch_header(input)
+
+    switches = {}
+    references = {}
+    for card in header.cards:
+        key, value = card.keyword, card.value
+        if not isinstance(value, str):
+            continue
+        if key.endswith("CORR"):
+            switches[key] = value.strip()
+            continue
+        try:
+            path = resolve_reference(value, dirname)
+        except KeyError:
+            # under an unset environment variable, as for a step that is switched off: keep the name
+            references[key] = [value.strip(), None]
+            continue
+        if path is not None and os.path.isfile(path):
+            references[key] = [value.strip(), file_digest(path)]
+
+    description = {
+        "inputs": [[os.path.basename(f), file_digest(f)] for f in staged_inputs(input)],
+        "switches": switches,
+        "references": references,
+        "version": executable_version(executable),
+        "options": options or {},
+    }
+    blob = json.dumps(description, sort_keys=True).encode("utf8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+class ResultCache:
+    """
+    A size-bounded, least-recently-used store of calibration products.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the cache; created if needed. Several processes may
+        share it.
+
+    max_bytes : int or float, optional
+        Size above which the least recently used entries are removed. Default
+        is `None`, no limit.
+    """
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, input, options=None):
+        """Return the cache key for calibrating ``input``, see `calibration_key`."""
+        return calibration_key(input, options=options)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _manifest(self, key):
+        """Return the manifest of entry ``key``, or `None` if there is none."""
+        try:
+            with open(os.path.join(self._entry(key), self.manifest_name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __contains__(self, key):
+        return self._manifest(key) is not None
+
+    def restore(self, key, dest_dir):
+        """
+        Put the products of entry ``key`` into ``dest_dir``.
+
+        Products already in ``dest_dir`` with the cached contents are left in
+        place; others are copied from the cache.
+
+        Returns
+        -------
+        outputs : list of str or None
+            Sorted paths of the products, or `None` if ``key`` is not cached.
+        """
+        manifest = self._manifest(key)
+        if manifest is None:
+            return None
+        entry = self._entry(key)
+
+        outputs = []
+        for name, digest in manifest["files"].items():
+            dest = os.path.join(dest_dir, name)
+            if not (os.path.isfile(dest) and file_digest(dest) == digest):
+                fd, tmp = tempfile.mkstemp(dir=dest_dir, prefix="." + name, suffix=".part")
+                os.close(fd)
+                try:
+                    shutil.copy2(os.path.join(entry, name), tmp)
+                except OSError:
+                    # removed by a concurrent eviction
+                    os.remove(tmp)
+                    return None
+                os.replace(tmp, dest)
+            outputs.append(dest)
+
+        # mark as recently used
+        os.utime(os.path.join(entry, self.manifest_name))
+        return sorted(outputs)
+
+    def store(self, key, files):
+        """Add ``files`` to the cache as the products of entry ``key``."""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".tmp-")
+        try:
+            manifest = {"files": {}, "created": time.time()}
+            for filename in files:
+                name = os.path.basename(filename)
+                shutil.copy2(filename, os.path.join(tmp, name))
+                manifest["files"][name] = file_digest(filename)
+            with open(os.path.join(tmp, self.manifest_name), "w") as f:
+                json.dump(manifest, f)
+            os.rename(tmp, entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        self.evict()
+
+    def entries(self):
+        """Return ``(last_used, size, key)`` for every entry."""
+        entries = []
+        for prefix in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(subdir):
+                continue
+            for key in os.listdir(subdir):
+                entry = os.path.join(subdir, key)
+                if key.startswith(".") or not os.path.isdir(entry):
+                    continue
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry, self.manifest_name))
+                    size = sum(e.stat().st_size for e in os.scandir(entry))
+                except OSError:
+                    continue
+                entries.append((last_used, size, key))
+        return entries
+
+    def size(self):
+        """Return the total size of the cached products in bytes."""
+        return sum(size for last_used, size, key in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits ``max_bytes``."""
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for last_used, size, key in entries)
+        for last_used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+
+def cached_run(cache, input, run, options=None, executable="calwf3.e"):
+    """
+    Run a calibration through a `ResultCache`.
+
+    Parameters
+    ----------
+    cache : `ResultCache` or str
+        The cache, or the directory of an unbounded cache.
+
+    input : str
+        The file to calibrate.
+
+    run : func
+        Called with no arguments to run the calibration on a cache miss; must
+        return a `~wfc3tools.runner.RunResult`.
+
+    options, executable
+        As for `calibration_key`.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        The result of ``run``, or on a cache hit a result with
+        ``cached=True`` listing the restored products.
+    """
+    if not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
+
+    key = calibration_key(input, options=options, executable=executable)
+    t0 = time.monotonic()
+    outputs = cache.restore(key, os.path.dirname(os.path.abspath(input)))
+    if outputs is not None:
+        return RunResult(input=input, command=[], returncode=0, outputs=outputs, wall_time=time.monotonic() - t0, cached=True)
+
+    result = run()
+    if result.ok:
+        cache.store(key, result.outputs)
+    return result
+
+
+def _names_file(value):
+    """Return `True` if a header value looks like a file name."""
+    value = value.strip().lower()
+    return "$" in value or value.endswith((".fits", ".fits.gz"))
+
+
+def _affects_cte(card):
+    """Return `True` if a header card may change the CTE-corrected image."""
+    key = card.keyword
+    if key in ("", "HISTORY", "COMMENT"):
+        return False
+    if key.endswith("CORR"):
+        return key == "PCTECORR"
+    if key in CTE_REFERENCES:
+        return True
+    return not (isinstance(card.value, str) and _names_file(card.value))
+
+
+def cte_key(raw_file, executable="wf3cte.e"):
+    """
+    Compute the `CTECache` key for the CTE correction of ``raw_file``.
+
+    The key covers the pixel data, the header keywords except the switches
+    and reference files of the other calibration steps, the names and
+    contents of the CTE reference files, and the version of ``executable``.
+
+    Parameters
+    ----------
+    raw_file : str
+        UVIS raw file.
+
+    executable : str, optional
+        Executable whose version is part of the key. Default is ``wf3cte.e``.
+
+    Returns
+    -------
+    key : str
+        SHA-256 hex digest.
+    """
+    dirname = os.path.dirname(raw_file)
+    sha = hashlib.sha256()
+    with fits.open(raw_file, do_not_scale_image_data=True) as hdulist:
+        for hdu in hdulist:
+            for card in hdu.header.cards:
+                if _affects_cte(card):
+                    sha.update(card.image.encode("ascii", errors="replace"))
+            if hdu.data is not None:
+                sha.update(np.ascontiguousarray(hdu.data).tobytes())
+        header = hdulist[0].header
+
+    for key in CTE_REFERENCES:
+        try:
+            path = resolve_reference(header.get(key, ""), dirname)
+        except KeyError:
+            # under an unset environment variable: the name is already part of the key
+            continue
+        if path is not None and os.path.isfile(path):
+            sha.update(file_digest(path).encode("ascii"))
+    sha.update(executable_version(executable).encode("utf8"))
+    return sha.hexdigest()
+
+
+def rac_name(raw_file):
+    """Return the name of the CTE-corrected intermediate of ``raw_file``."""
+    dirname = os.path.dirname(raw_file)
+    root = os.path.basename(raw_file).split("_")[0]
+    return os.path.join(dirname, f"{root}_rac_tmp.fits")
+
+
+class CTECache(ResultCache):
+    """
+    A size-bounded, least-recently-used store of CTE-corrected intermediates.
+
+    Entries hold the ``_rac_tmp.fits`` file written by ``wf3cte.e`` (or by
+    ``calwf3.e`` with ``save_tmp=True``), keyed by `cte_key`.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the cache; created if needed.
+
+    max_bytes : int or float, optional
+        Size above which the least recently used entries are removed. Default
+        is `None`, no limit.
+    """
+
+    def key(self, input, options=None):
+        """Return the cache key for the CTE correction of ``input``, see `cte_key`."""
+        return cte_key(input)
+
+
+def cte_cached_run(cache, infiles, run):
+    """
+    Run the CTE correction of ``infiles`` through a `CTECache`.
+
+    Parameters
+    ----------
+    cache : `CTECache` or str
+        The cache, or the directory of an unbounded cache.
+
+    infiles : list of str
+        UVIS raw files to correct.
+
+    run : func
+        Called with the list of files not found in the cache, to correct
+        them; must return a `~wfc3tools.runner.RunResult`.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        The result of ``run``, listing the restored intermediates among its
+        outputs, or with ``cached=True`` if all of them were restored.
+    """
+    if not isinstance(cache, CTECache):
+        cache = CTECache(cache)
+
+    t0 = time.monotonic()
+    keys = {}
+    restored = []
+    for raw_file in infiles:
+        keys[raw_file] = cache.key(raw_file)
+        outputs = cache.restore(keys[raw_file], os.path.dirname(os.path.abspath(raw_file)))
+        if outputs is not None:
+            restored += outputs
+
+    missing = [raw_file for raw_file in infiles if os.path.abspath(rac_name(raw_file)) not in restored]
+    if not missing:
+        return RunResult(
+            input=infiles[0] if len(infiles) == 1 else None,
+            command=[],
+            returncode=0,
+            outputs=sorted(restored),
+            wall_time=time.monotonic() - t0,
+            cached=True,
+        )
+
+    result = run(missing)
+    if result.ok:
+        for raw_file in missing:
+            if os.path.isfile(rac_name(raw_file)):
+                cache.store(keys[raw_file], [rac_name(raw_file)])
+    result.outputs = sorted(set(result.outputs) | set(restored))
+    return result
@@ -25,18 +25,36 @@ Running calwf3:
 
 # STDLIB
 import os.path
-import subprocess
+import time
 
-# STSCI
-from stsci.tools import parseinput
+# THIRD-PARTY
+from astropy.io import fits
 
-from .util import error_code
+from .cache import CTECache, cached_run, rac_name
+from .inputs import expand_inputs, member_files
+from .openmp import omp_environ
+from .runner import RunResult, run_executable
+from .staging import run_staged
+from .wf3ccd import _wf3ccd_call_list
+from .wf32d import _wf32d_call_list
 
 __all__ = ["calwf3"]
 
 
 def calwf3(
-    input=None, printtime=False, save_tmp=False, verbose=False, debug=False, parallel=True, version=False, log_func=print
+    input=None,
+    printtime=False,
+    save_tmp=False,
+    verbose=False,
+    debug=False,
+    parallel=True,
+    version=False,
+    log_func=print,
+    nthreads=None,
+    scratch_root=None,
+    products=None,
+    cache=None,
+    cte_cache=None,
 ):
     """
     Run the calwf3.e executable as from the shell.
@@ -71,9 +89,53 @@ def calwf3(
         filename should be provided. If a filename is provided, it will
         be ignored.
 
-    log_func : func(), default=print()
+    log_func : func(), file, str, or LogCapture, default=print()
         If not specified, the print function is used for logging to facilitate
-        use in the Jupyter notebook.
+        use in the Jupyter notebook. For long runs, an open file, a file name,
+        or a `~wfc3tools.runner.LogCapture` takes the output with no Python
+        call per line. If None, the output is discarded.
+
+    nthreads : int, default=None
+        Number of OpenMP threads for the UVIS CTE correction when ``parallel``
+        is True. If None, the OpenMP default of one thread per CPU is used.
+        Set this when running several calwf3 processes at once, see
+        `wfc3tools.openmp`.
+
+    scratch_root : str, default=None
+        If given, the input and its companion files are staged into a new
+        directory under ``scratch_root`` (e.g. ``/dev/shm``), calwf3.e runs
+        there, and the products are moved back next to the input. See
+        `wfc3tools.staging`.
+
+    products : list of str, default=None
+        With ``scratch_root``, the product suffixes to move back, e.g.
+        ``["flt", "flc", "tra"]``. If None, everything calwf3.e wrote is
+        moved back.
+
+    cache : `~wfc3tools.cache.ResultCache` or str, default=None
+        If given, a run whose input, switches, reference files, calwf3
+        version and options (including those that only change the trailer)
+        are unchanged since a cached run is skipped, and
+        its products are restored from the cache. See `wfc3tools.cache`.
+
+    cte_cache : `~wfc3tools.cache.CTECache` or str, default=None
+        If given and the input is a single UVIS raw file with PCTECORR set to
+        PERFORM, the CTE-corrected intermediate (``_rac_tmp.fits``) is taken
+        from the cache when its pixels, CTE reference files and CTE code are
+        unchanged, and only wf3ccd and wf32d are run to make the flt and flc
+        files. Otherwise calwf3.e runs in full and its intermediate is added
+        to the cache. The flt and flc files of a cache hit match those of a
+        full run, apart from their HISTORY and processing keywords; the
+        trailer only records the wf3ccd and wf32d runs. Not used with
+        ``scratch_root``.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        Summary of the run: command line, return code, wall and CPU time,
+        peak memory, and the products written. A return code that is not
+        one of the known error codes (`~wfc3tools.util.error_code`) does
+        not raise, so check ``result.returncode``.
 
     Outputs
     -------
@@ -121,6 +183,10 @@ def calwf3(
     >>> for fits in glob('j*_raw.fits'):
     >>>     calwf3(fits)
 
+    >>> # Or let calwf3_batch run several of them concurrently:
+    >>> from wfc3tools import calwf3_batch
+    >>> results = calwf3_batch('j*_raw.fits', max_workers=8)
+
     >>> # Just query for the version of the pipeline
     >>> from wfc3tools import calwf3
     >>> calwf3(version=True)
@@ -141,8 +207,52 @@ def calwf3(
 
     """
 
+    call_list = _calwf3_call_list(
+        input=input,
+        printtime=printtime,
+        save_tmp=save_tmp,
+        verbose=verbose,
+        debug=debug,
+        parallel=parallel,
+        version=version,
+    )
+
+    env = omp_environ(nthreads) if nthreads else None
+
+    def run():
+        if scratch_root is not None and not version:
+            return run_staged(call_list, input, scratch_root=scratch_root, products=products, log_func=log_func, env=env)
+        if cte_cache is not None and not version and _uses_cte(input):
+            return _run_with_cte_cache(
+                cte_cache,
+                call_list,
+                input,
+                save_tmp=save_tmp,
+                verbose=verbose or printtime,
+                debug=debug,
+                log_func=log_func,
+                env=env,
+            )
+        return run_executable(call_list, input=None if version else input, log_func=log_func, env=env)
+
+    if cache is not None and not version:
+        # the flags that change the products, trailer included
+        options = {"save_tmp": save_tmp, "printtime": printtime, "verbose": verbose, "debug": debug, "products": products}
+        result = cached_run(cache, input, run, options=options)
+    else:
+        result = run()
+
+    # only known error codes raise; an unknown return code is left to the caller in the result
+    ec = result.error
+    if ec:
+        raise RuntimeError("calwf3.e exited with code {}".format(ec))
+
+    return result
+
+
+def _calwf3_call_list(input=None, printtime=False, save_tmp=False, verbose=False, debug=False, parallel=True, version=False):
+    """Validate the calwf3 input and build the ``calwf3.e`` command line."""
     call_list = ["calwf3.e"]
-    return_code = None
 
     if printtime:
         call_list.append("-t")
@@ -162,33 +272,92 @@ def calwf3(
     if not parallel:
         call_list.append("-1")
 
-    infiles, dummy = parseinput.parseinput(input)
-    if (len(parseinput.irafglob(input)) == 0) and not version:
+    found = expand_inputs(input)
+    if (len(found) == 0) and not version:
         raise IOError("No valid image specified")
-    if len(parseinput.irafglob(input)) > 1:
-        raise IOError("calwf3 can only accept 1 file forinput at a time: {0}".format(infiles))
+    if len(found) > 1:
+        raise IOError("calwf3 can only accept 1 file forinput at a time: {0}".format(found))
 
-    for image in infiles:
+    for image in member_files(found):
         if not os.path.exists(image):
             raise IOError("Input file not found: {0}".format(image))
 
     if input and not version:
         call_list.append(input)
 
-    proc = subprocess.Popen(
-        call_list,
-        stderr=subprocess.STDOUT,
-        stdout=subprocess.PIPE,
-    )
-
-    if log_func is not None:
-        for line in proc.stdout:
-            log_func(line.decode("utf8"))
-
-    return_code = proc.wait()
-    ec = error_code(return_code)
-    if ec:
-        if ec is None:
-            print("Unknown return code found!")
-            ec = return_code
-        raise RuntimeError("calwf3.e exited with code {}".format(ec))
+    return call_list
+
+
+def _uses_cte(input):
+    """Return `True` if ``input`` is a single UVIS raw file with PCTECORR=PERFORM."""
+    if not input.endswith("_raw.fits"):
+        return False
+    header = fits.getheader(input)
+    return header.get("DETECTOR") == "UVIS" and header.get("PCTECORR") == "PERFORM"
+
+
+def _run_with_cte_cache(cte_cache, call_list, input, save_tmp=False, verbose=False, debug=False, log_func=print, env=None):
+    """Run calwf3 on a UVIS raw file, reusing its CTE-corrected intermediate when cached."""
+    if not isinstance(cte_cache, CTECache):
+        cte_cache = CTECache(cte_cache)
+
+    rac = rac_name(input)
+    root = rac[: -len("_rac_tmp.fits")]
+    tmp_files = [f"{root}_{suffix}_tmp.fits" for suffix in ("blv", "blc", "rac")]
+    key = cte_cache.key(input)
+
+    if cte_cache.restore(key, os.path.dirname(os.path.abspath(input))) is None:
+        # keep the intermediate files, to add the CTE-corrected one to the cache
+        if "-s" not in call_list:
+            call_list = call_list[:1] + ["-s"] + call_list[1:]
+        result = run_executable(call_list, input=input, log_func=log_func, env=env)
+        if result.ok and os.path.isfile(rac):
+            cte_cache.store(key, [rac])
+    else:
+        # Without switches on the command line, wf3ccd.e and wf32d.e follow the
+        # header switches, as they do when called by calwf3.e.
+        ccd = dict(dqicorr=None, atodcorr=None, blevcorr=None, biascorr=None, flashcorr=None, verbose=verbose)
+        d2 = dict(dqicorr=None, darkcorr=None, flatcorr=None, shadcorr=None, photcorr=None, verbose=verbose, debug=debug)
+        steps = [
+            (_wf3ccd_call_list, input, f"{root}_blv_tmp.fits", ccd),
+            (_wf32d_call_list, f"{root}_blv_tmp.fits", f"{root}_flt.fits", d2),
+            (_wf3ccd_call_list, rac, f"{root}_blc_tmp.fits", ccd),
+            (_wf32d_call_list, f"{root}_blc_tmp.fits", f"{root}_flc.fits", d2),
+        ]
+        result = _run_steps(steps, input, log_func=log_func)
+
+    if not save_tmp:
+        for filename in tmp_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+        result.outputs = [f for f in result.outputs if os.path.exists(f)]
+    return result
+
+
+def _run_steps(steps, input, log_func=print):
+    """Run single-step executables in order, stopping at the first failure."""
+    t0 = time.monotonic()
+    combined = RunResult(input=input, command=[], returncode=0)
+    outputs = set()
+
+    for build, step_input, output, kwargs in steps:
+        # build each command line just before running it, its input is the
+        # product of the previous step
+        call_list = build(step_input, output=output, **kwargs)
+        result = run_executable(call_list, input=step_input, log_func=log_func, output=output)
+
+        combined.command = result.command
+        combined.returncode = result.returncode
+        combined.error = result.error
+        outputs.update(result.outputs)
+        if result.user_time is not None:
+            combined.user_time = (combined.user_time or 0.0) + result.user_time
+            combined.system_time = (combined.system_time or 0.0) + result.system_time
+        if result.max_rss is not None:
+            combined.max_rss = max(combined.max_rss or 0, result.max_rss)
+        if not result.ok:
+            break
+
+    combined.outputs = sorted(outputs)
+    combined.wall_time = time.monotonic() - t0
+    return combined
@@ -0,0 +1,114 @@
+"""
+Executor backends for running calibrations in other processes or on other nodes.
+
+The batch functions run their jobs through an executor, chosen with their
+``executor`` argument:
+
+- ``"thread"`` (the default): threads of the calling process, each waiting on
+  its own executable;
+- ``"process"``: a `~concurrent.futures.ProcessPoolExecutor` on this node;
+- any object with a `concurrent.futures`-style ``submit`` method, whose
+  futures have a ``result`` method, such as a ``dask.distributed.Client`` or
+  an ``mpi4py.futures.MPIPoolExecutor``, to spread the jobs over the nodes of
+  a cluster.
+
+Jobs only pass file names to the workers, and the executables read their
+inputs and write their products in place, so with a cluster backend the
+data and the reference files must be on a file system shared by all nodes,
+under the same paths.  Output must go to a file or be discarded, as a
+``log_func`` function cannot be called back in the calling process.
+
+.. code-block:: python
+
+    >>> from dask.distributed import Client
+    >>> from wfc3tools import calwf3_batch
+    >>> client = Client('scheduler.example.edu:8786')
+    >>> results = calwf3_batch('/shared/data/*_raw.fits', executor=client)
+
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .runner import run_executable
+
+__all__ = ["executor_context", "run_call_lists"]
+
+
+@contextmanager
+def executor_context(executor="thread", max_workers=None):
+    """
+    Provide an executor for ``executor``, shutting it down afterwards if created here.
+
+    Parameters
+    ----------
+    executor : str or executor
+        ``"thread"``, ``"process"``, or an executor object, which is used as
+        is and left running.
+
+    max_workers : int, optional
+        Number of workers of a thread or process pool. Default is `None`, the
+        `concurrent.futures` default.
+    """
+    if executor == "thread":
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            yield pool
+    elif executor == "process":
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            yield pool
+    elif hasattr(executor, "submit"):
+        yield executor
+    else:
+        raise ValueError("Unknown executor {0!r}, expected 'thread', 'process' or an executor".format(executor))
+
+
+def _run_job(call_list, input=None, output=None, env=None, log_func=None):
+    """Run one command line on a worker, with ``env`` added to the worker environment."""
+    if env is not None:
+        env = dict(os.environ, **env)
+    return run_executable(call_list, input=input, log_func=log_func, env=env, output=output)
+
+
+def run_call_lists(call_lists, inputs=None, outputs=None, executor="thread", max_workers=None, env=None, log_func=None):
+    """
+    Run command lines, such as built by the wrappers, through an executor.
+
+    Parameters
+    ----------
+    call_lists : list of list of str
+        The command lines, e.g. ``["wf3ir.e", "/shared/iaa012wdq_raw.fits"]``.
+
+    inputs, outputs : list of str, optional
+        Input and output file of each command line, used to find its
+        products. Default is `None`.
+
+    executor : str or executor, optional
+        Where to run the jobs, see `executor_context`. Default is
+        ``"thread"``.
+
+    max_workers : int, optional
+        Number of workers of a thread or process pool. Default is `None`.
+
+    env : dict, optional
+        Environment variables added to the environment of the workers, such
+        as ``{"OMP_NUM_THREADS": "4"}``. Default is `None`.
+
+    log_func : str, file, or None, optional
+        Where the output goes, see `~wfc3tools.runner.run_executable`. With
+        the process and cluster backends, only a file name or `None` can be
+        used. Default is `None`, which discards the output.
+
+    Returns
+    -------
+    results : list of `~wfc3tools.runner.RunResult`
+        One result per command line, in order.
+    """
+    inputs = inputs if inputs is not None else [None] * len(call_lists)
+    outputs = outputs if outputs is not None else [None] * len(call_lists)
+    with executor_context(executor, max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_run_job, call_list, input=input, output=output, env=env, log_func=log_func)
+            for call_list, input, output in zip(call_lists, inputs, outputs)
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,224 @@
+"""
+Edit header keywords in place, without rewriting the data.
+
+Changing a calibration switch or a reference file name with
+``fits.open(..., mode="update")`` reads the file and may rewrite all of it.
+`update_header` instead rewrites only the 2880-byte header blocks of one
+HDU, which is possible whenever the edited cards still fit in the blocks
+the header already has (headers are padded with blank cards to a whole
+number of blocks).  When they do not fit, the file is updated with
+`astropy.io.fits` as before.
+
+`edit_headers` applies the same change to many files in parallel and
+reports which of them could not be edited in place.
+
+.. code-block:: python
+
+    >>> from glob import glob
+    >>> from wfc3tools.headers import edit_headers
+    >>> report = edit_headers(glob('*_raw.fits'), {'CRCORR': 'OMIT', 'FLATCORR': 'OMIT'})
+    >>> report.rewritten, report.failed
+    ([], {})
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from astropy.io import fits
+
+__all__ = ["EditReport", "edit_headers", "set_header_in_place", "update_header"]
+
+BLOCK = 2880
+CARD = 80
+_END = "END".ljust(CARD)
+
+
+def _read_header(f, offset):
+    """Read the header starting at ``offset``; return its cards and its length in bytes."""
+    f.seek(offset)
+    cards = []
+    length = 0
+    while True:
+        block = f.read(BLOCK)
+        if len(block) < BLOCK:
+            raise OSError("Truncated FITS header")
+        length += BLOCK
+        text = block.decode("ascii")
+        for i in range(0, BLOCK, CARD):
+            cards.append(text[i : i + CARD])
+        if any(card == _END for card in cards[-BLOCK // CARD :]):
+            return cards, length
+
+
+def _data_size(header):
+    """Return the size in bytes of the data unit described by ``header``, with padding."""
+    naxis = header.get("NAXIS", 0)
+    if naxis == 0:
+        return 0
+    pixels = 1
+    for i in range(1, naxis + 1):
+        pixels *= header["NAXIS{0}".format(i)]
+    size = abs(header["BITPIX"]) // 8 * header.get("GCOUNT", 1) * (header.get("PCOUNT", 0) + pixels)
+    return -(-size // BLOCK) * BLOCK
+
+
+def _keyword(card):
+    return card[:8].strip()
+
+
+def set_header_in_place(filename, values, ext=0):
+    """
+    Set header keywords by rewriting only the header blocks of one HDU.
+
+    Parameters
+    ----------
+    filename : str
+        FITS file to edit.
+
+    values : dict
+        New values, keyed by keyword (of at most 8 characters). Existing
+        cards keep their comment; new cards are added at the end of the
+        header.
+
+    ext : int, optional
+        Index of the HDU to edit. Default is 0, the primary header.
+
+    Returns
+    -------
+    edited : bool
+        `True` if the file was edited; `False` if the new cards do not fit in
+        the existing header blocks, in which case the file is unchanged.
+    """
+    with open(filename, "r+b") as f:
+        offset = 0
+        for dummy in range(ext):
+            cards, length = _read_header(f, offset)
+            header = fits.Header.fromstring("".join(cards))
+            offset += length + _data_size(header)
+        cards, length = _read_header(f, offset)
+
+        end = cards.index(_END)
+        cards = cards[:end]
+        for key, value in values.items():
+            key = key.upper()
+            if len(key) > 8:
+                raise ValueError("Keyword too long for in-place editing: {0}".format(key))
+            for i, card in enumerate(cards):
+                if _keyword(card) == key:
+                    old = fits.Card.fromstring(card)
+                    new = fits.Card(key, value, old.comment).image
+                    # drop the CONTINUE cards of a long string value
+                    stop = i + 1
+                    while stop < len(cards) and _keyword(cards[stop]) == "CONTINUE":
+                        stop += 1
+                    cards[i:stop] = [new[j : j + CARD] for j in range(0, len(new), CARD)]
+                    break
+            else:
+                new = fits.Card(key, value).image
+                cards += [new[j : j + CARD] for j in range(0, len(new), CARD)]
+
+        text = "".join(cards) + _END
+        if len(text) > length:
+            return False
+        f.seek(offset)
+        f.write(text.ljust(length).encode("ascii"))
+    return True
+
+
+def update_header(filename, values, ext=0):
+    """
+    Set header keywords, in place if possible.
+
+    Parameters
+    ----------
+    filename : str
+        FITS file to edit.
+
+    values : dict
+        New values, keyed by keyword.
+
+    ext : int, optional
+        Index of the HDU to edit. Default is 0, the primary header.
+
+    Returns
+    -------
+    in_place : bool
+        `True` if only the header blocks were rewritten; `False` if the file
+        had to be updated with `astropy.io.fits`.
+    """
+    if all(len(key) <= 8 for key in values) and set_header_in_place(filename, values, ext=ext):
+        return True
+    with fits.open(filename, mode="update") as hdulist:
+        for key, value in values.items():
+            hdulist[ext].header[key] = value
+    return False
+
+
+@dataclass
+class EditReport:
+    """
+    Outcome of `edit_headers`.
+
+    Attributes
+    ----------
+    edited : list of str
+        Files whose header blocks were rewritten in place.
+    rewritten : list of str
+        Files whose new header did not fit, and were updated with
+        `astropy.io.fits` (or left alone with ``fallback=False``).
+    failed : dict
+        Error message for each file that could not be edited at all.
+    """
+
+    edited: list = field(default_factory=list)
+    rewritten: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+
+
+def edit_headers(files, values, ext=0, fallback=True, max_workers=8):
+    """
+    Set header keywords in many files, in parallel.
+
+    Parameters
+    ----------
+    files : list of str
+        FITS files to edit.
+
+    values : dict
+        New values, keyed by keyword, e.g. ``{"CRCORR": "OMIT"}``.
+
+    ext : int, optional
+        Index of the HDU to edit. Default is 0, the primary header.
+
+    fallback : bool, optional
+        Update the files that cannot be edited in place with `astropy.io.fits`.
+        Default is `True`; if `False`, those files are left unchanged.
+
+    max_workers : int, optional
+        Number of files edited at once. Default is 8.
+
+    Returns
+    -------
+    report : `EditReport`
+        The files edited in place, those that were not, and those that failed.
+    """
+
+    def edit(filename):
+        try:
+            if fallback:
+                return update_header(filename, values, ext=ext), None
+            return set_header_in_place(filename, values, ext=ext), None
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            return None, str(e) or type(e).__name__
+
+    report = EditReport()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for filename, (in_place, error) in zip(files, pool.map(edit, files)):
+            if error is not None:
+                report.failed[filename] = error
+            elif in_place:
+                report.edited.append(filename)
+            else:
+                report.rewritten.append(filename)
+    return report
@@ -0,0 +1,373 @@
+"""
+Calibrate new files as they arrive in watched directories.
+
+`IngestDaemon` watches one or more directories for raw and association
+files, with inotify on Linux or by listing the directories periodically
+elsewhere.  A file is taken as complete once it has been closed by its
+writer (inotify) or has not changed for ``settle`` seconds (polling), and its
+size is a whole number of 2880-byte FITS blocks.  With inotify, the
+directories are also listed every ``rescan_interval`` seconds, and whenever
+the kernel reports that its event queue overflowed, so that files whose
+events were dropped are still calibrated.
+
+Exposures whose ASN_TAB keyword names an association are held back until
+the association table and all its members are complete, and the association
+is then calibrated as a whole; other exposures are calibrated on their own.
+A file rewritten after it was complete is calibrated again.
+Calibrations run in a pool of at most ``max_workers`` threads, so a burst of
+arrivals is queued rather than overloading the node.
+
+.. code-block:: python
+
+    >>> from wfc3tools.ingest import IngestDaemon
+    >>> def report(input, result, exception):
+    ...     print(input, exception or result.returncode)
+    >>> daemon = IngestDaemon(['/data/incoming'], max_workers=8, on_result=report)
+    >>> daemon.run()  # until daemon.stop() is called from another thread
+
+"""
+
+import collections
+import ctypes
+import fnmatch
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from astropy.io import fits
+
+from .asn import read_association
+from .calwf3 import _calwf3_call_list
+from .runner import run_executable
+
+__all__ = ["IngestDaemon", "is_complete"]
+
+FITS_BLOCK = 2880
+
+# inotify event masks, from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+
+def is_complete(filename):
+    """Return `True` if ``filename`` has a non-zero size that is a multiple of the FITS block size."""
+    try:
+        size = os.stat(filename).st_size
+    except OSError:
+        return False
+    return size > 0 and size % FITS_BLOCK == 0
+
+
+class _Inotify:
+    """Minimal inotify binding reporting files closed after writing, or moved in."""
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+            self.watches[wd] = directory
+
+    @staticmethod
+    def available():
+        """Return `True` if inotify can be used on this system."""
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            return hasattr(ctypes.CDLL(None), "inotify_init1")
+        except OSError:
+            return False
+
+    def read(self, timeout):
+        """
+        Return the paths of the files written within ``timeout`` seconds, and
+        `True` if events were dropped because the event queue overflowed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return [], False
+        paths = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+            elif name and wd in self.watches:
+                paths.append(os.path.join(self.watches[wd], os.fsdecode(name)))
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class IngestDaemon:
+    """
+    Watch directories and calibrate the files that arrive in them.
+
+    Parameters
+    ----------
+    directories : list of str
+        Directories to watch (not recursively).
+
+    task : func, optional
+        Called with each raw or association file to calibrate, in a worker
+        thread. Default is `None`, which runs ``calwf3.e`` with its output
+        discarded and returns its `~wfc3tools.runner.RunResult`.
+
+    max_workers : int, optional
+        Maximum number of tasks running at once. Default is 4.
+
+    on_result : func, optional
+        Called as ``on_result(input, result, exception)`` after every task,
+        with the return value of the task or the exception it raised.
+        Default is `None`.
+
+    patterns : tuple of str, optional
+        File name patterns to watch. Default is ``("*_raw.fits",
+        "*_asn.fits")``.
+
+    settle : float, optional
+        When polling, seconds a file must stay unchanged to be taken as
+        complete. Default is 2.
+
+    poll_interval : float, optional
+        Seconds between directory listings when polling, and the longest
+        time between checks of the stop flag. Default is 1.
+
+    use_inotify : bool, optional
+        Use inotify (`True`) or polling (`False`). Default is `None`, which
+        uses inotify where available.
+
+    rescan_interval : float, optional
+        With inotify, seconds between listings of the directories that catch
+        files whose events were lost. Default is 60.
+
+    process_existing : bool, optional
+        Also calibrate the files already in the directories when started.
+        Default is `True`.
+    """
+
+    def __init__(
+        self,
+        directories,
+        task=None,
+        max_workers=4,
+        on_result=None,
+        patterns=("*_raw.fits", "*_asn.fits"),
+        settle=2.0,
+        poll_interval=1.0,
+        use_inotify=None,
+        rescan_interval=60.0,
+        process_existing=True,
+    ):
+        if isinstance(directories, str):
+            directories = [directories]
+        self.directories = [os.path.abspath(d) for d in directories]
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                raise IOError("Directory not found: {0}".format(directory))
+
+        self.task = task if task is not None else self._calwf3
+        self.max_workers = max_workers
+        self.on_result = on_result
+        self.patterns = patterns
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = _Inotify.available() if use_inotify is None else use_inotify
+        self.rescan_interval = rescan_interval
+        self.process_existing = process_existing
+
+        self._stop = threading.Event()
+        self._candidates = {}  # path -> (stat, time of last change, closed by writer)
+        self._listing = {}  # path -> stat, from the last directory listing
+        self._complete = {}  # path -> stat when complete; pruned of files gone or changed at every listing
+        self._waiting = set()  # association tables with members still missing
+        self._dispatched = set()  # inputs queued or running
+        self._finished = collections.deque()  # inputs done, appended by the worker threads
+
+    @staticmethod
+    def _calwf3(input):
+        return run_executable(_calwf3_call_list(input=input), input=input, log_func=None)
+
+    def stop(self):
+        """Ask `run` to return once the running tasks are done."""
+        self._stop.set()
+
+    def _matches(self, path):
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    def _scan(self):
+        """List the watched directories, and return the files new or changed since the last listing."""
+        changed = []
+        listing = {}
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not self._matches(entry.path):
+                        continue
+                    st = entry.stat()
+                    listing[entry.path] = (st.st_size, st.st_mtime_ns)
+                    if self._listing.get(entry.path) != listing[entry.path]:
+                        changed.append(entry.path)
+        self._listing = listing
+        # a file rewritten since it was complete is calibrated again
+        self._complete = {path: stat for path, stat in self._complete.items() if listing.get(path) == stat}
+        return changed
+
+    def _add_candidate(self, path, closed=False):
+        if not self._matches(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        stat = (st.st_size, st.st_mtime_ns)
+        if self._complete.get(path) == stat:
+            return
+        self._candidates[path] = (stat, time.monotonic(), closed)
+
+    def _settled(self):
+        """Return the candidates that are now complete, with their stat."""
+        now = time.monotonic()
+        settled = []
+        for path, (stat, changed_at, closed) in list(self._candidates.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._candidates[path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != stat:
+                self._candidates[path] = (current, now, False)
+                continue
+            if (closed or now - changed_at >= self.settle) and is_complete(path):
+                del self._candidates[path]
+                settled.append((path, current))
+        return settled
+
+    def _ready(self, path, stat):
+        """Return the inputs that can be calibrated now that ``path`` is complete with ``stat``."""
+        self._complete[path] = stat
+        if path.endswith("_asn.fits"):
+            self._waiting.add(path)
+        else:
+            try:
+                asn_tab = str(fits.getval(path, "ASN_TAB")).strip()
+            except (KeyError, OSError):
+                asn_tab = "NONE"
+            if asn_tab.upper() in ("", "NONE"):
+                return [path]
+            self._waiting.add(os.path.join(os.path.dirname(path), asn_tab.lower()))
+
+        inputs = []
+        for asn_file in list(self._waiting):
+            if asn_file not in self._complete:
+                continue
+            try:
+                products = read_association(asn_file)
+            except (OSError, ValueError) as e:
+                self._waiting.discard(asn_file)
+                if self.on_result is not None:
+                    self.on_result(asn_file, None, e)
+                continue
+            members = [
+                os.path.join(os.path.dirname(asn_file), member + "_raw.fits")
+                for names in products.values()
+                for member in names
+            ]
+            if all(member in self._complete for member in members):
+                self._waiting.discard(asn_file)
+                inputs.append(asn_file)
+        return inputs
+
+    def _prune_dispatched(self):
+        """Forget the inputs whose tasks are done, so that a long-running watcher does not grow."""
+        while self._finished:
+            self._dispatched.discard(self._finished.popleft())
+
+    def _run_task(self, input):
+        try:
+            try:
+                result, exception = self.task(input), None
+            except Exception as e:
+                result, exception = None, e
+            if self.on_result is not None:
+                self.on_result(input, result, exception)
+            return result
+        finally:
+            self._finished.append(input)
+
+    def run(self, duration=None):
+        """
+        Watch the directories and calibrate arriving files.
+
+        Parameters
+        ----------
+        duration : float, optional
+            Seconds after which to stop. Default is `None`, which runs until
+            `stop` is called.
+        """
+        self._stop.clear()
+        deadline = None if duration is None else time.monotonic() + duration
+        inotify = _Inotify(self.directories) if self.use_inotify else None
+
+        existing = self._scan()
+        if self.process_existing:
+            for path in existing:
+                self._add_candidate(path)
+
+        last_scan = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while not self._stop.is_set():
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break
+                    timeout = self.poll_interval if not self._candidates else min(self.poll_interval, 0.2)
+                    if inotify is not None:
+                        paths, overflow = inotify.read(timeout)
+                        for path in paths:
+                            self._add_candidate(path, closed=True)
+                        if overflow or time.monotonic() - last_scan >= self.rescan_interval:
+                            # events may have been lost: left to settle like polled files
+                            last_scan = time.monotonic()
+                            for path in self._scan():
+                                if path not in self._candidates:
+                                    self._add_candidate(path)
+                    else:
+                        self._stop.wait(timeout)
+                        for path in self._scan():
+                            self._add_candidate(path)
+
+                    for path, stat in self._settled():
+                        for input in self._ready(path, stat):
+                            if input not in self._dispatched:
+                                self._dispatched.add(input)
+                                executor.submit(self._run_task, input)
+                    self._prune_dispatched()
+            self._prune_dispatched()
+        finally:
+            if inotify is not None:
+                inotify.close()
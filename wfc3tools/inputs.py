@@ -0,0 +1,230 @@
+"""
+Resolve input file lists once, and check them before running anything.
+
+The wrappers accept single names, Python lists, comma-separated lists,
+wildcards and at-files.  `expand_inputs` resolves all of them in one pass:
+the names in each directory are listed once with `os.scandir` and kept
+until the directory changes, so wildcards and existence checks do not go
+back to the file system for every name.  On large directories over a
+network file system this avoids seconds of latency per call.
+
+`preflight` reads the primary headers of many inputs concurrently and
+checks that they are WFC3 files with the calibration switches ``calwf3.e``
+needs, reporting every invalid input at once, before any executable runs.
+
+.. code-block:: python
+
+    >>> from wfc3tools.inputs import expand_inputs, preflight
+    >>> files = expand_inputs('/data/*_raw.fits')
+    >>> headers = preflight(files)
+
+"""
+
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+from astropy.io import fits
+from stsci.tools import parseinput
+
+__all__ = ["REQUIRED_SWITCHES", "clear_listing_cache", "expand_inputs", "member_files", "preflight"]
+
+# Calibration switches calwf3.e reads from the primary header of each detector
+REQUIRED_SWITCHES = {
+    "UVIS": (
+        "DQICORR",
+        "ATODCORR",
+        "BLEVCORR",
+        "BIASCORR",
+        "FLSHCORR",
+        "CRCORR",
+        "DARKCORR",
+        "FLATCORR",
+        "SHADCORR",
+        "PHOTCORR",
+        "PCTECORR",
+    ),
+    "IR": (
+        "DQICORR",
+        "ZOFFCORR",
+        "DARKCORR",
+        "BLEVCORR",
+        "NLINCORR",
+        "CRCORR",
+        "UNITCORR",
+        "PHOTCORR",
+        "FLATCORR",
+        "ZSIGCORR",
+    ),
+}
+
+_listings = {}  # directory -> (mtime_ns, names)
+_listings_lock = threading.Lock()
+
+
+def clear_listing_cache():
+    """Forget the directory listings kept by `expand_inputs`."""
+    with _listings_lock:
+        _listings.clear()
+
+
+def _listing(directory):
+    """Return the names in ``directory``, listing it again only if it changed."""
+    directory = directory or "."
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return frozenset()
+    with _listings_lock:
+        cached = _listings.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with os.scandir(directory) as entries:
+        names = frozenset(entry.name for entry in entries)
+    if time.time_ns() - mtime > 2_000_000_000:
+        # a directory changed within the file system time resolution may change again unnoticed
+        with _listings_lock:
+            _listings[directory] = (mtime, names)
+    return names
+
+
+def _expand_item(item, found, missing):
+    """Expand one name, wildcard, or at-file."""
+    item = item.strip()
+    if not item:
+        return
+    if item.startswith("@"):
+        with open(item[1:]) as f:
+            for line in f:
+                _expand_item(line.rstrip(), found, missing)
+        return
+    if "," in item:
+        for part in item.split(","):
+            _expand_item(part, found, missing)
+        return
+
+    dirname, basename = os.path.split(item)
+    if "$" in item or glob.has_magic(dirname):
+        # IRAF-style directory variables and wildcards in directories
+        matches = parseinput.irafglob(item)
+        found += matches
+        if not matches and not glob.has_magic(item):
+            missing.append(item)
+    elif glob.has_magic(basename):
+        found += sorted(os.path.join(dirname, name) for name in _listing(dirname) if fnmatchcase(name, basename))
+    elif basename in _listing(dirname) or os.path.exists(item):
+        found.append(item)
+    else:
+        missing.append(item)
+
+
+def expand_inputs(input, missing=None):
+    """
+    Expand lists, wildcards, and at-files into a list of existing files.
+
+    This resolves input as `stsci.tools.irafglob.irafglob` does, listing
+    each directory only once.
+
+    Parameters
+    ----------
+    input : str or list of str, or None
+        The input specification.
+
+    missing : list, optional
+        If given, the plain names (not wildcards) that do not exist are
+        appended to it. Default is `None`.
+
+    Returns
+    -------
+    files : list of str
+        The existing files, in input order, with the matches of each
+        wildcard sorted.
+    """
+    found = []
+    lost = []
+    if input:
+        for item in [input] if isinstance(input, str) else input:
+            _expand_item(item, found, lost)
+    if missing is not None:
+        missing += lost
+    return found
+
+
+def member_files(files):
+    """
+    Replace the association tables in ``files`` by the files of their members.
+
+    Members are named as by `stsci.tools.parseinput.parseinput`; the other
+    files are returned as they are.
+    """
+    result = []
+    for filename in files:
+        if filename.lower().endswith("_asn.fits"):
+            result += parseinput.parseinput(filename)[0]
+        else:
+            result.append(filename)
+    return result
+
+
+def _check_header(filename):
+    """Return the primary header of ``filename`` and a list of problems with it."""
+    try:
+        header = fits.getheader(filename)
+    except (OSError, ValueError) as e:
+        return None, ["cannot read primary header ({0})".format(e)]
+
+    if filename.lower().endswith("_asn.fits"):
+        return header, []
+
+    problems = []
+    if header.get("INSTRUME", "WFC3").strip() != "WFC3":
+        problems.append("INSTRUME is {0}, not WFC3".format(header["INSTRUME"]))
+    detector = header.get("DETECTOR")
+    if detector not in REQUIRED_SWITCHES:
+        problems.append("DETECTOR is {0}, not UVIS or IR".format(detector))
+    else:
+        absent = [key for key in REQUIRED_SWITCHES[detector] if key not in header]
+        if absent:
+            problems.append("missing calibration switches {0}".format(", ".join(absent)))
+    filetype = header.get("FILETYPE")
+    if filetype is not None and filetype.strip() != "SCI":
+        problems.append("FILETYPE is {0}, not SCI".format(filetype))
+    return header, problems
+
+
+def preflight(files, max_workers=16):
+    """
+    Check the primary headers of ``files`` before calibrating them.
+
+    Every file must be readable and, except for association tables, have
+    INSTRUME = WFC3, DETECTOR = UVIS or IR, FILETYPE = SCI if present, and
+    the calibration switches in `REQUIRED_SWITCHES`.
+
+    Parameters
+    ----------
+    files : list of str
+        Files to check.
+
+    max_workers : int, optional
+        Number of headers read at once. Default is 16.
+
+    Returns
+    -------
+    headers : dict
+        Primary header of each file.
+
+    Raises
+    ------
+    IOError
+        Listing every file that failed a check, and why.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        checked = list(pool.map(_check_header, files))
+
+    errors = ["{0}: {1}".format(f, "; ".join(problems)) for f, (header, problems) in zip(files, checked) if problems]
+    if errors:
+        raise IOError("Invalid input files:\n" + "\n".join(errors))
+    return {f: header for f, (header, problems) in zip(files, checked)}
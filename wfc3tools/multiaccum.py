@@ -0,0 +1,507 @@
+"""
+Fast access to the reads of IR MultiAccum files.
+
+IR ``_raw`` and ``_ima`` files hold one imset (SCI, ERR, DQ, SAMP and TIME
+extensions) per read, up to 80 extensions in all.  Looking an extension up
+by name, as ``hdulist["SCI", i]``, scans the extensions one by one, so the
+tools that visit every read, and often several keywords of each, end up
+scanning the file NSAMP² times.  `MultiAccumIndex` reads the extension
+headers once, maps each (EXTNAME, EXTVER) to its position in the file, and
+keeps the per-read SAMPTIME and DELTATIM values as arrays.
+
+`MultiAccumCube` opens a file with memory mapping and presents each
+extension as an (nsamp, ny, nx) array, in file order (last read first).
+Indexing it reads only the selected reads and pixels: unscaled data (IMA
+files) are views of the memory-mapped file, and scaled data (RAW files) are
+read through `~astropy.io.fits.ImageHDU.section`.
+
+Even so, the ramp of one pixel is spread over NSAMP data units.  For
+repeated queries of the same file, `write_ramp_cache` writes a pixel-major
+copy of its SCI, ERR and DQ arrays, of shape (ny, nx, nsamp), to ``.npy``
+files next to it, with a small JSON file recording the size and
+modification time of the source.  `MultiAccumCube`, and so ``pstack`` and
+``pstat``, read from the cache whenever it exists and is up to date, so
+that each ramp is a single contiguous read.
+
+.. code-block:: python
+
+    >>> from wfc3tools.multiaccum import MultiAccumCube
+    >>> with MultiAccumCube('ibh719grq_ima.fits') as cube:
+    ...     cube.shape
+    ...     cube.samptime[:3]
+    ...     ramp = cube.to_counts(cube.sci[:, 25, 100])
+    (16, 1024, 1024)
+    array([100.651947,  93.470573,  86.2892  ])
+
+    >>> from wfc3tools.multiaccum import write_ramp_cache
+    >>> cache = write_ramp_cache('ibh719grq_ima.fits')
+    >>> cache.metadata_file
+    'ibh719grq_ima.ramps.json'
+
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+from astropy.io import fits
+
+__all__ = ["MultiAccumCube", "MultiAccumIndex", "RampCache", "ReadStack", "write_ramp_cache"]
+
+# Extensions copied to a ramp cache by default
+RAMP_CACHE_EXTNAMES = ("SCI", "ERR", "DQ")
+
+
+class MultiAccumIndex:
+    """
+    Index of the extensions and sample times of an open MultiAccum file.
+
+    Parameters
+    ----------
+    hdulist : `~astropy.io.fits.HDUList`
+        The open file. Only its headers are read.
+
+    Attributes
+    ----------
+    nsamp : int
+        Number of reads, including the zeroth read (NSAMP).
+    samptime : numpy.ndarray
+        Time of each read since the start of the exposure, in file order, so
+        that ``samptime[i - 1]`` is the SAMPTIME of imset ``i``.
+    deltatim : numpy.ndarray
+        Time since the previous read (DELTATIM), in file order.
+    bunit : str
+        Units of the science data (BUNIT of the first extension).
+    """
+
+    def __init__(self, hdulist):
+        self.hdulist = hdulist
+        self.positions = {}
+        for position, hdu in enumerate(hdulist):
+            if position == 0:
+                continue
+            extname = str(hdu.header.get("EXTNAME", "")).strip().upper()
+            self.positions.setdefault((extname, hdu.header.get("EXTVER", 1)), position)
+
+        self.nsamp = hdulist[0].header["NSAMP"]
+        self.bunit = hdulist[1].header.get("BUNIT", "")
+        self.samptime = np.array([self.header("SCI", i).get("SAMPTIME", 0.0) for i in range(1, self.nsamp + 1)])
+        self.deltatim = np.array([self.header("SCI", i).get("DELTATIM", 0.0) for i in range(1, self.nsamp + 1)])
+
+    @property
+    def is_rate(self):
+        """`True` if the science data are count rates (BUNIT ends with ``/S``)."""
+        return "/" in self.bunit
+
+    def position(self, extname, extver):
+        """Return the position in the file of extension (``extname``, ``extver``)."""
+        try:
+            return self.positions[(extname.upper(), extver)]
+        except KeyError:
+            raise KeyError("Extension ({0!r}, {1}) not found.".format(extname.upper(), extver)) from None
+
+    def header(self, extname, extver):
+        """Return the header of extension (``extname``, ``extver``)."""
+        return self.hdulist[self.position(extname, extver)].header
+
+    def __getitem__(self, key):
+        extname, extver = key
+        return self.hdulist[self.position(extname, extver)]
+
+    def __contains__(self, key):
+        extname, extver = key
+        return (extname.upper(), extver) in self.positions
+
+
+def _is_scaled(header):
+    return header.get("BSCALE", 1) != 1 or header.get("BZERO", 0) != 0
+
+
+class ReadStack:
+    """
+    One extension of every read of a `MultiAccumCube`, as an (nsamp, ny, nx) array.
+
+    Indexing reads only the selected reads and pixels from the file. The first
+    index selects reads, by position in the file (0 is the last read); the
+    others select pixels of each read, and may be integer arrays of the same
+    length to pick out single pixels.
+
+    Parameters
+    ----------
+    cube : `MultiAccumCube`
+        The open file.
+
+    extname : str
+        ``"SCI"``, ``"ERR"``, ``"DQ"``, ``"SAMP"`` or ``"TIME"``.
+    """
+
+    def __init__(self, cube, extname):
+        self.cube = cube
+        self.extname = extname.upper()
+
+    @property
+    def shape(self):
+        return self.cube.shape
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __len__(self):
+        return self.cube.nsamp
+
+    def _hdu(self, read):
+        return self.cube.index[self.extname, int(read) + 1]
+
+    def _read(self, read, key):
+        hdu = self._hdu(read)
+        header = hdu.header
+        if header.get("NAXIS", 0) == 0:
+            # null data array: every pixel has the value PIXVALUE
+            return np.broadcast_to(np.asarray(header.get("PIXVALUE", 0)), self.shape[1:])[key].copy()
+        if not _is_scaled(header):
+            return hdu.data[key]
+        if any(np.ndim(k) > 0 for k in key):
+            # fancy indexing: read the rows from the first to the last selected
+            rows = np.asarray(key[0])
+            first = rows.min()
+            return hdu.section[first : rows.max() + 1, :][(rows - first,) + key[1:]]
+        return hdu.section[key]
+
+    @staticmethod
+    def _split(key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        reads, pixels = key[0], key[1:]
+        return reads, pixels + (slice(None),) * (2 - len(pixels))
+
+    def _pixels_shape(self, pixels):
+        return np.broadcast_to(0, self.shape[1:])[pixels].shape
+
+    def __getitem__(self, key):
+        reads, pixels = self._split(key)
+        ramps = self.cube.ramps.get(self.extname)
+        if ramps is not None:
+            # pixel-major cache: select the pixels first, then their reads
+            values = ramps[pixels][..., reads]
+            if np.ndim(reads) == 0 and not isinstance(reads, slice):
+                return values
+            return np.moveaxis(values, -1, 0)
+        if np.ndim(reads) == 0 and not isinstance(reads, slice):
+            return self._read(range(self.cube.nsamp)[reads], pixels)
+        selected = np.arange(self.cube.nsamp)[reads]
+        if len(selected) == 0:
+            return np.empty((0,) + self._pixels_shape(pixels))
+        return np.stack([self._read(read, pixels) for read in selected])
+
+    def __setitem__(self, key, value):
+        reads, pixels = self._split(key)
+        if np.ndim(reads) == 0 and not isinstance(reads, slice):
+            self._hdu(range(self.cube.nsamp)[reads]).data[pixels] = value
+            return
+        selected = np.arange(self.cube.nsamp)[reads]
+        value = np.broadcast_to(value, (len(selected),) + self._pixels_shape(pixels))
+        for read, read_value in zip(selected, value):
+            self._hdu(read).data[pixels] = read_value
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
+class MultiAccumCube:
+    """
+    An IR MultiAccum (``_raw`` or ``_ima``) file, read by read.
+
+    Parameters
+    ----------
+    filename : str
+        The file to open.
+
+    mode : str, optional
+        ``"readonly"`` (the default) or ``"update"`` to modify the data in place.
+
+    ramp_cache : bool or str, optional
+        Read the data from the `RampCache` of the file, if it exists and is up
+        to date: `True` (the default) for a cache next to the file, or the
+        directory of the cache. Never used in update mode.
+
+    Attributes
+    ----------
+    hdulist : `~astropy.io.fits.HDUList`
+        The open file.
+    index : `MultiAccumIndex`
+        Index of its extensions.
+    ramps : dict
+        Memory-mapped (ny, nx, nsamp) arrays of the ramp cache, by EXTNAME;
+        empty if the cache is not used.
+    sci, err, dq, samp, time : `ReadStack`
+        The extensions of every read, as (nsamp, ny, nx) arrays.
+
+    Examples
+    --------
+    >>> with MultiAccumCube('ibh719grq_ima.fits') as cube:
+    ...     first_reads = cube.sci[-4:-1, 100:200, 100:200]
+    ...     ramps = cube.to_counts(cube.sci[:, [25, 40], [100, 731]])
+
+    """
+
+    def __init__(self, filename, mode="readonly", ramp_cache=True):
+        self.filename = filename
+        # memory-mapped where possible; astropy falls back to reading scaled data
+        self.hdulist = fits.open(filename, mode=mode)
+        try:
+            self.index = MultiAccumIndex(self.hdulist)
+        except BaseException:
+            self.hdulist.close()
+            raise
+        self.ramps = {}
+        if ramp_cache and mode == "readonly":
+            self.ramps = RampCache(filename, cache_dir=None if ramp_cache is True else ramp_cache).load()
+        self.sci = ReadStack(self, "SCI")
+        self.err = ReadStack(self, "ERR")
+        self.dq = ReadStack(self, "DQ")
+        self.samp = ReadStack(self, "SAMP")
+        self.time = ReadStack(self, "TIME")
+
+    def close(self):
+        """Close the file, writing any changes in update mode."""
+        self.ramps = {}
+        self.hdulist.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, extname):
+        """Return the `ReadStack` of extension ``extname``."""
+        return ReadStack(self, extname)
+
+    @property
+    def header(self):
+        """The primary header."""
+        return self.hdulist[0].header
+
+    @property
+    def nsamp(self):
+        return self.index.nsamp
+
+    @property
+    def samptime(self):
+        return self.index.samptime
+
+    @property
+    def deltatim(self):
+        return self.index.deltatim
+
+    @property
+    def bunit(self):
+        return self.index.bunit
+
+    @property
+    def is_rate(self):
+        return self.index.is_rate
+
+    @property
+    def shape(self):
+        """(nsamp, ny, nx)"""
+        header = self.index.header("SCI", 1)
+        return (self.nsamp, header["NAXIS2"], header["NAXIS1"])
+
+    def _times(self, values, reads, axis):
+        times = np.asarray(self.samptime[reads], dtype=float)
+        shape = [1] * np.ndim(values)
+        shape[axis] = times.size
+        return times.reshape(shape)
+
+    def to_counts(self, values, reads=slice(None), axis=0):
+        """
+        Convert values of the reads ``reads`` to counts, if they are count rates.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Values with one entry per selected read along ``axis``.
+        reads : slice or array of int, optional
+            The reads of ``values``. Default is all.
+        axis : int, optional
+            The read axis of ``values``. Default is 0.
+        """
+        values = np.asarray(values, dtype=float)
+        if not self.is_rate:
+            return values
+        return values * self._times(values, reads, axis)
+
+    def to_rate(self, values, reads=slice(None), axis=0):
+        """
+        Convert values of the reads ``reads`` to count rates, if they are counts.
+
+        The rate of the zeroth read, whose SAMPTIME is 0, is set to 0. The
+        parameters are those of `to_counts`.
+        """
+        values = np.asarray(values, dtype=float)
+        if self.is_rate:
+            return values
+        times = self._times(values, reads, axis)
+        return np.divide(values, times, out=np.zeros(np.broadcast(values, times).shape), where=times > 0)
+
+
+class RampCache:
+    """
+    Pixel-major copy of the reads of a MultiAccum file.
+
+    Each cached extension is an (ny, nx, nsamp) array in a ``.npy`` file,
+    with the reads in file order, so that the ramp of a pixel is contiguous.
+    A JSON metadata file records the size and modification time of the
+    source file; the cache is ignored once either changes.
+
+    Parameters
+    ----------
+    filename : str
+        The MultiAccum (``_raw`` or ``_ima``) file.
+
+    cache_dir : str, optional
+        Directory of the cache. Default is `None`, the directory of
+        ``filename``.
+
+    Attributes
+    ----------
+    metadata_file : str
+        The JSON metadata file, ``<rootname>_ima.ramps.json``; the arrays are
+        in ``<rootname>_ima.ramps.<extname>.npy``.
+    """
+
+    def __init__(self, filename, cache_dir=None):
+        self.filename = filename
+        directory = os.path.dirname(os.path.abspath(filename)) if cache_dir is None else cache_dir
+        self._prefix = os.path.join(directory, os.path.splitext(os.path.basename(filename))[0] + ".ramps")
+        self.metadata_file = self._prefix + ".json"
+
+    def array_file(self, extname):
+        """Return the ``.npy`` file of extension ``extname``."""
+        return "{0}.{1}.npy".format(self._prefix, extname.lower())
+
+    def _source(self):
+        stat = os.stat(self.filename)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def load(self):
+        """
+        Open the cached arrays.
+
+        Returns
+        -------
+        ramps : dict
+            Memory-mapped (ny, nx, nsamp) arrays by EXTNAME, or an empty dict
+            if the cache does not exist or is out of date.
+        """
+        try:
+            with open(self.metadata_file) as f:
+                metadata = json.load(f)
+            source = self._source()
+        except (OSError, ValueError):
+            return {}
+        if any(metadata.get(key) != value for key, value in source.items()):
+            return {}
+
+        ramps = {}
+        for extname in metadata["extnames"]:
+            try:
+                ramps[extname] = np.load(self.array_file(extname), mmap_mode="r")
+            except (OSError, ValueError):
+                return {}
+            if ramps[extname].shape != tuple(metadata["shape"]):
+                return {}
+        return ramps
+
+    def _write_array(self, stack, chunk_rows):
+        nsamp, ny, nx = stack.shape
+        dest = self.array_file(stack.extname)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix="." + os.path.basename(dest), suffix=".part")
+        os.close(fd)
+        try:
+            ramps = None
+            for start in range(0, ny, chunk_rows):
+                block = stack[:, start : start + chunk_rows, :]
+                if ramps is None:
+                    ramps = np.lib.format.open_memmap(tmp, mode="w+", dtype=block.dtype, shape=(ny, nx, nsamp))
+                ramps[start : start + chunk_rows] = np.moveaxis(block, 0, -1)
+            ramps.flush()
+            del ramps
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def write(self, extnames=RAMP_CACHE_EXTNAMES, chunk_rows=64):
+        """
+        Write the cache from the source file, replacing any previous one.
+
+        Parameters
+        ----------
+        extnames : list of str, optional
+            Extensions to cache. Default is SCI, ERR and DQ; extensions not
+            in the file are skipped.
+
+        chunk_rows : int, optional
+            Number of rows of every read converted at once. Default is 64.
+        """
+        # recorded before reading, so that a change during the conversion invalidates the cache
+        source = self._source()
+        self.remove()
+        with MultiAccumCube(self.filename, ramp_cache=False) as cube:
+            extnames = [extname.upper() for extname in extnames if (extname, 1) in cube.index]
+            for extname in extnames:
+                self._write_array(cube[extname], chunk_rows)
+            shape = cube.shape[1:] + cube.shape[:1]
+
+        metadata = dict(source, source=os.path.basename(self.filename), shape=shape, extnames=extnames)
+        tmp = self.metadata_file + ".part"
+        with open(tmp, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp, self.metadata_file)
+
+    def remove(self):
+        """Remove the cache, if any."""
+        try:
+            with open(self.metadata_file) as f:
+                extnames = json.load(f)["extnames"]
+            os.remove(self.metadata_file)
+        except (OSError, ValueError, KeyError):
+            return
+        for extname in extnames:
+            if os.path.exists(self.array_file(extname)):
+                os.remove(self.array_file(extname))
+
+
+def write_ramp_cache(filename, cache_dir=None, extnames=RAMP_CACHE_EXTNAMES, chunk_rows=64):
+    """
+    Write a pixel-major ramp cache of a MultiAccum file.
+
+    Parameters
+    ----------
+    filename : str
+        The MultiAccum (``_raw`` or ``_ima``) file.
+
+    cache_dir : str, optional
+        Directory of the cache. Default is `None`, the directory of
+        ``filename``, where `MultiAccumCube`, ``pstack`` and ``pstat`` find it.
+
+    extnames : list of str, optional
+        Extensions to cache. Default is SCI, ERR and DQ.
+
+    chunk_rows : int, optional
+        Number of rows of every read converted at once. Default is 64.
+
+    Returns
+    -------
+    cache : `RampCache`
+        The cache written.
+    """
+    cache = RampCache(filename, cache_dir=cache_dir)
+    cache.write(extnames=extnames, chunk_rows=chunk_rows)
+    return cache
@@ -0,0 +1,206 @@
+"""
+Share the CPUs of a node between concurrent OpenMP runs.
+
+The UVIS pixel-based CTE correction in ``wf3cte.e`` (and therefore in
+``calwf3.e``) is parallelized with OpenMP.  By default the OpenMP runtime
+starts one thread per CPU, which is ideal for a single run but oversubscribes
+the node when several runs are started at once.  The tools here split a set
+of CPUs into disjoint slots, and give each child process an environment that
+limits it to its own slot through ``OMP_NUM_THREADS`` and ``OMP_PLACES``.
+No process is pinned here (there is no ``sched_setaffinity`` call):
+``OMP_PLACES`` and ``OMP_PROC_BIND`` are hints, and thread affinity is left
+to the OpenMP runtime.
+
+.. code-block:: python
+
+    >>> from wfc3tools.openmp import calibrate_cte_threads
+    >>> best = calibrate_cte_threads("iaa012wdq_raw.fits")
+    >>> best.timings
+    {1: 212.4, 2: 109.8, 4: 58.1, 8: 34.9, 16: 24.7, 32: 21.3, 64: 20.6}
+    >>> best.threads_per_job, best.max_jobs
+    (4, 16)
+
+    >>> from wfc3tools import calwf3_batch
+    >>> results = calwf3_batch("*_raw.fits", threads_per_job=best.threads_per_job)
+
+"""
+
+import os
+import queue
+import shutil
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from .runner import run_executable
+
+__all__ = ["ThreadBudget", "ThreadCalibration", "available_cpus", "calibrate_cte_threads", "omp_environ"]
+
+
+def available_cpus():
+    """Return the sorted list of CPUs this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def omp_environ(num_threads, cpus=None, environ=None):
+    """
+    Build the environment for a child process limited to ``num_threads``.
+
+    Parameters
+    ----------
+    num_threads : int
+        Number of OpenMP threads the child may start.
+
+    cpus : list of int, optional
+        CPUs the OpenMP threads are bound to, one place per CPU. Default is
+        `None`, which leaves thread placement to the OpenMP runtime.
+
+    environ : dict, optional
+        Environment to start from. Default is `None`, which uses a copy of
+        `os.environ`.
+
+    Returns
+    -------
+    env : dict
+        The environment to pass to the child process.
+    """
+    if num_threads < 1:
+        raise ValueError("num_threads must be at least 1")
+
+    env = dict(os.environ if environ is None else environ)
+    env["OMP_NUM_THREADS"] = str(num_threads)
+    if cpus:
+        env["OMP_PLACES"] = ",".join("{%d}" % cpu for cpu in cpus)
+        env["OMP_PROC_BIND"] = "close"
+    return env
+
+
+class ThreadBudget:
+    """
+    A fixed allotment of CPUs split into disjoint slots, one per running job.
+
+    Parameters
+    ----------
+    threads_per_job : int
+        Number of CPUs, and so OpenMP threads, given to each job.
+
+    cpus : list of int, optional
+        CPUs to share. Default is `None`, which uses `available_cpus`.
+
+    Examples
+    --------
+    >>> budget = ThreadBudget(threads_per_job=4)
+    >>> with budget.slot() as env:
+    ...     run_executable(["wf3cte.e", "iaa012wdq_raw.fits"], env=env)
+
+    """
+
+    def __init__(self, threads_per_job, cpus=None):
+        cpus = available_cpus() if cpus is None else list(cpus)
+        if threads_per_job < 1:
+            raise ValueError("threads_per_job must be at least 1")
+        if threads_per_job > len(cpus):
+            raise ValueError(f"threads_per_job={threads_per_job} exceeds the {len(cpus)} available CPUs")
+
+        self.threads_per_job = threads_per_job
+        self.cpus = cpus
+        self._free = queue.Queue()
+        for i in range(len(cpus) // threads_per_job):
+            self._free.put(cpus[i * threads_per_job : (i + 1) * threads_per_job])
+        self.max_jobs = self._free.qsize()
+
+    @contextmanager
+    def slot(self):
+        """Wait for a free slot and yield the environment for a job using it."""
+        cpus = self._free.get()
+        try:
+            yield omp_environ(len(cpus), cpus)
+        finally:
+            self._free.put(cpus)
+
+
+@dataclass
+class ThreadCalibration:
+    """
+    Result of `calibrate_cte_threads`.
+
+    Attributes
+    ----------
+    timings : dict
+        Wall time of one ``wf3cte.e`` run, in seconds, keyed by thread count.
+    throughput : dict
+        Expected exposures per second for the whole CPU allotment, keyed by
+        thread count, when running as many jobs of that size as fit.
+    threads_per_job : int
+        The thread count with the best throughput.
+    max_jobs : int
+        Number of concurrent jobs that go with ``threads_per_job``.
+    """
+
+    timings: dict
+    throughput: dict
+    threads_per_job: int
+    max_jobs: int
+
+
+def calibrate_cte_threads(input, thread_counts=None, cpus=None, log_func=None):
+    """
+    Measure how ``wf3cte.e`` scales with threads and choose a jobs x threads split.
+
+    ``wf3cte.e`` is run once per thread count on a copy of ``input`` in a
+    temporary directory. The throughput of the CPU allotment is then
+    estimated, for each thread count, as the number of jobs of that size that
+    fit times the rate of one job, and the best split is returned.  Runs are
+    timed one at a time, so contention for memory bandwidth between
+    concurrent jobs is not included in the estimate.  Each run is only given
+    an ``OMP_PLACES``/``OMP_PROC_BIND`` hint for the first CPUs of ``cpus``;
+    the affinity of its threads is left to the OpenMP runtime.
+
+    Parameters
+    ----------
+    input : str
+        A UVIS raw file with PCTECORR set to PERFORM. Its reference files
+        must be reachable as for a normal run.
+
+    thread_counts : list of int, optional
+        Thread counts to try. Default is the powers of two up to the number of
+        CPUs, plus the number of CPUs itself.
+
+    cpus : list of int, optional
+        CPUs to share between the jobs. Default is `None`, which uses
+        `available_cpus`.
+
+    log_func : func, optional
+        Called with each line of ``wf3cte.e`` output. Default is `None`.
+
+    Returns
+    -------
+    calibration : `ThreadCalibration`
+        The measured timings and the recommended split.
+    """
+    cpus = available_cpus() if cpus is None else list(cpus)
+    ncpu = len(cpus)
+    if thread_counts is None:
+        thread_counts = [2**i for i in range(ncpu.bit_length()) if 2**i <= ncpu]
+        if ncpu not in thread_counts:
+            thread_counts.append(ncpu)
+
+    timings = {}
+    for nthreads in sorted(set(thread_counts)):
+        if not 1 <= nthreads <= ncpu:
+            raise ValueError(f"Thread count {nthreads} must be between 1 and {ncpu}")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            staged = os.path.join(tmpdir, os.path.basename(input))
+            shutil.copy2(input, staged)
+            result = run_executable(
+                ["wf3cte.e", staged], input=staged, log_func=log_func, env=omp_environ(nthreads, cpus[:nthreads])
+            )
+        if not result.ok:
+            raise RuntimeError("wf3cte.e exited with code {}".format(result.error or result.returncode))
+        timings[nthreads] = result.wall_time
+
+    throughput = {nthreads: (ncpu // nthreads) / wall for nthreads, wall in timings.items()}
+    best = max(throughput, key=throughput.get)
+    return ThreadCalibration(timings=timings, throughput=throughput, threads_per_job=best, max_jobs=ncpu // best)
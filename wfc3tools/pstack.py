@@ -30,6 +30,25 @@ but you can plot either counts or rate using the optional keyword ``units``.
              59.11241987,   39.01870227,   32.63157047,   16.07532735,
              33.69198196,   16.90631634,   13.54113704,    0.        ])
 
+Ramps of many pixels can be extracted at once, with one pass over the file:
+
+.. code-block:: python
+
+    >>> xdata, ydata = pstack(
+    ...     'ibh719grq_ima.fits', column=[100, 250, 731], row=[25, 40, 512])
+    >>> ydata.shape
+    (3, 16)
+
+Repeated queries of the same image are faster with a ramp cache, which
+holds the ramp of each pixel contiguously; it is used automatically once
+written, until the image changes:
+
+.. code-block:: python
+
+    >>> from wfc3tools.multiaccum import write_ramp_cache
+    >>> cache = write_ramp_cache('ibh719grq_ima.fits')
+    >>> xdata, ydata = pstack('ibh719grq_ima.fits', column=100, row=25)
+
 .. warning::
     Note that the arrays are structured in SCI order, so the final exposure is
     the first element in the array.
@@ -37,9 +56,10 @@ but you can plot either counts or rate using the optional keyword ``units``.
 """
 
 import numpy as np
-from astropy.io import fits
 from matplotlib import pyplot as plt
 
+from .multiaccum import MultiAccumCube
+
 __all__ = ["pstack"]
 
 
@@ -56,11 +76,13 @@ def pstack(filename, column=0, row=0, extname="sci", units="counts", title=None,
         file, containing all the data from multiple readouts.  You must specify
         just the file name, with no extension designation.
 
-    column : int, default=0
-        The column index of the pixel to be plotted.
+    column : int or array of int, default=0
+        The column index of the pixel to be plotted, or of each of several
+        pixels.
 
-    row : int, default=0
-        The row index of the pixel to be plotted.
+    row : int or array of int, default=0
+        The row index of the pixel to be plotted, or of each of several
+        pixels, of the same length as ``column``.
 
     extname : str, default="sci"
        Extension name (EXTNAME keyword value) of data to plot.  Allowed values
@@ -94,6 +116,9 @@ def pstack(filename, column=0, row=0, extname="sci", units="counts", title=None,
 
     yaxis : numpy.ndarray
        Array of y-axis values that will be plotted as specified by 'units'.
+       For arrays of columns and rows, an array of shape (npix, nsamp) with
+       the values of every pixel, read in a single pass over the file; the
+       plot is skipped when more than one pixel is given.
 
     Examples
     --------
@@ -110,6 +135,13 @@ def pstack(filename, column=0, row=0, extname="sci", units="counts", title=None,
                               ylabel="")
 
     """
+    multiple = np.ndim(column) > 0 or np.ndim(row) > 0
+    if multiple:
+        column, row = np.broadcast_arrays(np.asarray(column, dtype=int), np.asarray(row, dtype=int))
+        column = column.ravel()
+        row = row.ravel()
+        plot = plot and column.size == 1
+
     if plot:
         plt.ion()
 
@@ -119,35 +151,29 @@ def pstack(filename, column=0, row=0, extname="sci", units="counts", title=None,
         print("Invalid value given for extname")
         return 0, 0
 
-    with fits.open(filename) as myfile:
-        nsamp = myfile[0].header["NSAMP"]
-        bunit = myfile[1].header["BUNIT"]  # must use data header for units
-        yaxis = np.zeros(nsamp)
+    with MultiAccumCube(filename) as cube:
+        nsamp = cube.nsamp
+        bunit = cube.bunit  # must use data header for units
+        yaxis = np.zeros((column.size, nsamp) if multiple else nsamp)
+        reads = slice(0, nsamp - 1)  # all but the zeroth read
 
         # plots versus sample for TIME extension
         if "time" in extname.lower():
             xaxis = np.arange(nsamp) + 1
             time = True
+            yaxis[..., reads] = cube.samptime[reads]
         else:
             xaxis = np.zeros(nsamp)
+            xaxis[reads] = cube.samptime[reads]
 
-        for i in range(1, nsamp, 1):
-            if time:
-                yaxis[i - 1] = myfile["SCI", i].header["SAMPTIME"]
-            else:
-                # Numpy is row-major with array indices written row-first
-                # (lexicographical access order)
-                yaxis[i - 1] = myfile[extname.upper(), i].data[row, column]
-                xaxis[i - 1] = myfile["SCI", i].header["SAMPTIME"]
-
-                # convert to countrate
-                if "rate" in units.lower() and "/" not in bunit.lower():
-                    exptime = myfile["SCI", i].header["SAMPTIME"]
-                    yaxis[i - 1] /= exptime
-                # convert to counts
-                if "counts" in units.lower() and "/" in bunit.lower():
-                    exptime = myfile["SCI", i].header["SAMPTIME"]
-                    yaxis[i - 1] *= exptime
+            # Numpy is row-major with array indices written row-first
+            # (lexicographical access order); only these pixels are read
+            values = cube[extname][reads, row, column]
+            if "rate" in units.lower():
+                values = cube.to_rate(values, reads)
+            elif "counts" in units.lower():
+                values = cube.to_counts(values, reads)
+            yaxis[..., reads] = values.T
 
     if not ylabel:
         if "rate" in units.lower():
@@ -171,14 +197,14 @@ def pstack(filename, column=0, row=0, extname="sci", units="counts", title=None,
             plt.xlabel("Sample time")
 
         if not title:
-            title = "%s   Pixel stack for col=%d, row=%d" % (filename, column, row)
+            title = "%s   Pixel stack for col=%d, row=%d" % (filename, np.ravel(column)[0], np.ravel(row)[0])
         plt.title(title)
 
         if time:
             plt.xlim(np.max(xaxis), np.min(xaxis))
             plt.ylabel("Seconds")
 
-        plt.plot(xaxis, yaxis, "+")
+        plt.plot(xaxis, np.ravel(yaxis), "+")
         plt.draw()
 
     return xaxis, yaxis
@@ -8,6 +8,9 @@ the zeroth-read) are plotted. The SCI, ERR, DQ statistics are plotted as a
 function of sample time. The sample times are read from the SAMPTIME
 keyword in the SCI header for each readout.
 
+If the image has an up-to-date ramp cache, written with
+`~wfc3tools.multiaccum.write_ramp_cache`, the data are read from it.
+
 SAMP and TIME are not generally populated until the FLT image stage. To plot
 the samptime vs sample, use wfc3tools.pstat and the "time" extension.
 
@@ -54,10 +57,11 @@ used for any computation.
 """
 
 import numpy as np
-from astropy.io import fits
 from matplotlib import pyplot as plt
 from scipy.stats import mode as mode
 
+from .multiaccum import MultiAccumCube
+
 __all__ = ["pstat"]
 
 
@@ -192,14 +196,13 @@ def pstat(
         return 0, 0
 
     # open the file and get the data
-    with fits.open(imagename) as myfile:
-        nsamp = myfile[0].header["NSAMP"]
-        bunit = myfile[1].header["BUNIT"]  # must look at header for units
+    with MultiAccumCube(imagename) as cube:
+        nsamp = cube.nsamp
+        bunit = cube.bunit  # must look at header for units
         yaxis = np.zeros(nsamp)
         xaxis = np.zeros(nsamp)
 
-        xsize = myfile[1].header["NAXIS1"]  # full x size
-        ysize = myfile[1].header["NAXIS2"]  # full y size
+        ysize, xsize = cube.shape[1:]  # full size
 
         # set the start and end of the image section -- Python slicing rules apply
         if all_cols:
@@ -216,34 +219,34 @@ def pstat(
             ystart = row_slice[0]
             yend = row_slice[1]
 
-        for i in range(1, nsamp, 1):
-            if "midpt" in stat:
-                yaxis[i - 1] = np.median(myfile[extname.upper(), i].data[ystart:yend, xstart:xend])
+        # every read but the zeroth at once, one contiguous read per pixel with a ramp cache
+        reads = slice(0, nsamp - 1)
+        data = cube[extname][reads, ystart:yend, xstart:xend].reshape(nsamp - 1, -1)
 
-            if "mean" in stat:
-                yaxis[i - 1] = np.mean(myfile[extname.upper(), i].data[ystart:yend, xstart:xend])
+        if "midpt" in stat:
+            yaxis[reads] = np.median(data, axis=1)
 
-            if "mode" in stat:
-                yaxis[i - 1] = mode(myfile[extname.upper(), i].data[ystart:yend, xstart:xend], axis=None)[0]
+        if "mean" in stat:
+            yaxis[reads] = np.mean(data, axis=1)
 
-            if "min" in stat:
-                yaxis[i - 1] = np.min(myfile[extname.upper(), i].data[ystart:yend, xstart:xend])
+        if "mode" in stat:
+            yaxis[reads] = np.ravel(mode(data, axis=1)[0])
 
-            if "max" in stat:
-                yaxis[i - 1] = np.max(myfile[extname.upper(), i].data[ystart:yend, xstart:xend])
+        if "min" in stat:
+            yaxis[reads] = np.min(data, axis=1)
 
-            if "stddev" in stat:
-                yaxis[i - 1] = np.std(myfile[extname.upper(), i].data[ystart:yend, xstart:xend])
+        if "max" in stat:
+            yaxis[reads] = np.max(data, axis=1)
 
-            exptime = myfile["SCI", i].header["SAMPTIME"]
-            xaxis[i - 1] = exptime
+        if "stddev" in stat:
+            yaxis[reads] = np.std(data, axis=1)
 
-            # convert to countrate
-            if "rate" in units.lower() and "/" not in bunit.lower():
-                yaxis[i - 1] /= exptime
-            # convert to counts
-            if "counts" in units.lower() and "/" in bunit.lower():
-                yaxis[i - 1] *= exptime
+        # convert to countrate or counts
+        xaxis[reads] = cube.samptime[reads]
+        if "rate" in units.lower():
+            yaxis[reads] = cube.to_rate(yaxis[reads], reads)
+        elif "counts" in units.lower():
+            yaxis[reads] = cube.to_counts(yaxis[reads], reads)
 
     if plot:
         if not overplot:
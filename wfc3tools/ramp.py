@@ -0,0 +1,270 @@
+"""
+Fit up-the-ramp count rates of IR exposures with NumPy.
+
+Turning an IMA file into an FLT file normally takes a run of ``calwf3.e``
+(the CRCORR step of ``wf3ir``).  `fit_ima` does the equivalent in Python, so
+that an IMA edited in memory or on disk, as by
+`~wfc3tools.wfc3ir_tools.make_flattened_ramp_flt`, can be turned into
+SCI/ERR/DQ/SAMP/TIME arrays in the FLT layout without leaving the process.
+
+The count rate of every pixel is a weighted linear fit of the increments
+between successive reads, weighted by their read and Poisson noise.  Cosmic
+ray hits are found as increments that deviate from the fit by more than
+``threshold`` standard deviations, one per iteration, and are left out of
+the fit; reads flagged with any of ``bad_bits`` in their DQ array (such as
+saturation) are left out as well.  All pixels are fitted at once, a block of
+rows at a time, so that the memory used stays bounded.
+
+The fit is close to, but not the same as, the optimal weighting of
+``wf3ir``: the increments are treated as independent, which slightly
+underweights the read noise shared by adjacent increments.
+
+.. code-block:: python
+
+    >>> from wfc3tools.ramp import fit_ima
+    >>> fit_ima('ibh719grq_ima.fits', output='ibh719grq_fit_flt.fits')
+
+"""
+
+import warnings
+
+import numpy as np
+from astropy.io import fits
+
+from .multiaccum import MultiAccumCube
+
+__all__ = ["CR_FLAG", "DEFAULT_BAD_BITS", "RampFit", "fit_ima", "fit_ramps"]
+
+# DQ flag of cosmic ray hits found in the ramp, as set by calwf3
+CR_FLAG = 8192
+
+# DQ flags of reads left out of the fit: Reed-Solomon error, missing data, and saturation
+DEFAULT_BAD_BITS = 1 | 2 | 256
+
+
+class RampFit:
+    """
+    Result of fitting the ramps of a block of pixels.
+
+    Attributes
+    ----------
+    rate : ndarray
+        Count rate, in the units of the counts per second.
+    error : ndarray
+        Uncertainty of ``rate``.
+    dq : ndarray
+        Bitwise OR of the DQ flags of all reads, with `CR_FLAG` where a jump
+        was found.
+    samp : ndarray
+        Number of reads used in the fit.
+    time : ndarray
+        Exposure time covered by the increments used in the fit, in seconds.
+    """
+
+    def __init__(self, rate, error, dq, samp, time):
+        self.rate = rate
+        self.error = error
+        self.dq = dq
+        self.samp = samp
+        self.time = time
+
+
+def fit_ramps(counts, times, readnoise, dq=None, threshold=4.0, bad_bits=DEFAULT_BAD_BITS, max_jumps=None):
+    """
+    Fit the count rate of every pixel in a stack of reads.
+
+    Parameters
+    ----------
+    counts : ndarray
+        Accumulated counts of each read, of shape ``(nsamp, ...)``, with the
+        reads in increasing order of ``times``.
+    times : ndarray
+        Time of each read in seconds, of shape ``(nsamp,)``.
+    readnoise : float or ndarray
+        Noise of the difference of two reads, in the units of ``counts``;
+        an array must be broadcastable to the shape of one read.
+    dq : ndarray, optional
+        DQ array of each read, of the same shape as ``counts``. Default is
+        `None`, all reads good.
+    threshold : float, optional
+        Rejection threshold of jumps, in standard deviations. Default is 4.
+    bad_bits : int, optional
+        DQ flags of reads to leave out. Default is 259 (1 + 2 + 256).
+    max_jumps : int, optional
+        Maximum number of jumps rejected per pixel. Default is `None`, as
+        many as found while two increments remain.
+
+    Returns
+    -------
+    fit : `RampFit`
+        Arrays of the shape of one read.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    nsamp = counts.shape[0]
+    shape = counts.shape[1:]
+
+    increments = np.diff(counts, axis=0)
+    dt = np.diff(times).reshape((nsamp - 1,) + (1,) * len(shape))
+    valid = np.broadcast_to(dt > 0, increments.shape).copy()
+    if dq is not None:
+        bad = (np.asarray(dq) & bad_bits) != 0
+        valid &= ~(bad[1:] | bad[:-1])
+    rn2 = np.broadcast_to(np.asarray(readnoise, dtype=np.float64) ** 2, shape)
+
+    # start from the median rate of the good increments, robust to jumps
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # pixels without good increments
+        rate = np.nanmedian(np.where(valid, increments / np.where(dt > 0, dt, 1.0), np.nan), axis=0)
+    rate = np.nan_to_num(rate)
+    jumped = np.zeros(shape, dtype=bool)
+    max_jumps = nsamp if max_jumps is None else max_jumps
+
+    for iteration in range(max_jumps + 1):
+        variance = rn2 + np.maximum(rate, 0.0) * dt
+        weights = np.where(valid, dt / variance, 0.0)
+        norm = np.sum(weights * dt, axis=0)
+        rate = np.divide(np.sum(weights * increments, axis=0), norm, out=np.zeros(shape), where=norm > 0)
+        if iteration == max_jumps:
+            break
+
+        residuals = np.where(valid, np.abs(increments - rate * dt) / np.sqrt(variance), 0.0)
+        worst = np.argmax(residuals, axis=0)
+        worst_residual = np.take_along_axis(residuals, worst[None], axis=0)[0]
+        jump = (worst_residual > threshold) & (np.sum(valid, axis=0) > 2)
+        if not jump.any():
+            break
+        index = worst[None]
+        np.put_along_axis(valid, index, np.take_along_axis(valid, index, axis=0) & ~jump, axis=0)
+        jumped |= jump
+
+    variance = rn2 + np.maximum(rate, 0.0) * dt
+    norm = np.sum(np.where(valid, dt * dt / variance, 0.0), axis=0)
+    error = np.divide(1.0, np.sqrt(norm), out=np.zeros(shape), where=norm > 0)
+
+    used = np.sum(valid, axis=0)
+    out_dq = np.zeros(shape, dtype=np.int16)
+    if dq is not None:
+        out_dq |= np.bitwise_or.reduce(np.asarray(dq, dtype=np.int16), axis=0)
+    out_dq[jumped] |= np.int16(CR_FLAG)
+
+    return RampFit(
+        rate=rate,
+        error=error,
+        dq=out_dq,
+        samp=np.where(used > 0, used + 1, 0).astype(np.int16),
+        time=np.sum(np.where(valid, dt, 0.0), axis=0),
+    )
+
+
+def _readnoise(header):
+    """Return the noise of the difference of two reads from the READNSE[A-D] keywords, or `None`."""
+    values = [header[key] for key in ("READNSEA", "READNSEB", "READNSEC", "READNSED") if key in header]
+    # READNSE is the noise of one read
+    return np.sqrt(2.0) * float(np.mean(values)) if values else None
+
+
+def _trimmed_header(header, trim):
+    """Copy an extension header for the data trimmed by ``trim`` pixels on every side."""
+    header = header.copy()
+    for key in ("CRPIX1", "CRPIX2", "LTV1", "LTV2"):
+        if key in header:
+            header[key] -= trim
+    return header
+
+
+def fit_ima(ima_file, output=None, threshold=4.0, bad_bits=DEFAULT_BAD_BITS, readnoise=None, trim=5, chunk_rows=64):
+    """
+    Fit the ramps of an IR IMA file into FLT arrays.
+
+    Parameters
+    ----------
+    ima_file : str
+        IMA file, such as written by ``calwf3`` with CRCORR=OMIT.
+    output : str, optional
+        FLT file to write, with SCI, ERR, DQ, SAMP and TIME extensions and
+        the primary header of the IMA file. Default is `None`, nothing written.
+    threshold : float, optional
+        Rejection threshold of jumps, in standard deviations. Default is 4.
+    bad_bits : int, optional
+        DQ flags of reads to leave out. Default is 259 (1 + 2 + 256).
+    readnoise : float, optional
+        Noise of the difference of two reads, in the units of the IMA times
+        seconds. Default is `None`, sqrt(2) times the mean of the READNSE[A-D]
+        keywords (the noise of one read, in electrons) if present, or else
+        sqrt(2) times the ERR of the first read after the zeroth.
+    trim : int, optional
+        Number of reference pixels removed from every side, as in FLT files.
+        Default is 5.
+    chunk_rows : int, optional
+        Number of rows fitted at once. Default is 64, which takes about 60 MB
+        of working memory for a full-frame 16-read ramp; the memory used is
+        proportional to ``chunk_rows``.
+
+    Returns
+    -------
+    hdulist : `~astropy.io.fits.HDUList`
+        The FLT extensions, with the count rate in the units of the IMA
+        (e.g. ELECTRONS/S).
+    """
+    with MultiAccumCube(ima_file) as ima:
+        primary = ima.header
+        sci_header = ima.index.header("SCI", 1)
+        # reads are stored last first; the fit starts from the zeroth read, so that
+        # TIME covers the whole exposure
+        order = np.argsort(ima.samptime)
+        times = ima.samptime[order]
+        first = order[times > 0][:1]
+        per_second = ima.is_rate
+        if readnoise is None:
+            readnoise = _readnoise(primary)
+
+        ny, nx = sci_header["NAXIS2"], sci_header["NAXIS1"]
+        rows = slice(trim, ny - trim)
+        columns = slice(trim, nx - trim)
+        out_shape = (ny - 2 * trim, nx - 2 * trim)
+        rate = np.zeros(out_shape, dtype=np.float32)
+        error = np.zeros(out_shape, dtype=np.float32)
+        dq = np.zeros(out_shape, dtype=np.int16)
+        samp = np.zeros(out_shape, dtype=np.int16)
+        time = np.zeros(out_shape, dtype=np.float32)
+
+        for start in range(0, out_shape[0], chunk_rows):
+            block = slice(rows.start + start, min(rows.start + start + chunk_rows, rows.stop))
+
+            counts = ima.to_counts(ima.sci[order, block, columns], order)
+            read_dq = ima.dq[order, block, columns].astype(np.int16)
+            noise = readnoise
+            if noise is None:
+                noise = np.sqrt(2.0) * ima.to_counts(ima.err[first, block, columns], first)[0]
+
+            fit = fit_ramps(counts, times, noise, dq=read_dq, threshold=threshold, bad_bits=bad_bits)
+            out = slice(start, start + counts.shape[1])
+            rate[out] = fit.rate
+            error[out] = fit.error
+            dq[out] = fit.dq
+            samp[out] = fit.samp
+            time[out] = fit.time
+
+        extensions = [
+            ("SCI", rate, sci_header),
+            ("ERR", error, ima.index.header("ERR", 1)),
+            ("DQ", dq, ima.index.header("DQ", 1)),
+            ("SAMP", samp, ima.index.header("SAMP", 1)),
+            ("TIME", time, ima.index.header("TIME", 1)),
+        ]
+        hdulist = fits.HDUList([fits.PrimaryHDU(header=primary.copy())])
+        for extname, data, header in extensions:
+            header = _trimmed_header(header, trim)
+            hdulist.append(fits.ImageHDU(data, header=header, name=extname, ver=1))
+
+    if not per_second:
+        # FLT files always hold count rates
+        hdulist["SCI"].header["BUNIT"] = sci_header.get("BUNIT", "COUNTS").strip() + "/S"
+        hdulist["ERR"].header["BUNIT"] = hdulist["SCI"].header["BUNIT"]
+    hdulist[0].header["CRCORR"] = "COMPLETE"
+    hdulist[0].header["NEXTEND"] = 5
+    if output is not None:
+        hdulist[0].header["FILENAME"] = output
+        hdulist.writeto(output, overwrite=True)
+    return hdulist
@@ -0,0 +1,464 @@
+"""
+Run an HSTCAL executable and summarize the run.
+
+The Python wrappers for the calibration executables (``calwf3``, ``wf3ccd``,
+...) all launch a ``.e`` program in a subprocess and relay its output to a
+logging function.  The helpers here do that work once, and return a
+`RunResult` describing what happened instead of raising on failure, so that
+callers such as :func:`~wfc3tools.batch.calwf3_batch` can run many
+exposures and inspect every outcome afterwards.
+
+.. code-block:: python
+
+    >>> from wfc3tools.runner import run_executable
+    >>> result = run_executable(["calwf3.e", "ibh719grq_raw.fits"],
+    ...                         input="ibh719grq_raw.fits", log_func=None)
+    >>> result.returncode, result.error
+    (0, None)
+    >>> result.outputs
+    ['ibh719grq.tra', 'ibh719grq_flt.fits', 'ibh719grq_ima.fits']
+
+The output of the executable goes to ``log_func``, which can be
+
+- a function, called with each line. The output is read on a background
+  thread, so a slow function never stalls the executable;
+- an open file or a file name, to which the executable writes directly,
+  with no work done in Python;
+- a `LogCapture`, which keeps the most recent lines in memory and splits the
+  output into lines in large batches;
+- `None`, to discard the output.
+
+.. code-block:: python
+
+    >>> from wfc3tools import calwf3
+    >>> from wfc3tools.runner import LogCapture
+    >>> capture = LogCapture(max_lines=1000)
+    >>> calwf3('ibh719grq_raw.fits', verbose=True, debug=True, log_func=capture)
+    >>> capture.lines[-1]
+    'End      25-Apr-2024 13:34:20 UTC'
+    >>> calwf3('iaa012wdq_raw.fits', verbose=True, log_func='iaa012wdq.log')
+
+"""
+
+import asyncio
+import collections
+import glob
+import inspect
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from astropy.io import fits
+
+from .util import error_code
+
+__all__ = ["LogCapture", "RunResult", "find_outputs", "run_executable", "run_executable_async"]
+
+# bytes read from the output pipe at a time
+_CHUNK_SIZE = 65536
+
+# longest output line read by the asyncio runner; its default of 64 KiB is
+# short of what some debug output writes on one line
+_LINE_LIMIT = 2**24
+
+
+@dataclass
+class RunResult:
+    """
+    Summary of one run of an HSTCAL executable.
+
+    Attributes
+    ----------
+    input : str
+        Input file given to the executable, or `None`.
+    command : list of str
+        The full command line that was executed.
+    returncode : int
+        Exit status of the executable.
+    error : str or None
+        Name of the HSTCAL error matching ``returncode`` (see
+        `~wfc3tools.util.error_code`), or `None` for a successful run or an
+        unknown code.
+    outputs : list of str
+        Products written (or rewritten) next to the input during the run.
+    wall_time : float
+        Elapsed wall clock time of the run, in seconds.
+    user_time, system_time : float or None
+        CPU time spent by the executable in user and system mode, in seconds.
+    max_rss : int or None
+        Peak resident set size of the executable, in bytes.
+    cached : bool
+        `True` if the products were restored from a
+        `~wfc3tools.cache.ResultCache` and the executable was not run.
+
+    The resource usage of the executable is only available on platforms with
+    `os.wait4`, and not for `run_executable_async`; it is `None` otherwise.
+    """
+
+    input: str
+    command: list
+    returncode: int
+    error: str = None
+    outputs: list = field(default_factory=list)
+    wall_time: float = 0.0
+    user_time: float = None
+    system_time: float = None
+    max_rss: int = None
+    cached: bool = False
+
+    @property
+    def cpu_time(self):
+        """Total CPU time of the executable in seconds, or `None` if unknown."""
+        if self.user_time is None:
+            return None
+        return self.user_time + self.system_time
+
+    @property
+    def ok(self):
+        """`True` if the executable exited with status 0."""
+        return self.returncode == 0
+
+
+def _product_roots(input):
+    """Return the rootnames whose products may be written for ``input``."""
+    basename = os.path.basename(input)
+    roots = {os.path.splitext(basename)[0].split("_")[0].lower()}
+    if basename.lower().endswith("_asn.fits"):
+        try:
+            memnames = fits.getdata(input, 1)["MEMNAME"]
+        except (OSError, KeyError, IndexError):
+            return roots
+        roots.update(name.strip().lower() for name in memnames)
+    return roots
+
+
+def find_outputs(input, since, output=None):
+    """
+    List the products written next to ``input`` since a given time.
+
+    Parameters
+    ----------
+    input : str
+        Raw, intermediate, or association file that was processed.
+
+    since : float
+        Time stamp (as from `time.time`) when processing started.
+
+    output : str, optional
+        Output name given to the executable, whose rootname is searched as
+        well. Default is `None`.
+
+    Returns
+    -------
+    outputs : list of str
+        Sorted names of the files belonging to the rootname(s) of ``input``
+        that were modified at or after ``since``.
+    """
+    candidates = set()
+    for name in (input, output):
+        if not name:
+            continue
+        dirname = os.path.dirname(name)
+        for root in _product_roots(name):
+            for pattern in (f"{root}.fits", f"{root}_*.fits", f"{root}.tra"):
+                candidates.update(glob.glob(os.path.join(dirname, pattern)))
+    candidates.discard(input)
+
+    outputs = []
+    for filename in candidates:
+        try:
+            # allow for coarse file system time stamps
+            if os.path.getmtime(filename) >= since - 1.0:
+                outputs.append(filename)
+        except OSError:
+            continue
+    return sorted(outputs)
+
+
+class LogCapture:
+    """
+    Keep the output of an executable in memory, in bounded space.
+
+    Pass an instance as ``log_func`` to any of the wrappers. The output is
+    read in large chunks and split into lines in one pass per chunk, rather
+    than with a Python call per line.
+
+    Parameters
+    ----------
+    max_lines : int or None
+        Number of most recent lines kept; older lines are dropped. `None`
+        keeps every line. Default is 10000.
+
+    Attributes
+    ----------
+    lines : collections.deque of str
+        The captured lines, without line endings.
+    """
+
+    def __init__(self, max_lines=10000):
+        self.lines = collections.deque(maxlen=max_lines)
+        self._partial = b""
+
+    def feed(self, chunk):
+        """Add a chunk of raw output."""
+        data = self._partial + chunk
+        end = data.rfind(b"\n")
+        if end < 0:
+            self._partial = data
+            return
+        self._partial = data[end + 1 :]
+        self.lines.extend(data[:end].decode("utf8", errors="replace").split("\n"))
+
+    def flush(self):
+        """Add any incomplete last line."""
+        if self._partial:
+            self.lines.append(self._partial.decode("utf8", errors="replace"))
+            self._partial = b""
+
+    def text(self):
+        """Return the captured lines as one string."""
+        return "\n".join(self.lines)
+
+
+@contextmanager
+def _output_target(log_func):
+    """Yield the ``stdout`` argument for the executable, given ``log_func``."""
+    if log_func is None:
+        yield subprocess.DEVNULL
+    elif isinstance(log_func, (str, bytes, os.PathLike)):
+        with open(log_func, "ab") as f:
+            yield f
+    elif hasattr(log_func, "fileno"):
+        # anything the user wrote must go before the output of the executable
+        log_func.flush()
+        yield log_func
+    else:
+        yield subprocess.PIPE
+
+
+def _drain(stream, chunks):
+    """Read ``stream`` until it is exhausted, putting the chunks on a queue."""
+    try:
+        for chunk in iter(lambda: stream.read1(_CHUNK_SIZE), b""):
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
+
+def _relay_lines(stream, log_func):
+    """Pass the output in ``stream`` to ``log_func``, as ``Popen`` would read it."""
+    if isinstance(log_func, LogCapture):
+        for chunk in iter(lambda: stream.read1(_CHUNK_SIZE), b""):
+            log_func.feed(chunk)
+        log_func.flush()
+        return
+
+    # Drain the pipe on a separate thread so that the executable never waits
+    # on a slow log_func.
+    chunks = queue.SimpleQueue()
+    reader = threading.Thread(target=_drain, args=(stream, chunks), daemon=True)
+    reader.start()
+
+    partial = b""
+    for chunk in iter(chunks.get, None):
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            log_func((line + b"\n").decode("utf8"))
+    if partial:
+        log_func(partial.decode("utf8"))
+    reader.join()
+
+
+def _maxrss_bytes(ru_maxrss):
+    """Convert ``ru_maxrss`` to bytes; it is in kilobytes except on macOS."""
+    return ru_maxrss if sys.platform == "darwin" else ru_maxrss * 1024
+
+
+def run_executable(call_list, input=None, log_func=print, env=None, output=None, cwd=None, timeout=None):
+    """
+    Run an HSTCAL executable and wait for it to finish.
+
+    Parameters
+    ----------
+    call_list : list of str
+        Executable name followed by its command line arguments.
+
+    input : str, optional
+        The input file being processed, used to find the products of the run.
+        Default is `None`.
+
+    log_func : func, file, str, `LogCapture`, or None
+        Where the output of the executable goes: a function called with each
+        line, an open file or file name written to directly, or a
+        `LogCapture`. If `None`, the output is discarded. Default is `print`.
+
+    env : dict, optional
+        Environment of the executable, for example from
+        `~wfc3tools.openmp.omp_environ`. Default is `None`, which inherits the
+        environment of the calling process.
+
+    output : str, optional
+        Output name given to the executable, used to find the products of the
+        run. Default is `None`.
+
+    cwd : str, optional
+        Working directory of the executable. Default is `None`, the current
+        directory.
+
+    timeout : float, optional
+        Maximum run time in seconds, after which the executable is killed and
+        ``result.error`` is ``"TIMEOUT"``. Default is `None`, no limit.
+
+    Returns
+    -------
+    result : `RunResult`
+        Summary of the run, including the resource usage of the executable.
+        Failures are reported through ``result.returncode``; no exception is
+        raised for them.
+    """
+    start = time.time()
+    t0 = time.monotonic()
+
+    with _output_target(log_func) as stdout:
+        proc = subprocess.Popen(
+            call_list,
+            stderr=subprocess.STDOUT,
+            stdout=stdout,
+            env=env,
+            cwd=cwd,
+        )
+    timer = None
+    killed = threading.Event()
+    if timeout is not None:
+
+        def kill():
+            killed.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    if proc.stdout is not None:
+        with proc.stdout:
+            _relay_lines(proc.stdout, log_func)
+
+    usage = {}
+    if hasattr(os, "wait4"):
+        # reap the child ourselves to get its resource usage
+        dummy, status, rusage = os.wait4(proc.pid, 0)
+        return_code = proc.returncode = os.waitstatus_to_exitcode(status)
+        usage = dict(user_time=rusage.ru_utime, system_time=rusage.ru_stime, max_rss=_maxrss_bytes(rusage.ru_maxrss))
+    else:
+        return_code = proc.wait()
+    wall_time = time.monotonic() - t0
+
+    error = error_code(return_code) if return_code else None
+    if timer is not None:
+        timer.cancel()
+        if return_code and killed.is_set():
+            error = "TIMEOUT"
+
+    return RunResult(
+        input=input,
+        command=list(call_list),
+        returncode=return_code,
+        error=error,
+        outputs=find_outputs(input, start, output=output),
+        wall_time=wall_time,
+        **usage,
+    )
+
+
+async def _relay_output(proc, log_func):
+    """Pass the output of ``proc`` to ``log_func`` and wait for it to exit."""
+    if isinstance(log_func, LogCapture):
+        chunk = await proc.stdout.read(_CHUNK_SIZE)
+        while chunk:
+            log_func.feed(chunk)
+            chunk = await proc.stdout.read(_CHUNK_SIZE)
+        log_func.flush()
+    elif proc.stdout is not None:
+        async for line in proc.stdout:
+            ret = log_func(line.decode("utf8"))
+            if inspect.isawaitable(ret):
+                await ret
+    return await proc.wait()
+
+
+async def run_executable_async(call_list, input=None, log_func=print, env=None, timeout=None, output=None):
+    """
+    Run an HSTCAL executable without blocking the event loop.
+
+    This is the `asyncio` counterpart of `run_executable`. The executable is
+    killed if the awaiting task is cancelled or ``timeout`` expires.
+
+    Parameters
+    ----------
+    call_list : list of str
+        Executable name followed by its command line arguments.
+
+    input : str, optional
+        The input file being processed, used to find the products of the run.
+        Default is `None`.
+
+    log_func : func, coroutine function, file, str, `LogCapture`, or None
+        Where the output of the executable goes, as for `run_executable`. A
+        function may return an awaitable, which is awaited before the next
+        line is read. Default is `print`.
+
+    env : dict, optional
+        Environment of the executable. Default is `None`, which inherits the
+        environment of the calling process.
+
+    timeout : float, optional
+        Maximum run time in seconds. Default is `None`, no limit.
+
+    output : str, optional
+        Output name given to the executable, used to find the products of the
+        run. Default is `None`.
+
+    Returns
+    -------
+    result : `RunResult`
+        Summary of the run.
+
+    Raises
+    ------
+    asyncio.TimeoutError
+        If the run took longer than ``timeout``.
+    """
+    start = time.time()
+    t0 = time.monotonic()
+
+    with _output_target(log_func) as stdout:
+        proc = await asyncio.create_subprocess_exec(
+            *call_list,
+            stderr=subprocess.STDOUT,
+            stdout=stdout,
+            env=env,
+            limit=_LINE_LIMIT,
+        )
+    try:
+        return_code = await asyncio.wait_for(_relay_output(proc, log_func), timeout)
+    except BaseException:
+        # cancelled or timed out: do not leave the executable running
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    wall_time = time.monotonic() - t0
+
+    return RunResult(
+        input=input,
+        command=list(call_list),
+        returncode=return_code,
+        error=error_code(return_code) if return_code else None,
+        outputs=find_outputs(input, start, output=output),
+        wall_time=wall_time,
+    )
@@ -74,9 +74,10 @@ Include median:
 """
 
 import numpy as np
-from astropy.io import fits
 from stsci.tools import parseinput
 
+from .multiaccum import MultiAccumCube
+
 __all__ = ["sampinfo"]
 
 
@@ -140,48 +141,53 @@ def sampinfo(imagelist, add_keys=None, mean=False, median=False):
             ir_list += ["DATAMIN", "DATAMAX"]
 
     for image in imlist[0]:
-        current = fits.open(image)
-        header0 = current[0].header
-        nextend = header0["NEXTEND"]
         try:
-            nsamp = header0["NSAMP"]
+            current = MultiAccumCube(image)
         except KeyError as e:
             print(str(e))
             print("Task good for IR data only")
             break
-        exptime = header0["EXPTIME"]
-        samp_seq = header0["SAMP_SEQ"]
-
-        print("IMAGE\t\t\tNEXTEND\tSAMP_SEQ\tNSAMP\tEXPTIME")
-        print("%s\t%d\t%s\t\t%d\t%f\n" % (image, nextend, samp_seq, nsamp, exptime))
-        printline = "IMSET\tSAMPNUM"
-
-        for key in ir_list:
-            printline += "\t" + key
-        print(printline)
-
-        # loop through all the samples for the image and print stuff as we go
-        for samp in range(1, nsamp + 1, 1):
-            printline = ""
-            printline += str(samp)
-            printline += "\t" + str(nsamp - samp)
+
+        with current:
+            header0 = current.header
+            nextend = header0["NEXTEND"]
+            nsamp = current.nsamp
+            exptime = header0["EXPTIME"]
+            samp_seq = header0["SAMP_SEQ"]
+
+            print("IMAGE\t\t\tNEXTEND\tSAMP_SEQ\tNSAMP\tEXPTIME")
+            print("%s\t%d\t%s\t\t%d\t%f\n" % (image, nextend, samp_seq, nsamp, exptime))
+            printline = "IMSET\tSAMPNUM"
+
             for key in ir_list:
-                if "DATAMIN" in key:
-                    datamin = True
-                    dataminval = np.min(current["SCI", samp].data)
-                if "DATAMAX" in key:
-                    datamax = True
-                    datamaxval = np.max(current["SCI", samp].data)
-                try:
-                    printline += "\t" + str(current["SCI", samp].header[key])
-                except KeyError:
-                    try:
-                        printline += "\t" + str(current[0].header[key])
-                    except KeyError as e:
-                        printline += "\tNA"
-            if datamin and datamax:
-                printline += "\tAvgPixel: " + str((dataminval + datamaxval) / 2.0)
-            if median:
-                printline += "\tMedPixel: " + str(np.median(current["SCI", samp].data))
+                printline += "\t" + key
             print(printline)
-        current.close()
+
+            # loop through all the samples for the image and print stuff as we go,
+            # reading the data only for the statistics
+            need_data = median or "DATAMIN" in ir_list or "DATAMAX" in ir_list
+            for samp in range(1, nsamp + 1, 1):
+                sci_header = current.index.header("SCI", samp)
+                data = current.sci[samp - 1] if need_data else None
+                printline = ""
+                printline += str(samp)
+                printline += "\t" + str(nsamp - samp)
+                for key in ir_list:
+                    if "DATAMIN" in key:
+                        datamin = True
+                        dataminval = np.min(data)
+                    if "DATAMAX" in key:
+                        datamax = True
+                        datamaxval = np.max(data)
+                    try:
+                        printline += "\t" + str(sci_header[key])
+                    except KeyError:
+                        try:
+                            printline += "\t" + str(header0[key])
+                        except KeyError as e:
+                            printline += "\tNA"
+                if datamin and datamax:
+                    printline += "\tAvgPixel: " + str((dataminval + datamaxval) / 2.0)
+                if median:
+                    printline += "\tMedPixel: " + str(np.median(data))
+                print(printline)
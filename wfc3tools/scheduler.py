@@ -0,0 +1,287 @@
+"""
+Schedule a mixed batch of calibrations by their memory and CPU needs.
+
+A full-frame UVIS exposure with the pixel-based CTE correction needs
+several GB of memory and minutes of CPU time on many threads, while an IR
+subarray needs little of either.  A pool that only caps the number of jobs
+must be sized for the worst case, which wastes the node on small jobs, or
+risks running out of memory on large ones.  `calwf3_scheduled` instead
+estimates the peak memory, cores and CPU time of every job from its header
+alone (DETECTOR, image size, NEXTEND, NSAMP, PCTECORR), and starts jobs as
+long as they fit in the memory and cores of the node.  The jobs expected to
+take longest are started first; smaller jobs fill the room they leave.
+
+The estimates are deliberately rough.  They can be tuned through the
+``*_BYTES_PER_PIXEL`` and ``*_SECONDS_PER_PIXEL`` constants of this module,
+or replaced with an ``estimator`` function returning a `JobEstimate`.
+
+.. code-block:: python
+
+    >>> from wfc3tools.scheduler import calwf3_scheduled
+    >>> results = calwf3_scheduled("*_raw.fits", memory=64e9, cores=32)
+
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+
+from astropy.io import fits
+
+from .batch import _expand_inputs
+from .calwf3 import _calwf3_call_list
+from .openmp import available_cpus, omp_environ
+from .runner import RunResult, run_executable
+
+__all__ = ["JobEstimate", "available_memory", "calwf3_scheduled", "estimate_job", "run_scheduled"]
+
+# Peak memory of calwf3.e per raw pixel (all extensions), and with the CTE correction
+UVIS_BYTES_PER_PIXEL = 48
+CTE_BYTES_PER_PIXEL = 200
+# Peak memory of calwf3.e per IR pixel and sample
+IR_BYTES_PER_PIXEL = 40
+
+# CPU time per raw pixel, per CTE-corrected pixel, and per IR pixel and sample
+UVIS_SECONDS_PER_PIXEL = 1.5e-6
+CTE_SECONDS_PER_PIXEL = 4e-5
+IR_SECONDS_PER_PIXEL = 1e-6
+
+# Memory of the process itself, whatever the input
+BASE_BYTES = 100e6
+
+
+@dataclass
+class JobEstimate:
+    """
+    Expected resource needs of one job.
+
+    Attributes
+    ----------
+    input : str
+        The input file.
+    memory : float
+        Peak memory in bytes.
+    cores : int
+        Number of cores the job keeps busy.
+    cpu_seconds : float
+        CPU time in seconds, over all cores.
+    """
+
+    input: str
+    memory: float
+    cores: int = 1
+    cpu_seconds: float = 0.0
+
+    @property
+    def wall_seconds(self):
+        """Expected run time in seconds."""
+        return self.cpu_seconds / self.cores
+
+
+def available_memory():
+    """Return the memory available for new processes, in bytes."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def _first_exposure(input):
+    """Return the raw file whose header describes ``input``, and the number of exposures."""
+    if not input.lower().endswith("_asn.fits"):
+        return input, 1
+    dirname = os.path.dirname(input)
+    with fits.open(input) as asn:
+        members = [row["MEMNAME"].strip().lower() for row in asn[1].data if row["MEMTYPE"].strip().upper().startswith("EXP")]
+    for member in members:
+        raw = os.path.join(dirname, member + "_raw.fits")
+        if os.path.exists(raw):
+            return raw, len(members)
+    raise IOError("No member of {0} found".format(input))
+
+
+def estimate_job(input, cte_threads=4):
+    """
+    Estimate the resources ``calwf3.e`` needs for ``input`` from its header.
+
+    Parameters
+    ----------
+    input : str
+        Raw, intermediate, or association file.
+
+    cte_threads : int, optional
+        Number of OpenMP threads given to jobs with the CTE correction.
+        Default is 4.
+
+    Returns
+    -------
+    estimate : `JobEstimate`
+        The expected peak memory, cores and CPU time of the job. Association
+        members are calibrated one after the other, so the memory is that of
+        one member, and the CPU time that of all of them.
+    """
+    exposure, nexp = _first_exposure(input)
+    header = fits.getheader(exposure, 0)
+    sci = fits.getheader(exposure, 1)
+    pixels = sci.get("NAXIS1", 0) * sci.get("NAXIS2", 0)
+
+    if header.get("DETECTOR") == "IR":
+        pixels *= header.get("NSAMP", 1)
+        return JobEstimate(
+            input=input,
+            memory=BASE_BYTES + IR_BYTES_PER_PIXEL * pixels,
+            cpu_seconds=nexp * IR_SECONDS_PER_PIXEL * pixels,
+        )
+
+    # one SCI, ERR and DQ extension per chip; full-frame (SUBARRAY = F) UVIS has two chips
+    pixels *= max(header.get("NEXTEND", 3) // 3, 1)
+    memory = BASE_BYTES + UVIS_BYTES_PER_PIXEL * pixels
+    cpu_seconds = UVIS_SECONDS_PER_PIXEL * pixels
+    cores = 1
+    if header.get("PCTECORR") == "PERFORM":
+        memory += CTE_BYTES_PER_PIXEL * pixels
+        cpu_seconds += CTE_SECONDS_PER_PIXEL * pixels
+        cores = cte_threads
+    return JobEstimate(input=input, memory=memory, cores=cores, cpu_seconds=nexp * cpu_seconds)
+
+
+def run_scheduled(estimates, run, memory=None, cores=None):
+    """
+    Run jobs within a memory and core budget, longest expected first.
+
+    Jobs are started in order of decreasing expected run time, skipping
+    those that do not fit in the memory and cores left, which are started
+    as soon as enough of them is released. A job larger than the whole
+    budget runs alone, with its cores capped at ``cores``.
+
+    Parameters
+    ----------
+    estimates : list of `JobEstimate`
+        The jobs to run.
+
+    run : func
+        Called with the `JobEstimate` of each job, in a worker thread, with
+        ``cores`` capped at the core budget.
+
+    memory : float, optional
+        Memory budget in bytes. Default is `None`, which uses
+        `available_memory`.
+
+    cores : int, optional
+        Core budget. Default is `None`, the number of CPUs available.
+
+    Returns
+    -------
+    results : list
+        The return value of ``run`` for each job, in the order of
+        ``estimates``. A job whose ``run`` raised gets a failed
+        `~wfc3tools.runner.RunResult` (return code 2) with the exception as
+        its error, and the other jobs go on.
+    """
+    if memory is None:
+        memory = available_memory()
+    if cores is None:
+        cores = len(available_cpus())
+
+    pending = sorted(range(len(estimates)), key=lambda i: -estimates[i].wall_seconds)
+    results = [None] * len(estimates)
+    free_memory, free_cores = memory, cores
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=cores) as executor:
+        while pending or running:
+            for i in list(pending):
+                job_memory = min(estimates[i].memory, memory)
+                job_cores = min(estimates[i].cores, cores)
+                if job_memory <= free_memory and job_cores <= free_cores:
+                    pending.remove(i)
+                    free_memory -= job_memory
+                    free_cores -= job_cores
+                    job = replace(estimates[i], cores=job_cores)
+                    running[executor.submit(run, job)] = (i, job_memory, job_cores)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, job_memory, job_cores = running.pop(future)
+                free_memory += job_memory
+                free_cores += job_cores
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    # e.g. an input that vanished since it was estimated
+                    error = str(e) or type(e).__name__
+                    results[i] = RunResult(input=estimates[i].input, command=[], returncode=2, error=error)
+
+    return results
+
+
+def calwf3_scheduled(
+    inputs,
+    memory=None,
+    cores=None,
+    cte_threads=4,
+    printtime=False,
+    save_tmp=False,
+    verbose=False,
+    debug=False,
+    log_func=None,
+    estimator=None,
+):
+    """
+    Run ``calwf3.e`` on many inputs within the memory and cores of the node.
+
+    Parameters
+    ----------
+    inputs : str or list
+        Input files, as for :func:`~wfc3tools.batch.calwf3_batch`.
+
+    memory : float, optional
+        Memory budget in bytes. Default is `None`, which uses
+        `available_memory`.
+
+    cores : int, optional
+        Core budget. Default is `None`, the number of CPUs available.
+
+    cte_threads : int, optional
+        OpenMP threads (and cores) given to each run with the CTE correction;
+        other runs get one. Default is 4.
+
+    printtime, save_tmp, verbose, debug : bool, optional
+        Passed on to every run, see :func:`~wfc3tools.calwf3.calwf3`.
+
+    log_func : func, optional
+        Called with every line of output of every run. Default is `None`,
+        which discards the output.
+
+    estimator : func, optional
+        Called with each input file and ``cte_threads`` to return its
+        `JobEstimate`. Default is `None`, which uses `estimate_job`.
+
+    Returns
+    -------
+    results : list of `~wfc3tools.runner.RunResult`
+        One result per input file, in input order.
+    """
+    infiles = _expand_inputs(inputs)
+    if len(infiles) == 0:
+        raise IOError("No valid image specified")
+    if estimator is None:
+        estimator = estimate_job
+
+    call_lists = {
+        image: _calwf3_call_list(
+            input=image, printtime=printtime, save_tmp=save_tmp, verbose=verbose, debug=debug, parallel=True
+        )
+        for image in infiles
+    }
+    estimates = [estimator(image, cte_threads) for image in infiles]
+
+    def run(estimate):
+        env = omp_environ(estimate.cores)
+        return run_executable(call_lists[estimate.input], input=estimate.input, log_func=log_func, env=env)
+
+    return run_scheduled(estimates, run, memory=memory, cores=cores)
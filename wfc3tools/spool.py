@@ -0,0 +1,316 @@
+"""
+A persistent, resumable spool of calibration jobs.
+
+`JobSpool` keeps a queue of ``calwf3`` and ``wf3*`` runs in a local SQLite
+database, with the state, number of attempts, timings, error and products of
+each job.  If the driving process dies, running the spool again picks up the
+jobs that were not finished; the jobs that were running are run again.
+
+Failed runs are classified by their error (see `~wfc3tools.util.error_code`):
+transient errors such as OPEN_FAILED or a timeout are retried, with a delay
+that doubles after every attempt, while errors that another attempt cannot
+fix, such as CAL_FILE_MISSING, fail the job at once.  A ``timeout`` kills
+hung executables, so that no job holds a worker forever.
+
+.. code-block:: python
+
+    >>> from glob import glob
+    >>> from wfc3tools.spool import JobSpool
+    >>> spool = JobSpool('reprocess.db')
+    >>> for raw in glob('*_raw.fits'):
+    ...     spool.submit('calwf3', raw)
+    >>> spool.run(max_workers=16, timeout=4 * 3600)
+    >>> spool.counts()
+    {'done': 1410, 'failed': 3}
+
+"""
+
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .calwf3 import _calwf3_call_list
+from .runner import run_executable
+from .wf3ccd import _wf3ccd_call_list
+from .wf3cte import _wf3cte_call_list
+from .wf3ir import _wf3ir_call_list
+from .wf3rej import _wf3rej_call_list
+from .wf32d import _wf32d_call_list
+
+__all__ = ["JobSpool", "RETRYABLE_ERRORS", "is_retryable"]
+
+# Command line builders of the tasks a spool can run
+_TASKS = {
+    "calwf3": _calwf3_call_list,
+    "wf3cte": _wf3cte_call_list,
+    "wf3ccd": _wf3ccd_call_list,
+    "wf32d": _wf32d_call_list,
+    "wf3ir": _wf3ir_call_list,
+    "wf3rej": _wf3rej_call_list,
+}
+
+# Errors that may not happen again on another attempt
+RETRYABLE_ERRORS = frozenset(
+    [
+        "OUT_OF_MEMORY",
+        "OPEN_FAILED",
+        "ALLOCATION_PROBLEM",
+        "WRITE_FAILED",
+        "INVALID_TEMP_FILE",
+        "FILE_NOT_READABLE",
+        "COPY_NOT_POSSIBLE",
+        "TIMEOUT",
+    ]
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    input TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    returncode INTEGER,
+    error TEXT,
+    outputs TEXT,
+    wall_time REAL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    submitted REAL,
+    started REAL,
+    finished REAL,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    UNIQUE (task, input, options)
+)
+"""
+
+
+def is_retryable(result):
+    """
+    Return `True` if the failed run in ``result`` is worth trying again.
+
+    Runs killed by a signal (e.g. by the kernel when out of memory) and runs
+    that failed with one of `RETRYABLE_ERRORS` are retried.
+    """
+    if result.returncode < 0:
+        return True
+    return result.error in RETRYABLE_ERRORS
+
+
+class JobSpool:
+    """
+    A queue of calibration jobs stored in an SQLite database.
+
+    Parameters
+    ----------
+    path : str
+        The database file; created if needed.
+
+    Notes
+    -----
+    Only the process calling `run` updates the database while jobs run; the
+    executables run in worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(_SCHEMA)
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, task, input, **options):
+        """
+        Add a job to the spool, unless the same job is already in it.
+
+        Parameters
+        ----------
+        task : str
+            One of ``"calwf3"``, ``"wf3cte"``, ``"wf3ccd"``, ``"wf32d"``,
+            ``"wf3ir"`` or ``"wf3rej"``.
+
+        input : str
+            The input of the task.
+
+        **options
+            Keyword arguments of the task, such as ``save_tmp=True`` for
+            ``calwf3`` or ``output=...`` for ``wf3rej``.
+
+        Returns
+        -------
+        job_id : int
+            The id of the job.
+
+        Raises
+        ------
+        ValueError
+            If the task is unknown, or its options are not valid.
+        IOError
+            If the input does not exist.
+        """
+        if task not in _TASKS:
+            raise ValueError("Unknown task {0}, expected one of {1}".format(task, sorted(_TASKS)))
+        # checks the input and options now, rather than when the job runs
+        try:
+            _TASKS[task](input, **options)
+        except TypeError as e:
+            raise ValueError("Invalid options of task {0}: {1}".format(task, e)) from None
+        options = json.dumps(options, sort_keys=True)
+        with self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO jobs (task, input, options, submitted) VALUES (?, ?, ?, ?)",
+                (task, input, options, time.time()),
+            )
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE task = ? AND input = ? AND options = ?", (task, input, options)
+            ).fetchone()
+        return row["id"]
+
+    def jobs(self, state=None):
+        """Return the jobs, or those in ``state``, as a list of dicts."""
+        if state is None:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY id")
+        else:
+            rows = self._db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,))
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["options"] = json.loads(job["options"])
+            job["outputs"] = json.loads(job["outputs"]) if job["outputs"] else []
+            jobs.append(job)
+        return jobs
+
+    def counts(self):
+        """Return the number of jobs in each state."""
+        rows = self._db.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")
+        return {row["state"]: row["n"] for row in rows}
+
+    def reset(self, state="failed"):
+        """Put the jobs in ``state`` back in the queue, with no attempts made."""
+        with self._db:
+            self._db.execute("UPDATE jobs SET state = 'pending', attempts = 0, next_attempt = 0 WHERE state = ?", (state,))
+
+    def _claim(self, limit):
+        """Mark up to ``limit`` pending jobs that are due as running, and return them."""
+        rows = self._db.execute(
+            "SELECT * FROM jobs WHERE state = 'pending' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?",
+            (time.time(), limit),
+        ).fetchall()
+        with self._db:
+            for row in rows:
+                self._db.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, started = ? WHERE id = ?",
+                    (time.time(), row["id"]),
+                )
+        return rows
+
+    def _finish(self, row, result, error, max_attempts, backoff):
+        """Record the outcome of one attempt of a job."""
+        attempts = row["attempts"] + 1
+        if result is not None and result.ok:
+            state, next_attempt = "done", 0
+        elif result is not None and is_retryable(result) and attempts < max_attempts:
+            state, next_attempt = "pending", time.time() + backoff * 2 ** (attempts - 1)
+        else:
+            state, next_attempt = "failed", 0
+
+        values = dict(state=state, next_attempt=next_attempt, finished=time.time(), error=error)
+        if result is not None:
+            values.update(
+                returncode=result.returncode,
+                error=result.error or (None if result.ok else str(result.returncode)),
+                outputs=json.dumps(result.outputs),
+                wall_time=result.wall_time,
+                cpu_time=result.cpu_time,
+                max_rss=result.max_rss,
+            )
+        columns = ", ".join("{0} = ?".format(name) for name in values)
+        with self._db:
+            self._db.execute("UPDATE jobs SET {0} WHERE id = ?".format(columns), (*values.values(), row["id"]))
+
+    def run(self, max_workers=None, max_attempts=3, backoff=30.0, timeout=None, log_func=None):
+        """
+        Run the jobs in the spool until none is left to run.
+
+        Jobs left running by a driver that died are run again.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Maximum number of executables running at once. Default is
+            `None`, the `~concurrent.futures.ThreadPoolExecutor` default.
+
+        max_attempts : int, optional
+            Maximum number of attempts of a job with retryable errors.
+            Default is 3.
+
+        backoff : float, optional
+            Seconds to wait before the first retry of a job; the wait doubles
+            after every attempt. Default is 30.
+
+        timeout : float, optional
+            Maximum run time of one attempt in seconds, after which the
+            executable is killed. Default is `None`, no limit.
+
+        log_func : func, optional
+            Called with every line of output of every job. Default is
+            `None`, which discards the output.
+
+        Returns
+        -------
+        counts : dict
+            The number of jobs in each state, see `counts`.
+        """
+        with self._db:
+            self._db.execute("UPDATE jobs SET state = 'pending', next_attempt = 0 WHERE state = 'running'")
+
+        def run_job(row):
+            options = json.loads(row["options"])
+            call_list = _TASKS[row["task"]](row["input"], **options)
+            return run_executable(
+                call_list, input=row["input"], log_func=log_func, output=options.get("output"), timeout=timeout
+            )
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while True:
+                for row in self._claim(max_workers - len(running)):
+                    running[executor.submit(run_job, row)] = row
+
+                if not running:
+                    due = self._db.execute("SELECT MIN(next_attempt) AS due FROM jobs WHERE state = 'pending'").fetchone()[
+                        "due"
+                    ]
+                    if due is None:
+                        break
+                    time.sleep(max(due - time.time(), 0.0))
+                    continue
+
+                done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row = running.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        # invalid input or options, or a failure outside the executable:
+                        # retrying will not help
+                        result, error = None, str(e) or type(e).__name__
+                    self._finish(row, result, error, max_attempts, backoff)
+
+        return self.counts()
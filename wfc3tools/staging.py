@@ -0,0 +1,252 @@
+"""
+Run calibrations in a private scratch directory.
+
+``calwf3.e`` writes its intermediate files (``_blv_tmp``, ``_rac_tmp``,
+``_crj_tmp``, ...) and the ``.tra`` trailer next to its input.  On a shared
+network file system that I/O can dominate the run time, and concurrent runs
+on members of the same association write to the same directory.  Staging
+copies (or hard-links) the input and its companion files into a new
+directory, for example on the ``/dev/shm`` memory file system, runs the
+executable there, and moves only the final products back, each with an
+atomic rename.  The scratch directory is removed whether or not the run
+succeeds.
+
+Reference files are still read from the directories named by the ``iref``
+(and similar) environment variables, which must be absolute paths.
+
+.. code-block:: python
+
+    >>> from wfc3tools import calwf3
+    >>> calwf3('/nfs/data/iaa012wdq_raw.fits', scratch_root='/dev/shm',
+    ...        products=['flt', 'flc', 'tra'])
+
+"""
+
+import os
+import shutil
+import tempfile
+
+from astropy.io import fits
+
+from .runner import run_executable
+
+__all__ = ["ScratchDir", "default_scratch_root", "move_atomic", "run_staged", "staged_inputs"]
+
+
+def default_scratch_root():
+    """Return ``/dev/shm`` if it is usable, else `None` (the system default)."""
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        return shm
+    return None
+
+
+def staged_inputs(input):
+    """
+    List the files needed to process ``input`` in another directory.
+
+    These are ``input`` itself and the SPT files that go with it; for an
+    association table, also the RAW and SPT files of its members that are
+    present in the same directory.
+
+    Parameters
+    ----------
+    input : str
+        Raw, intermediate, or association file.
+
+    Returns
+    -------
+    files : list of str
+        Existing files, starting with ``input``.
+    """
+    dirname = os.path.dirname(input)
+    basename = os.path.basename(input)
+    roots = [basename.split("_")[0]]
+
+    if basename.lower().endswith("_asn.fits"):
+        with fits.open(input) as asn:
+            for row in asn[1].data:
+                memtype = row["MEMTYPE"].strip().upper()
+                if memtype.startswith("EXP") and ("MEMPRSNT" not in asn[1].columns.names or row["MEMPRSNT"]):
+                    roots.append(row["MEMNAME"].strip().lower())
+
+    files = [input]
+    for root in roots:
+        for suffix in ("raw", "spt"):
+            filename = os.path.join(dirname, f"{root}_{suffix}.fits")
+            if filename not in files and os.path.isfile(filename):
+                files.append(filename)
+    return files
+
+
+def move_atomic(src, dest):
+    """
+    Move ``src`` to ``dest`` so that ``dest`` never appears partly written.
+
+    The file is first moved (or copied, across file systems) to a temporary
+    name in the destination directory, and then renamed to ``dest``.
+    """
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    fd, tmp = tempfile.mkstemp(dir=dest_dir, prefix="." + os.path.basename(dest), suffix=".part")
+    os.close(fd)
+    try:
+        try:
+            os.replace(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+            os.remove(src)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _product_suffix(filename):
+    """Return the product suffix of a file name, e.g. ``"flt"`` or ``"rac_tmp"``."""
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    if ext == ".tra":
+        return "tra"
+    return stem.split("_", 1)[1] if "_" in stem else ""
+
+
+class ScratchDir:
+    """
+    A scratch directory for one job, removed when the job is done.
+
+    Parameters
+    ----------
+    root : str, optional
+        Directory in which to create the scratch directory. Default is
+        `None`, which uses the system temporary directory.
+
+    Examples
+    --------
+    >>> with ScratchDir('/dev/shm') as scratch:
+    ...     local = scratch.stage('/nfs/data/iaa012wdq_raw.fits')
+    ...     ...
+    ...     scratch.collect('/nfs/data', products=['flt'])
+
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.path = None
+        self.staged = set()
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix="wfc3tools-", dir=self.root)
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def stage(self, filename, link=True):
+        """
+        Hard-link or copy ``filename`` into the scratch directory.
+
+        Hard links are only possible on the same file system and are only
+        safe when the executable does not modify the file; otherwise, and with
+        ``link=False``, the file is copied.
+
+        Returns
+        -------
+        staged : str
+            Path of the file in the scratch directory.
+        """
+        staged = os.path.join(self.path, os.path.basename(filename))
+        if link:
+            try:
+                os.link(filename, staged)
+            except OSError:
+                shutil.copy2(filename, staged)
+        else:
+            shutil.copy2(filename, staged)
+        self.staged.add(os.path.basename(filename))
+        return staged
+
+    def collect(self, dest_dir, products=None):
+        """
+        Move the files written in the scratch directory to ``dest_dir``.
+
+        Parameters
+        ----------
+        dest_dir : str
+            Destination directory.
+
+        products : list of str, optional
+            Product suffixes to move, such as ``["flt", "flc", "tra"]``.
+            Default is `None`, which moves every file that was not staged.
+
+        Returns
+        -------
+        moved : list of str
+            Sorted destination paths of the moved files.
+        """
+        moved = []
+        for name in os.listdir(self.path):
+            if name in self.staged:
+                continue
+            if products is not None and _product_suffix(name) not in products:
+                continue
+            dest = os.path.join(dest_dir, name)
+            move_atomic(os.path.join(self.path, name), dest)
+            moved.append(dest)
+        return sorted(moved)
+
+
+def run_staged(call_list, input, scratch_root=None, products=None, log_func=print, env=None, link=True):
+    """
+    Run an executable on ``input`` inside a scratch directory.
+
+    Parameters
+    ----------
+    call_list : list of str
+        Command line, which must contain ``input`` as one of its arguments.
+
+    input : str
+        The file to process; it and its companion files (see
+        `staged_inputs`) are staged.
+
+    scratch_root : str, optional
+        Where to create the scratch directory. Default is `None`, which uses
+        `default_scratch_root`.
+
+    products : list of str, optional
+        Product suffixes to move back next to ``input``. Default is `None`,
+        which moves back everything the executable wrote. The trailer file is
+        moved back on failure regardless, to help diagnose the problem.
+
+    log_func, env
+        As for `~wfc3tools.runner.run_executable`.
+
+    link : bool, optional
+        Hard-link inputs into the scratch directory when possible, instead of
+        copying them. Default is `True`.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        Summary of the run, with ``outputs`` listing the files moved back.
+    """
+    if scratch_root is None:
+        scratch_root = default_scratch_root()
+    dest_dir = os.path.dirname(os.path.abspath(input))
+
+    with ScratchDir(scratch_root) as scratch:
+        for filename in staged_inputs(input):
+            scratch.stage(filename, link=link)
+
+        local_input = os.path.basename(input)
+        local_call = [local_input if arg == input else arg for arg in call_list]
+        result = run_executable(
+            local_call, input=os.path.join(scratch.path, local_input), log_func=log_func, env=env, cwd=scratch.path
+        )
+
+        if result.ok:
+            result.outputs = scratch.collect(dest_dir, products=products)
+        else:
+            result.outputs = scratch.collect(dest_dir, products=["tra"])
+        result.input = input
+
+    return result
@@ -3,6 +3,7 @@
 import os
 from functools import partial
 
+import numpy as np
 import pytest
 from astropy.io import fits
 from astropy.io.fits import FITSDiff
@@ -10,7 +11,7 @@ from ci_watson.artifactory_helpers import generate_upload_params, generate_uploa
 from ci_watson.artifactory_helpers import get_bigdata as _get_bigdata
 from ci_watson.hst_helpers import download_crds, ref_from_image
 
-__all__ = ["calref_from_image", "BaseWFC3TOOLS"]
+__all__ = ["calref_from_image", "make_multiaccum", "BaseWFC3TOOLS"]
 
 # Overload generic get_bigdata to include repo root dir.
 # This is to accomodate developers who have to run big data tests across
@@ -64,6 +65,70 @@ def calref_from_image(input_image):
     return list(set(ref_files))  # Remove duplicates
 
 
+def make_multiaccum(path, sci=(), samptimes=(), bunit="ELECTRONS/S", dtype=np.float32, extensions=None, header=None):
+    """
+    Write a synthetic IR MultiAccum (``_raw`` or ``_ima``) file.
+
+    Parameters
+    ----------
+    path : str or `pathlib.Path`
+        File to write.
+
+    sci : array_like
+        Science data of each read, of shape (nsamp, ny, nx), in time order
+        (zeroth read first). The reads are written last first, as in
+        MultiAccum files. Default is no reads, only a primary header.
+
+    samptimes : array_like
+        Time of each read, in increasing order, written as SAMPTIME with the
+        DELTATIM since the previous read.
+
+    bunit : str, optional
+        BUNIT of the SCI and ERR extensions. Default is ``"ELECTRONS/S"``.
+
+    dtype : data-type, optional
+        Type of the SCI data; ``numpy.uint16`` is written with BZERO as in
+        RAW files. Default is ``numpy.float32``.
+
+    extensions : dict, optional
+        Data of the other extensions of each read, keyed by EXTNAME: an array
+        like ``sci``, or a scalar for a null data array with PIXVALUE.
+
+    header : dict, optional
+        Primary header keywords; NSAMP defaults to the number of reads.
+
+    Returns
+    -------
+    path : str
+        The file written.
+    """
+    samptimes = np.asarray(samptimes, dtype=float)
+    deltatim = np.diff(samptimes, prepend=samptimes[:1])
+    primary = fits.PrimaryHDU()
+    primary.header["NSAMP"] = len(samptimes)
+    for key, value in (header or {}).items():
+        primary.header[key] = value
+
+    hdus = [primary]
+    for extver, k in enumerate(range(len(samptimes) - 1, -1, -1), start=1):
+        sci_hdu = fits.ImageHDU(np.asarray(sci[k]).astype(dtype), name="SCI", ver=extver)
+        sci_hdu.header["BUNIT"] = bunit
+        sci_hdu.header["SAMPTIME"] = samptimes[k]
+        sci_hdu.header["DELTATIM"] = deltatim[k]
+        hdus.append(sci_hdu)
+        for extname, data in (extensions or {}).items():
+            if np.ndim(data) == 0:
+                hdu = fits.ImageHDU(name=extname, ver=extver)
+                hdu.header["PIXVALUE"] = data
+            else:
+                hdu = fits.ImageHDU(np.asarray(data[k]), name=extname, ver=extver)
+            if extname == "ERR":
+                hdu.header["BUNIT"] = bunit
+            hdus.append(hdu)
+    fits.HDUList(hdus).writeto(path)
+    return str(path)
+
+
 # Base class for actual tests.
 # NOTE: Named in a way so pytest will not pick them up here.
 # NOTE: bigdata marker requires TEST_BIGDATA environment variable to
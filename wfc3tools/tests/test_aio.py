@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+from wfc3tools.aio import calwf3_async, wf3ccd_async, wf3cte_async, wf3ir_async, wf3rej_async, wf32d_async
+
+# Stand-in for the HSTCAL executables: logs its command line and OpenMP
+# environment, writes one line longer than the default asyncio line limit,
+# and exits with HSTCAL_EXIT after sleeping HSTCAL_SLEEP seconds.
+SCRIPT = """
+import json, os, sys, time
+with open(os.environ["HSTCAL_LOG"], "a") as f:
+    f.write(json.dumps([sys.argv, os.environ.get("OMP_NUM_THREADS")]) + "\\n")
+print("x" * 200000)
+print("done")
+sys.stdout.flush()
+time.sleep(float(os.environ.get("HSTCAL_SLEEP", 0)))
+sys.exit(int(os.environ.get("HSTCAL_EXIT", 0)))
+"""
+
+EXECUTABLES = ("calwf3.e", "wf3cte.e", "wf3ccd.e", "wf32d.e", "wf3ir.e", "wf3rej.e")
+
+
+@pytest.fixture
+def fake_hstcal(tmp_path, monkeypatch):
+    """Put the stand-in executables on the PATH; return the file they log their runs to."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in EXECUTABLES:
+        executable = bin_dir / name
+        executable.write_text("#!{0}\n{1}".format(sys.executable, SCRIPT))
+        executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+    log = tmp_path / "hstcal.log"
+    monkeypatch.setenv("HSTCAL_LOG", str(log))
+    return log
+
+
+@pytest.fixture
+def raws(tmp_path):
+    names = []
+    for name in ("iaa012wdq_raw.fits", "iaa012wfq_raw.fits"):
+        (tmp_path / name).write_bytes(b"")
+        names.append(str(tmp_path / name))
+    return names
+
+
+def _runs(log):
+    return [json.loads(line) for line in log.read_text().splitlines()]
+
+
+@pytest.mark.parametrize(
+    "func, executable",
+    [
+        (calwf3_async, "calwf3.e"),
+        (wf3cte_async, "wf3cte.e"),
+        (wf3ccd_async, "wf3ccd.e"),
+        (wf32d_async, "wf32d.e"),
+        (wf3ir_async, "wf3ir.e"),
+        (wf3rej_async, "wf3rej.e"),
+    ],
+)
+def test_wrappers(fake_hstcal, raws, func, executable):
+    args = (raws[0], "iaa012010_crj.fits") if func is wf3rej_async else (raws[0],)
+    lines = []
+
+    result = asyncio.run(func(*args, log_func=lines.append))
+
+    assert result.ok
+    assert result.command[0] == executable
+    assert [len(line.strip()) for line in lines] == [200000, 4]
+    ((argv, threads),) = _runs(fake_hstcal)
+    assert os.path.basename(argv[0]) == executable
+
+
+def test_calwf3_async_options(fake_hstcal, raws):
+    async def log(line):
+        await asyncio.sleep(0)
+
+    result = asyncio.run(calwf3_async(raws[0], log_func=log, nthreads=3, verbose=True))
+
+    assert result.input == raws[0]
+    ((argv, threads),) = _runs(fake_hstcal)
+    assert argv[1:] == ["-v", raws[0]]
+    assert threads == "3"
+
+
+def test_wf3cte_async_many_inputs(fake_hstcal, raws):
+    result = asyncio.run(wf3cte_async(raws, log_func=None, nthreads=2))
+
+    assert result.input is None
+    ((argv, threads),) = _runs(fake_hstcal)
+    assert argv[-1] == ",".join(raws)
+    assert threads == "2"
+
+
+def test_failure(fake_hstcal, raws, monkeypatch):
+    monkeypatch.setenv("HSTCAL_EXIT", "114")
+    with pytest.raises(RuntimeError, match="wf3ir.e exited with code OPEN_FAILED"):
+        asyncio.run(wf3ir_async(raws[0], log_func=None))
+
+
+def test_timeout(fake_hstcal, raws, monkeypatch):
+    monkeypatch.setenv("HSTCAL_SLEEP", "30")
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(calwf3_async(raws[0], log_func=None, timeout=0.5))
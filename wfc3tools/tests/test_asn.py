@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from wfc3tools.asn import TaskGraph, calwf3_asn, read_association
+from wfc3tools.runner import run_executable
+
+# Stand-in for the HSTCAL step executables: logs its start and end, and writes its output (the last argument)
+SCRIPT = """
+import os, sys, time
+name = os.path.basename(sys.argv[0])
+output = os.path.basename(sys.argv[-1])
+with open(os.environ["FAKE_HSTCAL_LOG"], "a") as log:
+    log.write("start {0} {1}\\n".format(name, output))
+time.sleep(0.2 if name == "wf3rej.e" else 0.05)
+open(sys.argv[-1], "w").close()
+with open(os.environ["FAKE_HSTCAL_LOG"], "a") as log:
+    log.write("end {0} {1}\\n".format(name, output))
+"""
+
+
+def _task(log, name, code=0, delay=0.0):
+    def task():
+        log.append(name)
+        return run_executable(
+            [sys.executable, "-c", f"import sys, time; time.sleep({delay}); sys.exit({code})"], log_func=None
+        )
+
+    return task
+
+
+def test_task_graph():
+    log = []
+    graph = TaskGraph()
+    for member in ("a", "b", "c"):
+        graph.add(member, _task(log, member, delay=1.0))
+    graph.add("rej", _task(log, "rej"), deps=["a", "b", "c"])
+    graph.add("bad", _task(log, "bad", code=2))
+    graph.add("after_bad", _task(log, "after_bad"), deps=["bad"])
+    graph.add("after_after_bad", _task(log, "after_after_bad"), deps=["after_bad"])
+
+    t0 = time.monotonic()
+    results = graph.run(max_workers=4)
+    assert time.monotonic() - t0 < 2.5
+
+    assert list(results) == ["a", "b", "c", "rej", "bad"]
+    assert log.index("rej") > max(log.index(m) for m in ("a", "b", "c"))
+    assert not results["bad"].ok
+    assert "after_bad" not in log
+
+
+def test_task_graph_exception():
+    log = []
+
+    def missing():
+        raise IOError("Input file not found: missing_raw.fits")
+
+    graph = TaskGraph()
+    graph.add("missing", missing)
+    graph.add("after_missing", _task(log, "after_missing"), deps=["missing"])
+    graph.add("other", _task(log, "other"))
+    results = graph.run(max_workers=2)
+
+    assert list(results) == ["missing", "other"]
+    assert not results["missing"].ok
+    assert results["missing"].error == "Input file not found: missing_raw.fits"
+    assert results["other"].ok
+    assert log == ["other"]
+
+
+def test_calwf3_asn_order(tmp_path, monkeypatch):
+    """Member wf32d runs only after wf3rej has flagged the cosmic rays in the member tmp files."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ("wf3ccd.e", "wf3rej.e", "wf32d.e"):
+        executable = bin_dir / name
+        executable.write_text("#!{0}\n{1}".format(sys.executable, SCRIPT))
+        executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+    log_file = tmp_path / "log"
+    monkeypatch.setenv("FAKE_HSTCAL_LOG", str(log_file))
+
+    members = ["iaa012wdq", "iaa012weq"]
+    for member in members:
+        header = fits.Header([("DETECTOR", "UVIS"), ("PCTECORR", "OMIT")])
+        fits.PrimaryHDU(header=header).writeto(tmp_path / "{0}_raw.fits".format(member))
+    table = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="MEMNAME", format="14A", array=np.array([m.upper() for m in members] + ["IAA012011"])),
+            fits.Column(name="MEMTYPE", format="14A", array=np.array(["EXP-CRJ", "EXP-CRJ", "PROD-CRJ"])),
+        ]
+    )
+    asn = tmp_path / "iaa012010_asn.fits"
+    fits.HDUList([fits.PrimaryHDU(), table]).writeto(asn)
+
+    monkeypatch.chdir(tmp_path)
+    results = calwf3_asn(asn.name, max_workers=4)
+
+    assert all(result.ok for result in results.values())
+    assert sorted(results) == [
+        "wf32d:iaa012011_crj",
+        "wf32d:iaa012wdq_flt",
+        "wf32d:iaa012weq_flt",
+        "wf3ccd:iaa012wdq_blv_tmp",
+        "wf3ccd:iaa012weq_blv_tmp",
+        "wf3rej:iaa012011_crj_tmp",
+    ]
+    events = log_file.read_text().splitlines()
+    rejection_end = events.index("end wf3rej.e iaa012011_crj_tmp.fits")
+    for member in members:
+        assert events.index("end wf3ccd.e {0}_blv_tmp.fits".format(member)) < events.index(
+            "start wf3rej.e iaa012011_crj_tmp.fits"
+        )
+        assert events.index("start wf32d.e {0}_flt.fits".format(member)) > rejection_end
+    assert all((tmp_path / "{0}_flt.fits".format(member)).exists() for member in members)
+    assert not (tmp_path / "iaa012wdq_blv_tmp.fits").exists()
+
+
+def test_read_association(tmp_path):
+    names = ["IAA012WDQ", "IAA012WEQ", "IAA012011", "IAA012WFQ", "IAA012021"]
+    types = ["EXP-CR1", "EXP-CR1", "PROD-CR1", "EXP-CR2", "PROD-CR2"]
+    present = [True, True, True, False, True]
+    table = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="MEMNAME", format="14A", array=np.array(names)),
+            fits.Column(name="MEMTYPE", format="14A", array=np.array(types)),
+            fits.Column(name="MEMPRSNT", format="L", array=np.array(present)),
+        ]
+    )
+    asn = tmp_path / "iaa012010_asn.fits"
+    fits.HDUList([fits.PrimaryHDU(), table]).writeto(asn)
+
+    assert read_association(str(asn)) == {
+        ("iaa012011", "CR1"): ["iaa012wdq", "iaa012weq"],
+    }
@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+
+import pytest
+from astropy.io import fits
+
+from wfc3tools import cache as cache_module
+from wfc3tools.batch import _expand_inputs, calwf3_batch
+from wfc3tools.inputs import REQUIRED_SWITCHES
+
+# Stand-in for calwf3.e: writes an empty FLT next to its input, and a trailer
+# recording its command line and OpenMP environment.
+SCRIPT = """
+import json, os, sys
+input = sys.argv[-1]
+root = input[: -len("_raw.fits")]
+open(root + "_flt.fits", "w").close()
+with open(root + ".tra", "w") as f:
+    json.dump({"argv": sys.argv[1:], "threads": os.environ.get("OMP_NUM_THREADS"),
+               "places": os.environ.get("OMP_PLACES")}, f)
+"""
+
+
+@pytest.fixture
+def fake_calwf3(tmp_path, monkeypatch):
+    """Put the stand-in calwf3.e on the PATH."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "calwf3.e"
+    executable.write_text("#!{0}\n{1}".format(sys.executable, SCRIPT))
+    executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    monkeypatch.delenv("OMP_PLACES", raising=False)
+
+
+def _make_raws(directory, n=2, **keywords):
+    """Write ``n`` IR RAW primary headers with all calibration switches set."""
+    raws = []
+    for i in range(n):
+        header = fits.Header([("INSTRUME", "WFC3"), ("DETECTOR", "IR")])
+        for key in REQUIRED_SWITCHES["IR"]:
+            header[key] = "OMIT"
+        header.update(keywords)
+        raw = directory / "ibaa0{0}aaq_raw.fits".format(i)
+        fits.PrimaryHDU(header=header).writeto(raw)
+        raws.append(str(raw))
+    return raws
+
+
+def _trailer(raw):
+    with open(raw[: -len("_raw.fits")] + ".tra") as f:
+        return json.load(f)
+
+
+def test_expand_inputs(tmp_path):
+    for name in ("a_raw.fits", "b_raw.fits", "c_raw.fits"):
+        (tmp_path / name).write_bytes(b"")
+    atfile = tmp_path / "input.lst"
+    atfile.write_text(f"{tmp_path / 'c_raw.fits'}\n")
+
+    infiles = _expand_inputs([str(tmp_path / "[ab]_raw.fits"), "@" + str(atfile)])
+    assert sorted(infiles) == sorted(str(tmp_path / name) for name in ("a_raw.fits", "b_raw.fits", "c_raw.fits"))
+
+    with pytest.raises(IOError, match="Input file not found"):
+        _expand_inputs([str(tmp_path / "missing_raw.fits")])
+
+
+def test_batch(tmp_path, fake_calwf3):
+    raws = _make_raws(tmp_path, n=3)
+
+    results = calwf3_batch(raws, max_workers=2, verbose=True)
+
+    assert [result.input for result in results] == raws
+    for raw, result in zip(raws, results):
+        assert result.ok
+        assert result.outputs == [raw[: -len("_raw.fits")] + ".tra", raw[: -len("_raw.fits")] + "_flt.fits"]
+        trailer = _trailer(raw)
+        assert trailer["argv"][-1] == raw
+        assert "-v" in trailer["argv"]
+        assert trailer["threads"] is None
+
+
+def test_batch_threads_per_job(tmp_path, fake_calwf3):
+    raws = _make_raws(tmp_path, n=4)
+
+    results = calwf3_batch(raws, threads_per_job=1, cpus=[0, 1])
+
+    assert all(result.ok for result in results)
+    trailers = [_trailer(raw) for raw in raws]
+    assert {trailer["threads"] for trailer in trailers} == {"1"}
+    assert {trailer["places"] for trailer in trailers} <= {"{0}", "{1}"}
+
+
+def test_batch_process_executor(tmp_path, fake_calwf3, monkeypatch):
+    raws = _make_raws(tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    results = calwf3_batch([os.path.basename(raw) for raw in raws], executor="process", max_workers=2, threads_per_job=2)
+
+    assert [result.input for result in results] == raws
+    for raw, result in zip(raws, results):
+        assert result.ok
+        trailer = _trailer(raw)
+        assert trailer["argv"][-1] == raw
+        assert trailer["threads"] == "2"
+        assert trailer["places"] is None
+
+
+def test_batch_check_headers(tmp_path, fake_calwf3):
+    raws = _make_raws(tmp_path)
+    fits.setval(raws[1], "INSTRUME", value="ACS")
+
+    with pytest.raises(IOError, match="INSTRUME is ACS"):
+        calwf3_batch(raws)
+    assert not any(os.path.exists(raw[: -len("_raw.fits")] + ".tra") for raw in raws)
+
+    results = calwf3_batch(raws, check_headers=False)
+    assert all(result.ok for result in results)
+
+
+def test_batch_cache(tmp_path, fake_calwf3, monkeypatch):
+    monkeypatch.setattr(cache_module, "executable_version", lambda executable: "CALWF3 3.7.2")
+    raws = _make_raws(tmp_path)
+    cache = str(tmp_path / "cache")
+
+    first = calwf3_batch(raws, cache=cache)
+    assert all(result.ok and not result.cached for result in first)
+
+    for raw in raws:
+        os.remove(raw[: -len("_raw.fits")] + "_flt.fits")
+    second = calwf3_batch(raws, cache=cache)
+    assert all(result.ok and result.cached for result in second)
+    assert all(os.path.isfile(raw[: -len("_raw.fits")] + "_flt.fits") for raw in raws)
+
+    # options that only change the trailer still miss the cache
+    for options in ({"save_tmp": True}, {"verbose": True}, {"printtime": True}):
+        assert not any(result.cached for result in calwf3_batch(raws, cache=cache, **options))
+    assert all(result.cached for result in calwf3_batch(raws, cache=cache, verbose=True))
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from wfc3tools import cache as cache_module
+from wfc3tools.cache import CTECache, ResultCache, cached_run, calibration_key, cte_cached_run, cte_key
+from wfc3tools.runner import RunResult
+
+
+@pytest.fixture
+def raw(tmp_path, monkeypatch):
+    refdir = tmp_path / "ref"
+    refdir.mkdir()
+    (refdir / "w3m18525i_bpx.fits").write_bytes(b"bad pixels v1")
+    monkeypatch.setenv("tref", str(refdir) + os.sep)
+    monkeypatch.setattr(cache_module, "executable_version", lambda executable: "CALWF3 3.7.2")
+
+    hdr = fits.Header()
+    hdr["DQICORR"] = "PERFORM"
+    hdr["BPIXTAB"] = "tref$w3m18525i_bpx.fits"
+    raw = tmp_path / "data" / "iaa012wdq_raw.fits"
+    raw.parent.mkdir()
+    fits.PrimaryHDU(header=hdr).writeto(raw)
+    return raw
+
+
+def test_calibration_key(raw, tmp_path):
+    key = calibration_key(str(raw))
+    assert key == calibration_key(str(raw))
+
+    # changed reference file contents
+    (tmp_path / "ref" / "w3m18525i_bpx.fits").write_bytes(b"bad pixels v2")
+    assert calibration_key(str(raw)) != key
+    key = calibration_key(str(raw))
+
+    # changed switch
+    fits.setval(raw, "DQICORR", value="OMIT")
+    assert calibration_key(str(raw)) != key
+
+    assert calibration_key(str(raw), options={"save_tmp": True}) != calibration_key(str(raw))
+
+
+def test_calibration_key_unset_variable(raw, monkeypatch):
+    """A reference file under an unset environment variable is keyed by its name."""
+    fits.setval(raw, "FLSHCORR", value="OMIT")
+    fits.setval(raw, "FLSHFILE", value="iref$unused_fls.fits")
+    monkeypatch.delenv("iref", raising=False)
+    key = calibration_key(str(raw))
+    assert key == calibration_key(str(raw))
+
+    fits.setval(raw, "FLSHFILE", value="iref$other_fls.fits")
+    assert calibration_key(str(raw)) != key
+
+
+def test_cached_run(raw, tmp_path):
+    flt = raw.parent / "iaa012wdq_flt.fits"
+    calls = []
+
+    def run():
+        calls.append(1)
+        flt.write_bytes(b"x" * 1000)
+        return RunResult(input=str(raw), command=["calwf3.e"], returncode=0, outputs=[str(flt)])
+
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1500)
+    assert not cached_run(cache, str(raw), run).cached
+    assert cached_run(cache, str(raw), run).cached
+    assert len(calls) == 1
+
+    # restored when missing
+    os.remove(flt)
+    result = cached_run(cache, str(raw), run)
+    assert result.cached
+    assert result.outputs == [str(flt)]
+    assert flt.read_bytes() == b"x" * 1000
+
+    # a second entry pushes the first one out
+    cached_run(cache, str(raw), run, options={"save_tmp": True})
+    assert len(cache.entries()) == 1
+    assert cache.size() <= 1500
+    assert not cached_run(cache, str(raw), run).cached
+
+
+@pytest.fixture
+def uvis_raw(tmp_path, monkeypatch):
+    refdir = tmp_path / "ref"
+    refdir.mkdir()
+    (refdir / "54l1347ei_cte.fits").write_bytes(b"cte v1")
+    (refdir / "1ag2019ji_pfl.fits").write_bytes(b"flat v1")
+    monkeypatch.setenv("iref", str(refdir) + os.sep)
+    monkeypatch.setattr(cache_module, "executable_version", lambda executable: "WF3CTE 3.7.2")
+
+    hdr = fits.Header()
+    hdr["DETECTOR"] = "UVIS"
+    hdr["PCTECORR"] = "PERFORM"
+    hdr["FLATCORR"] = "PERFORM"
+    hdr["PCTETAB"] = "iref$54l1347ei_cte.fits"
+    hdr["PFLTFILE"] = "iref$1ag2019ji_pfl.fits"
+    raw = tmp_path / "data" / "iaa012wdq_raw.fits"
+    raw.parent.mkdir()
+    fits.HDUList([fits.PrimaryHDU(header=hdr), fits.ImageHDU(np.arange(16, dtype=np.uint16).reshape(4, 4))]).writeto(raw)
+    return raw
+
+
+def test_cte_key(uvis_raw, tmp_path):
+    key = cte_key(str(uvis_raw))
+
+    # downstream switches and reference files do not matter
+    fits.setval(uvis_raw, "FLATCORR", value="OMIT")
+    fits.setval(uvis_raw, "PFLTFILE", value="iref$2ag2019ji_pfl.fits")
+    (tmp_path / "ref" / "1ag2019ji_pfl.fits").write_bytes(b"flat v2")
+    assert cte_key(str(uvis_raw)) == key
+
+    # the CTE reference file does
+    (tmp_path / "ref" / "54l1347ei_cte.fits").write_bytes(b"cte v2")
+    assert cte_key(str(uvis_raw)) != key
+    key = cte_key(str(uvis_raw))
+
+    # and so do the pixels
+    with fits.open(uvis_raw, mode="update") as hdulist:
+        hdulist[1].data[0, 0] = 1000
+    assert cte_key(str(uvis_raw)) != key
+
+
+def test_cte_cached_run(uvis_raw, tmp_path):
+    rac = uvis_raw.parent / "iaa012wdq_rac_tmp.fits"
+    calls = []
+
+    def run(infiles):
+        calls.append(infiles)
+        rac.write_bytes(b"corrected")
+        return RunResult(input=infiles[0], command=["wf3cte.e"], returncode=0, outputs=[str(rac)])
+
+    cache = CTECache(str(tmp_path / "cache"))
+    assert not cte_cached_run(cache, [str(uvis_raw)], run).cached
+    os.remove(rac)
+
+    result = cte_cached_run(cache, [str(uvis_raw)], run)
+    assert result.cached
+    assert result.outputs == [str(rac)]
+    assert rac.read_bytes() == b"corrected"
+    assert calls == [[str(uvis_raw)]]
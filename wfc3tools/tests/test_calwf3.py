@@ -1,19 +1,73 @@
+import os
+import shutil
+import sys
+
 import pytest
+from astropy.io.fits import FITSDiff
 
 from wfc3tools import calwf3
+from wfc3tools.tests.helpers import BaseWFC3TOOLS
 
-# Mark all tests in this module:
+# Mark the tests that run calwf3.e:
 # Even if test does not use data, it needs HSTCAL to be installed
 # and that is only available on RegressionTests workflow.
-pytestmark = [pytest.mark.bigdata]
 
 
+@pytest.mark.bigdata
 def test_no_valid_input(_jail):
     """Run a very simple aliveness test."""
     with pytest.raises(IOError, match="No valid image specified"):
         calwf3()
 
 
+@pytest.mark.bigdata
 def test_version_print(_jail):
     """Make sure no error results from version print."""
     calwf3(version=True)
+
+
+@pytest.mark.bigdata
+class TestCTECache(BaseWFC3TOOLS):
+    detector = "uvis"
+
+    def test_cte_cache_matches_calwf3(self, tmp_path):
+        """On a CTE cache hit, the FLT and FLC match those of a plain calwf3.e run."""
+        filename = "iacr51ohq_raw.fits"
+        self.get_input_file(filename)
+        for run in ("plain", "cached"):
+            os.mkdir(run)
+            shutil.copy(filename, run)
+
+        calwf3(os.path.join("plain", filename), log_func=None)
+        cache = str(tmp_path / "cte-cache")
+        raw = os.path.join("cached", filename)
+        assert calwf3(raw, cte_cache=cache, log_func=None).command[0] == "calwf3.e"
+        for product in ("flt", "flc"):
+            os.remove(os.path.join("cached", "iacr51ohq_{0}.fits".format(product)))
+        # the CTE correction is skipped, and the CCD and 2D steps run on their own
+        assert calwf3(raw, cte_cache=cache, log_func=None).command[0] == "wf32d.e"
+
+        for product in ("flt", "flc"):
+            name = "iacr51ohq_{0}.fits".format(product)
+            diff = FITSDiff(os.path.join("cached", name), os.path.join("plain", name), ignore_keywords=self.ignore_keywords)
+            assert diff.identical, diff.report()
+        assert not any(name.endswith("_tmp.fits") for name in os.listdir("cached"))
+
+
+@pytest.mark.parametrize("code, raises", [(0, False), (114, True), (3, False)])
+def test_return_code(tmp_path, monkeypatch, code, raises):
+    """Only the known error codes of calwf3.e raise, as they always have."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "calwf3.e"
+    executable.write_text("#!{0}\nimport sys\nsys.exit({1})\n".format(sys.executable, code))
+    executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+    raw = tmp_path / "iaa012wdq_raw.fits"
+    raw.write_bytes(b"")
+
+    if raises:
+        with pytest.raises(RuntimeError, match="OPEN_FAILED"):
+            calwf3(str(raw), log_func=None)
+    else:
+        assert calwf3(str(raw), log_func=None).returncode == code
@@ -0,0 +1,39 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from wfc3tools.executors import run_call_lists
+
+SCRIPT = "import os, sys; open(sys.argv[1], 'w').write(os.environ['OMP_NUM_THREADS']); sys.exit(int(sys.argv[2]))"
+
+
+def _jobs(tmp_path):
+    outputs = [str(tmp_path / f"job{i}_flt.fits") for i in range(3)]
+    call_lists = [[sys.executable, "-c", SCRIPT, output, str(i)] for i, output in enumerate(outputs)]
+    return call_lists, outputs
+
+
+@pytest.mark.parametrize("executor", ["thread", "process", "pool"])
+def test_run_call_lists(tmp_path, executor):
+    call_lists, outputs = _jobs(tmp_path)
+    if executor == "pool":
+        executor = ThreadPoolExecutor(max_workers=2)
+
+    results = run_call_lists(call_lists, outputs=outputs, executor=executor, max_workers=2, env={"OMP_NUM_THREADS": "3"})
+    assert [r.returncode for r in results] == [0, 1, 2]
+    assert results[0].outputs == [outputs[0]]
+    assert open(outputs[2]).read() == "3"
+
+
+def test_run_call_lists_dask(tmp_path):
+    distributed = pytest.importorskip("dask.distributed")
+    call_lists, outputs = _jobs(tmp_path)
+    with distributed.LocalCluster(n_workers=2, processes=True) as cluster, distributed.Client(cluster) as client:
+        results = run_call_lists(call_lists, outputs=outputs, executor=client, env={"OMP_NUM_THREADS": "1"})
+    assert [r.returncode for r in results] == [0, 1, 2]
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        run_call_lists([[sys.executable, "-c", "pass"]], executor="mpi")
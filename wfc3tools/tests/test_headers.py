@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from wfc3tools.headers import edit_headers, set_header_in_place, update_header
+from wfc3tools.tests.helpers import make_multiaccum
+
+
+def _make_raw(path):
+    sci = [np.arange(200).reshape(10, 20)]
+    return make_multiaccum(path, sci, [0.0], dtype=np.int16, header={"CRCORR": ("PERFORM", "cosmic ray rejection")})
+
+
+def test_in_place(tmp_path):
+    raw = _make_raw(tmp_path / "test_raw.fits")
+    size = os.path.getsize(raw)
+    with open(raw, "rb") as f:
+        data = f.read()[-2880:]
+
+    assert update_header(raw, {"CRCORR": "OMIT", "FLATCORR": "OMIT"})
+    assert os.path.getsize(raw) == size
+    with open(raw, "rb") as f:
+        assert f.read()[-2880:] == data
+    header = fits.getheader(raw)
+    assert header["CRCORR"] == "OMIT"
+    assert header.comments["CRCORR"] == "cosmic ray rejection"
+    assert header["FLATCORR"] == "OMIT"
+
+    assert update_header(raw, {"BUNIT": "ELECTRONS"}, ext=1)
+    with fits.open(raw) as hdulist:
+        assert hdulist[1].header["BUNIT"] == "ELECTRONS"
+        assert hdulist[1].data[9, 19] == 199
+
+
+def test_header_full(tmp_path):
+    raw = _make_raw(tmp_path / "test_raw.fits")
+    values = {"KEY{0}".format(i): i for i in range(40)}
+
+    assert not set_header_in_place(raw, values)
+    assert "KEY0" not in fits.getheader(raw)
+
+    assert not update_header(raw, values)
+    with fits.open(raw) as hdulist:
+        assert hdulist[0].header["KEY39"] == 39
+        assert hdulist[1].data[9, 19] == 199
+
+
+def test_edit_headers(tmp_path):
+    raws = [_make_raw(tmp_path / "test{0}_raw.fits".format(i)) for i in range(3)]
+    missing = str(tmp_path / "missing_raw.fits")
+
+    report = edit_headers(raws + [missing], {"CRCORR": "OMIT"})
+    assert report.edited == raws
+    assert report.rewritten == []
+    assert list(report.failed) == [missing]
+    assert all(fits.getval(raw, "CRCORR") == "OMIT" for raw in raws)
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from wfc3tools.ingest import _EVENT, _IN_CLOSE_WRITE, _IN_Q_OVERFLOW, IngestDaemon, _Inotify
+
+
+def _raw(path, asn_tab="NONE"):
+    hdr = fits.Header()
+    hdr["ASN_TAB"] = asn_tab
+    # write under a temporary name and move in, as an archive mirror would
+    tmp = str(path) + ".part"
+    fits.PrimaryHDU(header=hdr).writeto(tmp, output_verify="silentfix")
+    os.replace(tmp, path)
+
+
+def _asn(path, members, product):
+    table = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="MEMNAME", format="14A", array=np.array([m.upper() for m in members] + [product])),
+            fits.Column(name="MEMTYPE", format="14A", array=np.array(["EXP-CRJ"] * len(members) + ["PROD-CRJ"])),
+            fits.Column(name="MEMPRSNT", format="L", array=np.array([True] * (len(members) + 1))),
+        ]
+    )
+    fits.HDUList([fits.PrimaryHDU(), table]).writeto(path)
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_ingest(tmp_path, use_inotify):
+    if use_inotify and not _Inotify.available():
+        pytest.skip("inotify not available")
+
+    _raw(tmp_path / "ibh719grq_raw.fits")  # already there
+    dispatched = []
+    lock = threading.Lock()
+
+    def task(input):
+        with lock:
+            dispatched.append(os.path.basename(input))
+        return input
+
+    daemon = IngestDaemon([str(tmp_path)], task=task, max_workers=2, settle=0.2, poll_interval=0.1, use_inotify=use_inotify)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        _raw(tmp_path / "iaa012wdq_raw.fits", asn_tab="iaa012010_asn.fits")
+        _asn(tmp_path / "iaa012010_asn.fits", ["iaa012wdq", "iaa012weq"], "IAA012011")
+        time.sleep(1.0)
+        assert "iaa012010_asn.fits" not in dispatched
+
+        _raw(tmp_path / "iaa012weq_raw.fits", asn_tab="iaa012010_asn.fits")
+        _raw(tmp_path / "ibh720grq_raw.fits")
+        deadline = time.monotonic() + 10
+        while len(dispatched) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        daemon.stop()
+        thread.join()
+
+    assert sorted(dispatched) == ["iaa012010_asn.fits", "ibh719grq_raw.fits", "ibh720grq_raw.fits"]
+    assert daemon._dispatched == set()
+
+
+def test_inotify_overflow(tmp_path):
+    """The overflow event of a full kernel queue is reported."""
+    read_fd, write_fd = os.pipe()
+    inotify = _Inotify.__new__(_Inotify)
+    inotify.fd = read_fd
+    inotify.watches = {1: str(tmp_path)}
+    name = b"ibh719grq_raw.fits\0\0"
+    os.write(write_fd, _EVENT.pack(1, _IN_CLOSE_WRITE, 0, len(name)) + name + _EVENT.pack(-1, _IN_Q_OVERFLOW, 0, 0))
+    os.close(write_fd)
+    try:
+        assert inotify.read(1.0) == ([str(tmp_path / "ibh719grq_raw.fits")], True)
+    finally:
+        inotify.close()
+
+
+def test_ingest_rescan(tmp_path):
+    """With inotify, files that arrive without a close or move event are found by the periodic listing."""
+    if not _Inotify.available():
+        pytest.skip("inotify not available")
+    watched = tmp_path / "incoming"
+    watched.mkdir()
+    dispatched = []
+    daemon = IngestDaemon(
+        [str(watched)], task=dispatched.append, settle=0.1, poll_interval=0.1, use_inotify=True, rescan_interval=0.3
+    )
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        _raw(tmp_path / "ibh719grq_raw.fits")
+        # a hard link only raises IN_CREATE, which is not watched
+        os.link(tmp_path / "ibh719grq_raw.fits", watched / "ibh719grq_raw.fits")
+        deadline = time.monotonic() + 10
+        while not dispatched and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        daemon.stop()
+        thread.join()
+
+    assert dispatched == [str(watched / "ibh719grq_raw.fits")]
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_ingest_rewritten(tmp_path, use_inotify):
+    """A RAW overwritten in place after it was calibrated is calibrated again, once."""
+    if use_inotify and not _Inotify.available():
+        pytest.skip("inotify not available")
+    raw = tmp_path / "ibh719grq_raw.fits"
+    _raw(raw)
+    dispatched = []
+    daemon = IngestDaemon(
+        [str(tmp_path)],
+        task=dispatched.append,
+        settle=0.1,
+        poll_interval=0.1,
+        use_inotify=use_inotify,
+        rescan_interval=0.2,
+    )
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+
+    def wait_for(n):
+        deadline = time.monotonic() + 10
+        while len(dispatched) < n and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    try:
+        wait_for(1)
+        hdr = fits.Header()
+        hdr["ASN_TAB"] = "NONE"
+        hdr["HISTORY"] = "reprocessed"
+        fits.PrimaryHDU(header=hdr).writeto(raw, overwrite=True, output_verify="silentfix")
+        wait_for(2)
+        # later listings find it unchanged
+        time.sleep(1.0)
+    finally:
+        daemon.stop()
+        thread.join()
+
+    assert dispatched == [str(raw), str(raw)]
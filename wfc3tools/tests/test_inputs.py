@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from astropy.io import fits
+
+from wfc3tools import inputs
+from wfc3tools.inputs import REQUIRED_SWITCHES, clear_listing_cache, expand_inputs, preflight
+
+
+def test_expand_inputs(tmp_path, monkeypatch):
+    for name in ("a_raw.fits", "b_raw.fits", "c_raw.fits", "a_flt.fits"):
+        (tmp_path / name).write_bytes(b"")
+    atfile = tmp_path / "input.lst"
+    atfile.write_text(f"{tmp_path / 'c_raw.fits'}\n{tmp_path / 'gone_raw.fits'}\n")
+    # old enough for the listing to be kept
+    os.utime(tmp_path, (1e9, 1e9))
+    clear_listing_cache()
+
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(inputs.os, "scandir", lambda path: scans.append(path) or scandir(path))
+
+    missing = []
+    files = expand_inputs([str(tmp_path / "*_raw.fits"), "@" + str(atfile), f"{tmp_path / 'a_flt.fits'}"], missing=missing)
+    assert files == [str(tmp_path / name) for name in ("a_raw.fits", "b_raw.fits", "c_raw.fits", "c_raw.fits", "a_flt.fits")]
+    assert missing == [str(tmp_path / "gone_raw.fits")]
+    assert expand_inputs(",".join([str(tmp_path / "a_raw.fits"), str(tmp_path / "b_raw.fits")])) == [
+        str(tmp_path / "a_raw.fits"),
+        str(tmp_path / "b_raw.fits"),
+    ]
+    assert scans == [str(tmp_path)]
+
+
+def test_preflight(tmp_path):
+    good = tmp_path / "good_raw.fits"
+    hdr = fits.Header()
+    hdr["INSTRUME"] = "WFC3"
+    hdr["DETECTOR"] = "IR"
+    for key in REQUIRED_SWITCHES["IR"]:
+        hdr[key] = "PERFORM"
+    fits.PrimaryHDU(header=hdr).writeto(good)
+
+    bad = tmp_path / "bad_raw.fits"
+    del hdr["FLATCORR"]
+    fits.PrimaryHDU(header=hdr).writeto(bad)
+    junk = tmp_path / "junk_raw.fits"
+    junk.write_bytes(b"not a FITS file")
+
+    assert list(preflight([str(good)])) == [str(good)]
+    with pytest.raises(IOError) as excinfo:
+        preflight([str(good), str(bad), str(junk)])
+    message = str(excinfo.value)
+    assert "bad_raw.fits: missing calibration switches FLATCORR" in message
+    assert "junk_raw.fits" in message
+    assert "good_raw.fits" not in message
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from wfc3tools import pstack, pstat
+from wfc3tools.multiaccum import MultiAccumCube, MultiAccumIndex, RampCache, write_ramp_cache
+from wfc3tools.tests.helpers import make_multiaccum
+
+
+def _make_ima(path, nsamp=5, shape=(8, 6)):
+    """A small IMA with a constant count rate of 2 electrons per second."""
+    zeros = np.zeros((nsamp,) + shape, dtype=np.float32)
+    extensions = {"ERR": zeros, "DQ": zeros, "SAMP": zeros, "TIME": zeros}
+    return make_multiaccum(path, np.full((nsamp,) + shape, 2.0), np.arange(nsamp) * 10.0, extensions=extensions)
+
+
+@pytest.fixture
+def data_reads(monkeypatch):
+    """Record the (EXTNAME, EXTVER) of every image extension whose data array is accessed."""
+    reads = []
+    lazy = fits.ImageHDU.data
+
+    def data(hdu):
+        reads.append((hdu.name, hdu.ver))
+        return lazy.__get__(hdu, type(hdu))
+
+    monkeypatch.setattr(fits.ImageHDU, "data", property(data, lazy.__set__, lazy.__delete__))
+    return reads
+
+
+def test_index(tmp_path):
+    with fits.open(_make_ima(tmp_path / "test_ima.fits")) as hdulist:
+        index = MultiAccumIndex(hdulist)
+
+        assert index.nsamp == 5
+        assert index.is_rate
+        np.testing.assert_allclose(index.samptime, [40.0, 30.0, 20.0, 10.0, 0.0])
+        np.testing.assert_allclose(index.deltatim, [10.0, 10.0, 10.0, 10.0, 0.0])
+        for extname, extver in [("SCI", 1), ("DQ", 3), ("time", 5)]:
+            assert index[extname, extver] is hdulist[extname, extver]
+        assert index.position("ERR", 2) == 7
+        assert ("SAMP", 4) in index
+        assert ("SCI", 6) not in index
+        with pytest.raises(KeyError):
+            index["SCI", 6]
+
+
+def test_pstat_counts(tmp_path):
+    x, y = pstat(_make_ima(tmp_path / "test_ima.fits"), units="counts", plot=False)
+    np.testing.assert_allclose(x, [40.0, 30.0, 20.0, 10.0, 0.0])
+    np.testing.assert_allclose(y, [80.0, 60.0, 40.0, 20.0, 0.0])
+
+
+def test_cube(tmp_path, data_reads):
+    ima = _make_ima(tmp_path / "test_ima.fits")
+    del data_reads[:]
+    with MultiAccumCube(ima) as cube:
+        assert cube.shape == (5, 8, 6)
+        assert cube.sci.shape == (5, 8, 6)
+        assert cube.sci[1:3, 2:4, 1].shape == (2, 2)
+        assert cube.sci[[0, 4], [1, 2], [3, 5]].shape == (2, 2)
+        assert cube.dq[-1].shape == (8, 6)
+        # only the selected reads are read
+        assert sorted(set(data_reads)) == [("DQ", 5), ("SCI", 1), ("SCI", 2), ("SCI", 3), ("SCI", 5)]
+        np.testing.assert_allclose(np.asarray(cube.sci), 2.0)
+        assert {("SCI", i) for i in range(1, 6)} <= set(data_reads)
+        np.testing.assert_allclose(cube.to_counts(cube.sci[:, 0, 0]), [80.0, 60.0, 40.0, 20.0, 0.0])
+        np.testing.assert_allclose(cube.to_rate(cube.sci[:2, 0, 0], slice(0, 2)), 2.0)
+
+    with MultiAccumCube(ima, mode="update") as cube:
+        cube.sci[0] += 1.0
+        cube.sci[1:3, :2, :2] = 7.0
+    with MultiAccumCube(ima) as cube:
+        np.testing.assert_allclose(cube.sci[0], 3.0)
+        np.testing.assert_allclose(cube.sci[1:3, :2, :2], 7.0)
+        np.testing.assert_allclose(cube.sci[1:3, 2:, 2:], 2.0)
+
+
+def test_cube_counts(tmp_path):
+    """RAW-like data in counts, scaled with BZERO, converted to rates."""
+    path = tmp_path / "test_raw.fits"
+    primary = fits.PrimaryHDU()
+    primary.header["NSAMP"] = 3
+    hdus = [primary]
+    for i, samptime in enumerate([20.0, 10.0, 0.0], start=1):
+        sci = fits.ImageHDU(np.full((4, 4), samptime * 3, dtype=np.uint16), name="SCI", ver=i)
+        sci.header["BUNIT"] = "COUNTS"
+        sci.header["SAMPTIME"] = samptime
+        hdus.append(sci)
+    fits.HDUList(hdus).writeto(path)
+
+    with MultiAccumCube(str(path)) as cube:
+        assert not cube.is_rate
+        ramp = cube.sci[:, [0, 3], [1, 2]]
+        np.testing.assert_allclose(ramp, [[60.0, 60.0], [30.0, 30.0], [0.0, 0.0]])
+        np.testing.assert_allclose(cube.to_rate(ramp), [[3.0, 3.0], [3.0, 3.0], [0.0, 0.0]])
+
+
+def test_ramp_cache(tmp_path, data_reads):
+    ima = _make_ima(tmp_path / "test_ima.fits", shape=(70, 6))
+    with fits.open(ima, mode="update") as hdulist:
+        for i in range(1, 6):
+            hdulist["SCI", i].data += np.arange(70 * 6, dtype=np.float32).reshape(70, 6) * i
+    with MultiAccumCube(ima) as cube:
+        assert cube.ramps == {}
+        expected = np.asarray(cube.sci)
+        x, y = pstack(ima, column=[1, 4], row=[3, 66], plot=False)
+        stats = pstat(ima, col_slice=(1, 5), row_slice=(60, 70), stat="mean", plot=False)
+
+    cache = write_ramp_cache(ima, chunk_rows=32)
+    assert cache.metadata_file == str(tmp_path / "test_ima.ramps.json")
+    ramps = cache.load()
+    assert sorted(ramps) == ["DQ", "ERR", "SCI"]
+    assert ramps["SCI"].shape == (70, 6, 5)
+    np.testing.assert_array_equal(ramps["SCI"], np.moveaxis(expected, 0, -1))
+
+    del data_reads[:]
+    with MultiAccumCube(ima) as cube:
+        assert sorted(cube.ramps) == ["DQ", "ERR", "SCI"]
+        np.testing.assert_array_equal(cube.sci[:], expected)
+        np.testing.assert_array_equal(cube.sci[1:3, 2:4, 1], expected[1:3, 2:4, 1])
+        np.testing.assert_array_equal(cube.sci[-1], expected[-1])
+        np.testing.assert_array_equal(cube.sci[[0, 4], [1, 2], [3, 5]], expected[[0, 4]][:, [1, 2], [3, 5]])
+        # the FITS file is read only for extensions that are not cached
+        assert data_reads == []
+        assert cube.samp[0].shape == (70, 6)
+        assert data_reads == [("SAMP", 1)]
+    np.testing.assert_array_equal(pstack(ima, column=[1, 4], row=[3, 66], plot=False)[1], y)
+    np.testing.assert_allclose(pstat(ima, col_slice=(1, 5), row_slice=(60, 70), stat="mean", plot=False), stats)
+
+    # a change to the file invalidates the cache
+    with MultiAccumCube(ima, mode="update") as cube:
+        assert cube.ramps == {}
+        cube.sci[0] = 0.0
+    # same size: only the modification time tells, whatever the timestamp resolution
+    mtime_ns = os.stat(ima).st_mtime_ns
+    os.utime(ima, ns=(mtime_ns, mtime_ns + 2 * 10**9))
+    assert RampCache(ima).load() == {}
+    with MultiAccumCube(ima) as cube:
+        assert cube.ramps == {}
+        np.testing.assert_array_equal(cube.sci[0], 0.0)
+
+    cache.remove()
+    assert os.listdir(tmp_path) == ["test_ima.fits"]
+
+
+def test_ramp_cache_dir(tmp_path):
+    ima = _make_ima(tmp_path / "test_ima.fits")
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    write_ramp_cache(ima, cache_dir=str(cache_dir), extnames=["sci"])
+
+    assert sorted(os.listdir(cache_dir)) == ["test_ima.ramps.json", "test_ima.ramps.sci.npy"]
+    with MultiAccumCube(ima) as cube:
+        assert cube.ramps == {}
+    with MultiAccumCube(ima, ramp_cache=str(cache_dir)) as cube:
+        assert list(cube.ramps) == ["SCI"]
+        np.testing.assert_allclose(cube.to_counts(cube.sci[:, 0, 0]), [80.0, 60.0, 40.0, 20.0, 0.0])
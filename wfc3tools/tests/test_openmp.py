@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+
+import pytest
+
+from wfc3tools.openmp import ThreadBudget, calibrate_cte_threads
+
+# Stand-in for wf3cte.e: takes longer with one thread than with more, logs its
+# input and OpenMP environment, and fails on an input named fail_raw.fits.
+SCRIPT = """
+import json, os, sys, time
+input = sys.argv[-1]
+threads = int(os.environ["OMP_NUM_THREADS"])
+with open(os.environ["WF3CTE_LOG"], "a") as f:
+    f.write(json.dumps([input, threads, os.environ.get("OMP_PLACES")]) + "\\n")
+if os.path.basename(input) == "fail_raw.fits":
+    sys.exit(114)
+time.sleep(0.6 if threads == 1 else 0.1)
+with open(input, "a") as f:
+    f.write("corrected")
+"""
+
+
+@pytest.fixture
+def fake_wf3cte(tmp_path, monkeypatch):
+    """Put the stand-in wf3cte.e on the PATH; return the file it logs its runs to."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "wf3cte.e"
+    executable.write_text("#!{0}\n{1}".format(sys.executable, SCRIPT))
+    executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+    log = tmp_path / "wf3cte.log"
+    monkeypatch.setenv("WF3CTE_LOG", str(log))
+    return log
+
+
+def test_thread_budget():
+    budget = ThreadBudget(threads_per_job=3, cpus=range(8))
+    assert budget.max_jobs == 2
+
+    with budget.slot() as env1, budget.slot() as env2:
+        assert env1["OMP_NUM_THREADS"] == "3"
+        assert env1["OMP_PLACES"] == "{0},{1},{2}"
+        assert env2["OMP_PLACES"] == "{3},{4},{5}"
+
+    with pytest.raises(ValueError):
+        ThreadBudget(threads_per_job=16, cpus=range(8))
+
+
+def test_calibrate_cte_threads(tmp_path, fake_wf3cte):
+    raw = tmp_path / "iaa012wdq_raw.fits"
+    raw.write_text("raw")
+
+    best = calibrate_cte_threads(str(raw), cpus=[4, 5, 6, 7])
+
+    assert sorted(best.timings) == [1, 2, 4]
+    assert best.timings[1] > best.timings[2]
+    assert best.throughput[2] == pytest.approx(2 / best.timings[2])
+    assert (best.threads_per_job, best.max_jobs) == (2, 2)
+    runs = [json.loads(line) for line in fake_wf3cte.read_text().splitlines()]
+    assert [run[1:] for run in runs] == [[1, "{4}"], [2, "{4},{5}"], [4, "{4},{5},{6},{7}"]]
+    # every run is on its own copy of the input
+    assert all(run[0] != str(raw) and os.path.basename(run[0]) == raw.name for run in runs)
+    assert raw.read_text() == "raw"
+
+
+def test_calibrate_cte_threads_errors(tmp_path, fake_wf3cte):
+    raw = tmp_path / "fail_raw.fits"
+    raw.write_text("raw")
+
+    with pytest.raises(RuntimeError, match="OPEN_FAILED"):
+        calibrate_cte_threads(str(raw), thread_counts=[1], cpus=[0, 1])
+    with pytest.raises(ValueError, match="between 1 and 2"):
+        calibrate_cte_threads(str(raw), thread_counts=[4], cpus=[0, 1])
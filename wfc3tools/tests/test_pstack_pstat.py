@@ -1,7 +1,7 @@
 import numpy as np
 
 from wfc3tools import pstack, pstat
-from wfc3tools.tests.helpers import BaseWFC3TOOLS
+from wfc3tools.tests.helpers import BaseWFC3TOOLS, make_multiaccum
 
 
 class TestPstack(BaseWFC3TOOLS):
@@ -59,3 +59,46 @@ class TestPstack(BaseWFC3TOOLS):
 
         np.testing.assert_allclose(stat_rate[0], x_truth, rtol=rtol)
         np.testing.assert_allclose(stat_rate[1], rate, rtol=rtol)
+
+
+def _make_multiaccum(path, nsamp=4, shape=(12, 10), bunit="ELECTRONS/S", raw=False):
+    """A small MultiAccum file with known data, and null ERR arrays."""
+    sci = [np.arange(np.prod(shape)).reshape(shape) + 100 * (nsamp - k) for k in range(nsamp)]
+    return make_multiaccum(
+        path,
+        sci,
+        np.arange(nsamp) * 10.0,
+        bunit=bunit,
+        dtype=np.uint16 if raw else np.float32,
+        extensions={"ERR": 2.5},
+    )
+
+
+def test_pstack_section(tmp_path):
+    ima = _make_multiaccum(tmp_path / "test_ima.fits")
+    x, y = pstack(ima, column=3, row=5, units="rate", plot=False)
+    np.testing.assert_allclose(x, [30.0, 20.0, 10.0, 0.0])
+    np.testing.assert_allclose(y[:-1], [153.0, 253.0, 353.0])
+
+    x, y = pstack(ima, column=3, row=5, extname="err", units="rate", plot=False)
+    np.testing.assert_allclose(y[:-1], 2.5)
+
+    # unsigned RAW data, stored with BZERO
+    raw = _make_multiaccum(tmp_path / "test_raw.fits", bunit="COUNTS", raw=True)
+    x, y = pstack(raw, column=9, row=11, plot=False)
+    np.testing.assert_allclose(y[:-1], [219.0, 319.0, 419.0])
+
+
+def test_pstack_many_pixels(tmp_path):
+    ima = _make_multiaccum(tmp_path / "test_ima.fits")
+    columns = np.array([3, 0, 9, 3])
+    rows = np.array([5, 11, 2, 7])
+
+    x, y = pstack(ima, column=columns, row=rows, plot=True)
+
+    assert y.shape == (4, 4)
+    for yaxis, column, row in zip(y, columns, rows):
+        np.testing.assert_allclose(yaxis, pstack(ima, column=column, row=row, plot=False)[1])
+
+    x, y = pstack(ima, column=columns, row=rows, extname="time", plot=False)
+    np.testing.assert_allclose(y[:, :-1], [[30.0, 20.0, 10.0]] * 4)
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from wfc3tools.ramp import CR_FLAG, fit_ima, fit_ramps
+from wfc3tools.tests.helpers import BaseWFC3TOOLS, make_multiaccum
+
+
+def _make_ima(path, rates, samptimes, readnoise=20.0, seed=3):
+    """
+    Write an IMA in ELECTRONS/S of a ramp of ``rates`` electrons per second
+    and a read noise of ``readnoise`` electrons per read; return its counts.
+
+    As `fit_ramps` assumes, the increments are independent, each with the
+    noise of the difference of two reads.
+    """
+    rng = np.random.default_rng(seed)
+    increments = [rng.poisson(rates * dt) + rng.normal(0.0, np.sqrt(2) * readnoise, rates.shape) for dt in np.diff(samptimes)]
+    counts = np.concatenate([np.zeros((1,) + rates.shape), np.cumsum(increments, axis=0)])
+    times = np.broadcast_to(np.asarray(samptimes, dtype=float)[:, None, None], counts.shape)
+    make_multiaccum(
+        path,
+        np.divide(counts, times, out=counts.copy(), where=times > 0),
+        samptimes,
+        extensions={
+            "ERR": np.divide(readnoise, times, out=np.zeros(counts.shape), where=times > 0).astype(np.float32),
+            "DQ": np.zeros(counts.shape, dtype=np.int16),
+            "SAMP": np.broadcast_to(np.arange(len(samptimes), dtype=np.int16)[:, None, None], counts.shape),
+            "TIME": times.astype(np.float32),
+        },
+        header={"READNSEA": readnoise},
+    )
+    return counts
+
+
+def test_fit_ramps():
+    times = np.arange(1, 11) * 25.0
+    counts = np.outer(times, [2.0, 10.0, 50.0]).reshape(10, 1, 3)
+    counts[6:, 0, 1] += 500.0  # cosmic ray between reads 5 and 6
+    dq = np.zeros(counts.shape, dtype=np.int16)
+    dq[8:, 0, 2] = 256  # saturated from read 8
+
+    fit = fit_ramps(counts, times, readnoise=20.0, dq=dq)
+
+    np.testing.assert_allclose(fit.rate, [[2.0, 10.0, 50.0]])
+    assert fit.dq[0, 1] == CR_FLAG
+    assert fit.dq[0, 2] == 256
+    np.testing.assert_array_equal(fit.samp, [[10, 9, 8]])
+    np.testing.assert_allclose(fit.time, [[225.0, 200.0, 175.0]])
+    assert np.all(fit.error > 0)
+
+
+def test_fit_ima(tmp_path):
+    ima = tmp_path / "ib1aaaaaq_ima.fits"
+    rates = np.full((30, 40), 5.0)
+    rates[12, 17] = 400.0
+    samptimes = np.concatenate([[0.0], np.arange(1, 13) * 50.0])
+    _make_ima(ima, rates, samptimes)
+
+    flt = tmp_path / "ib1aaaaaq_flt.fits"
+    fit_ima(str(ima), output=str(flt), chunk_rows=7)
+
+    with fits.open(flt) as hdulist:
+        assert [hdu.name for hdu in hdulist] == ["PRIMARY", "SCI", "ERR", "DQ", "SAMP", "TIME"]
+        assert hdulist[0].header["CRCORR"] == "COMPLETE"
+        sci = hdulist["SCI"].data
+        assert sci.shape == (20, 30)
+        assert sci[7, 12] == pytest.approx(400.0, rel=0.02)
+        assert np.median(sci) == pytest.approx(5.0, rel=0.05)
+        # the scatter of the rates agrees with their errors
+        pulls = (sci - 5.0) / hdulist["ERR"].data
+        pulls[7, 12] = 0.0
+        assert 0.7 < np.std(pulls) < 1.3
+        # every read, from the zeroth at 0 s to the last at 600 s
+        assert np.all(hdulist["SAMP"].data == 13)
+        assert np.all(hdulist["TIME"].data == 600.0)
+
+
+def test_fit_ima_err_readnoise(tmp_path):
+    """Without READNSE keywords, the read noise comes from the ERR of the first read."""
+    ima = tmp_path / "ib1aaaaaq_ima.fits"
+    rates = np.full((30, 40), 5.0)
+    samptimes = np.arange(0, 13) * 50.0
+    _make_ima(ima, rates, samptimes)
+    with fits.open(ima, mode="update") as hdulist:
+        del hdulist[0].header["READNSEA"]
+
+    np.testing.assert_allclose(fit_ima(str(ima))["ERR"].data, fit_ima(str(ima), readnoise=20.0 * np.sqrt(2))["ERR"].data)
+
+
+class TestFitIma(BaseWFC3TOOLS):
+    detector = "ir"
+
+    def test_fit_ima_wf3ir(self):
+        # compare with the FLT written by wf3ir from the same IMA
+        self.get_input_file("ibh719grq_ima.fits", skip_ref=True)
+        self.get_input_file("ibh719grq_flt.fits", skip_ref=True)
+
+        fit = fit_ima("ibh719grq_ima.fits")
+        with fits.open("ibh719grq_flt.fits") as flt:
+            good = (flt["DQ"].data == 0) & (fit["DQ"].data == 0)
+            assert good.sum() > 0.9 * good.size
+            np.testing.assert_allclose(np.median(fit["SCI"].data[good]), np.median(flt["SCI"].data[good]), rtol=0.01)
+            ratio = fit["SCI"].data[good] / flt["SCI"].data[good]
+            assert np.median(np.abs(ratio - 1)) < 0.02
+            np.testing.assert_allclose(fit["TIME"].data[good], flt["TIME"].data[good])
+
+            # every pixel: the two fits weight the same reads differently, which
+            # moves the rate by well under its uncertainty
+            difference = np.abs(fit["SCI"].data - flt["SCI"].data)
+            tolerance = 0.01 * np.abs(flt["SCI"].data) + flt["ERR"].data
+            bad = good & (difference > tolerance)
+            assert not bad.any(), "{0} pixels differ from wf3ir, e.g. at (y, x) = {1}".format(
+                bad.sum(), np.argwhere(bad)[:5].tolist()
+            )
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from wfc3tools.openmp import omp_environ
+from wfc3tools.runner import LogCapture, run_executable, run_executable_async
+
+
+def test_run_executable_success(tmp_path):
+    raw = tmp_path / "iaa012wdq_raw.fits"
+    raw.write_bytes(b"")
+    script = f"open({str(tmp_path / 'iaa012wdq_flt.fits')!r}, 'w').close(); print('line 1'); print('line 2')"
+
+    lines = []
+    result = run_executable([sys.executable, "-c", script], input=str(raw), log_func=lines.append)
+
+    assert result.ok
+    assert result.returncode == 0
+    assert result.error is None
+    assert result.outputs == [str(tmp_path / "iaa012wdq_flt.fits")]
+    assert result.wall_time > 0
+    assert [line.strip() for line in lines] == ["line 1", "line 2"]
+    if hasattr(os, "wait4"):
+        assert result.max_rss > 0
+        assert result.cpu_time >= 0
+
+
+def test_run_executable_output(tmp_path):
+    output = tmp_path / "output.fits"
+    script = f"open({str(output)!r}, 'w').close(); open({str(tmp_path / 'output.tra')!r}, 'w').close()"
+
+    result = run_executable([sys.executable, "-c", script], log_func=None, output=str(output))
+    assert result.outputs == [str(output), str(tmp_path / "output.tra")]
+
+
+def test_run_executable_failure():
+    result = run_executable([sys.executable, "-c", "import sys; sys.exit(115)"], log_func=None)
+
+    assert not result.ok
+    assert result.returncode == 115
+    assert result.error == "CAL_FILE_MISSING"
+    assert result.outputs == []
+
+
+def test_run_executable_env():
+    script = "import os, sys; sys.exit(int(os.environ['OMP_NUM_THREADS']))"
+    result = run_executable([sys.executable, "-c", script], log_func=None, env=omp_environ(3))
+    assert result.returncode == 3
+
+
+def test_run_executable_async():
+    lines = []
+
+    async def log(line):
+        lines.append(line.strip())
+
+    script = "print('a'); print('b')"
+    result = asyncio.run(run_executable_async([sys.executable, "-c", script], log_func=log))
+    assert result.ok
+    assert lines == ["a", "b"]
+
+
+def test_run_executable_async_timeout():
+    script = "import time; time.sleep(30)"
+    t0 = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run_executable_async([sys.executable, "-c", script], log_func=None, timeout=0.5))
+    assert time.monotonic() - t0 < 10
+
+
+LOG_SCRIPT = "for i in range(5000): print('line', i)"
+
+
+def test_log_capture():
+    capture = LogCapture(max_lines=100)
+    result = run_executable([sys.executable, "-c", LOG_SCRIPT], log_func=capture)
+    assert result.ok
+    assert len(capture.lines) == 100
+    assert capture.lines[0] == "line 4900"
+    assert capture.lines[-1] == "line 4999"
+
+    capture = LogCapture(max_lines=None)
+    asyncio.run(run_executable_async([sys.executable, "-c", LOG_SCRIPT], log_func=capture))
+    assert len(capture.lines) == 5000
+
+
+def test_log_file(tmp_path):
+    logfile = tmp_path / "run.log"
+    run_executable([sys.executable, "-c", LOG_SCRIPT], log_func=str(logfile))
+    with open(logfile, "a") as f:
+        run_executable([sys.executable, "-c", "print('appended')"], log_func=f)
+    lines = logfile.read_text().splitlines()
+    assert len(lines) == 5001
+    assert lines[-1] == "appended"
+
+
+def test_slow_log_func():
+    lines = []
+
+    def log(line):
+        time.sleep(0.0001)
+        lines.append(line)
+
+    result = run_executable([sys.executable, "-c", LOG_SCRIPT], log_func=log)
+    assert result.ok
+    assert lines[0] == "line 0\n"
+    assert len(lines) == 5000
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from wfc3tools.scheduler import JobEstimate, calwf3_scheduled, estimate_job, run_scheduled
+
+# Stand-in for calwf3.e: writes a trailer recording its OpenMP thread count.
+SCRIPT = """
+import json, os, sys
+with open(sys.argv[-1][: -len("_raw.fits")] + ".tra", "w") as f:
+    json.dump({"threads": os.environ.get("OMP_NUM_THREADS")}, f)
+"""
+
+
+def _raw(path, detector, naxis, nextend, **keywords):
+    hdr = fits.Header()
+    hdr["DETECTOR"] = detector
+    hdr["NEXTEND"] = nextend
+    for key, value in keywords.items():
+        hdr[key] = value
+    sci = fits.ImageHDU(np.zeros(naxis[::-1], dtype=np.uint16), name="SCI")
+    fits.HDUList([fits.PrimaryHDU(header=hdr), sci]).writeto(path)
+    return str(path)
+
+
+def test_estimate_job(tmp_path):
+    uvis = _raw(tmp_path / "uvis_raw.fits", "UVIS", (1000, 500), 6, PCTECORR="PERFORM")
+    ir = _raw(tmp_path / "ir_raw.fits", "IR", (64, 64), 40, NSAMP=8, SUBARRAY=True)
+
+    big = estimate_job(uvis, cte_threads=8)
+    small = estimate_job(ir)
+    assert big.cores == 8
+    assert small.cores == 1
+    assert big.memory > small.memory
+    assert big.wall_seconds > small.wall_seconds
+
+
+def test_run_scheduled():
+    estimates = [JobEstimate(f"small{i}", memory=1, cpu_seconds=1) for i in range(4)]
+    estimates.append(JobEstimate("big", memory=8, cores=2, cpu_seconds=100))
+    lock = threading.Lock()
+    started = []
+    usage = {"memory": 0, "peak": 0}
+
+    def run(estimate):
+        with lock:
+            started.append(estimate.input)
+            usage["memory"] += estimate.memory
+            usage["peak"] = max(usage["peak"], usage["memory"])
+        time.sleep(0.1)
+        with lock:
+            usage["memory"] -= estimate.memory
+        return estimate.input
+
+    results = run_scheduled(estimates, run, memory=10, cores=4)
+    assert results == [e.input for e in estimates]
+    assert started[0] == "big"
+    assert usage["peak"] <= 10
+
+
+def test_run_scheduled_caps_cores_and_records_errors():
+    estimates = [JobEstimate("big", memory=1, cores=16, cpu_seconds=100), JobEstimate("bad", memory=1)]
+    cores = {}
+
+    def run(estimate):
+        if estimate.input == "bad":
+            raise IOError("Input file not found: bad")
+        cores[estimate.input] = estimate.cores
+        return estimate.input
+
+    results = run_scheduled(estimates, run, memory=10, cores=4)
+    assert results[0] == "big"
+    assert cores == {"big": 4}
+    assert estimates[0].cores == 16
+    assert results[1].input == "bad"
+    assert results[1].returncode == 2
+    assert results[1].error == "Input file not found: bad"
+
+
+def test_calwf3_scheduled(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "calwf3.e"
+    executable.write_text("#!{0}\n{1}".format(sys.executable, SCRIPT))
+    executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+
+    uvis = _raw(tmp_path / "iaa012wdq_raw.fits", "UVIS", (100, 50), 6, PCTECORR="PERFORM")
+    ir = _raw(tmp_path / "ibaa01aaq_raw.fits", "IR", (64, 64), 40, NSAMP=8)
+
+    results = calwf3_scheduled([uvis, ir], memory=1e12, cores=2, cte_threads=8)
+
+    assert [result.input for result in results] == [uvis, ir]
+    assert all(result.ok for result in results)
+    threads = {}
+    for raw in (uvis, ir):
+        with open(raw[: -len("_raw.fits")] + ".tra") as f:
+            threads[raw] = json.load(f)["threads"]
+    # the CTE job asked for 8 threads, but only 2 cores are in the budget
+    assert threads == {uvis: "2", ir: "1"}
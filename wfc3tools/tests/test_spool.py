@@ -0,0 +1,82 @@
+import sqlite3
+import sys
+
+import pytest
+
+from wfc3tools import spool as spool_module
+from wfc3tools.runner import run_executable
+from wfc3tools.spool import JobSpool
+
+# Exits with the code in the input file name, after the given number of failures with OPEN_FAILED
+SCRIPT = """
+import os, sys, time
+name, = sys.argv[1:]
+code, failures = (int(x) for x in os.path.basename(name).split("_")[:2])
+count = int(open(name).read() or 0) if os.path.exists(name) else 0
+open(name, "w").write(str(count + 1))
+if code == 999:
+    time.sleep(30)
+sys.exit(114 if count < failures else code)
+"""
+
+
+@pytest.fixture
+def fake_task(monkeypatch):
+    monkeypatch.setitem(spool_module._TASKS, "fake", lambda input: [sys.executable, "-c", SCRIPT, input])
+
+
+def test_run_executable_timeout():
+    result = run_executable([sys.executable, "-c", "import time; time.sleep(30)"], log_func=None, timeout=0.5)
+    assert result.returncode < 0
+    assert result.error == "TIMEOUT"
+    assert result.wall_time < 10
+
+
+def test_spool(fake_task, tmp_path):
+    db = str(tmp_path / "spool.db")
+    names = {
+        "ok": tmp_path / "0_0_job",
+        "retried": tmp_path / "0_2_job",
+        "missing": tmp_path / "115_0_job",
+        "hung": tmp_path / "999_0_job",
+    }
+    with JobSpool(db) as spool:
+        ids = {key: spool.submit("fake", str(name)) for key, name in names.items()}
+        assert spool.submit("fake", str(names["ok"])) == ids["ok"]
+        counts = spool.run(max_workers=4, max_attempts=3, backoff=0.01, timeout=1.0)
+        assert counts == {"done": 2, "failed": 2}
+
+        jobs = {job["id"]: job for job in spool.jobs()}
+        assert jobs[ids["retried"]]["attempts"] == 3
+        assert jobs[ids["missing"]]["attempts"] == 1
+        assert jobs[ids["missing"]]["error"] == "CAL_FILE_MISSING"
+        assert jobs[ids["hung"]]["attempts"] == 3
+        assert jobs[ids["hung"]]["error"] == "TIMEOUT"
+
+    # a job left running by a driver that died is run again
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE jobs SET state = 'running' WHERE id = ?", (ids["ok"],))
+    with JobSpool(db) as spool:
+        spool.run(max_workers=1)
+        assert spool.counts() == {"done": 2, "failed": 2}
+        assert names["ok"].read_text() == "2"
+
+
+def test_spool_invalid_options(fake_task, tmp_path):
+    db = str(tmp_path / "spool.db")
+    raw = tmp_path / "0_0_job"
+    with JobSpool(db) as spool:
+        with pytest.raises(ValueError, match="Invalid options"):
+            spool.submit("fake", str(raw), nthreads=4)
+        with pytest.raises(IOError):
+            spool.submit("calwf3", str(tmp_path / "missing_raw.fits"))
+        job_id = spool.submit("fake", str(raw))
+
+    # options stored by an older version, or edited by hand, fail the job instead of the run
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE jobs SET options = ? WHERE id = ?", ('{"nthreads": 4}', job_id))
+    with JobSpool(db) as spool:
+        assert spool.run(max_workers=1) == {"failed": 1}
+        (job,) = spool.jobs()
+        assert "nthreads" in job["error"]
+        assert job["attempts"] == 1
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+from astropy.io import fits
+
+from wfc3tools.staging import run_staged, staged_inputs
+
+# Stand-in for an executable: write products named after the input into the
+# working directory, and record where that was.
+SCRIPT = """
+import os, sys
+root = os.path.basename(sys.argv[-1]).split("_")[0]
+for name in (root + "_flt.fits", root + "_blv_tmp.fits", root + ".tra"):
+    with open(name, "w") as f:
+        f.write(os.getcwd())
+sys.exit(int(sys.argv[-2]))
+"""
+
+
+def test_run_staged(tmp_path):
+    raw = tmp_path / "iaa012wdq_raw.fits"
+    raw.write_text("raw")
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+
+    result = run_staged(
+        [sys.executable, "-c", SCRIPT, "0", str(raw)],
+        str(raw),
+        scratch_root=str(scratch),
+        products=["flt", "tra"],
+        log_func=None,
+    )
+
+    assert result.ok
+    assert result.input == str(raw)
+    assert result.outputs == [str(tmp_path / "iaa012wdq.tra"), str(tmp_path / "iaa012wdq_flt.fits")]
+    assert (tmp_path / "iaa012wdq_flt.fits").read_text().startswith(str(scratch))
+    assert not (tmp_path / "iaa012wdq_blv_tmp.fits").exists()
+    assert os.listdir(scratch) == []
+
+    # only the trailer comes back from a failed run
+    os.remove(tmp_path / "iaa012wdq_flt.fits")
+    result = run_staged([sys.executable, "-c", SCRIPT, "114", str(raw)], str(raw), scratch_root=str(scratch), log_func=None)
+    assert result.error == "OPEN_FAILED"
+    assert result.outputs == [str(tmp_path / "iaa012wdq.tra")]
+    assert os.listdir(scratch) == []
+
+
+def test_staged_inputs(tmp_path):
+    asn_data = np.rec.array(
+        [("IAA012WDQ", "EXP-CRJ", True), ("IAA012WEQ", "EXP-CRJ", True), ("IAA012010", "PROD-CRJ", True)],
+        formats="S14,S14,i1",
+        names="MEMNAME,MEMTYPE,MEMPRSNT",
+    )
+    asn = tmp_path / "iaa012010_asn.fits"
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(asn_data)]).writeto(asn)
+    for name in ("iaa012wdq_raw.fits", "iaa012wdq_spt.fits", "iaa012weq_raw.fits"):
+        (tmp_path / name).write_text("")
+
+    assert staged_inputs(str(asn)) == [
+        str(asn),
+        str(tmp_path / "iaa012wdq_raw.fits"),
+        str(tmp_path / "iaa012wdq_spt.fits"),
+        str(tmp_path / "iaa012weq_raw.fits"),
+    ]
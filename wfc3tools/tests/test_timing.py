@@ -0,0 +1,49 @@
+import pytest
+
+from wfc3tools.timing import TimingCollector, aggregate_profiles, parse_timing, read_trailer_timing
+
+TRAILER = """\
+CALBEG*** CALWF3 -- Version 3.7.2 (Apr-15-2024) ***
+Begin    25-Apr-2024 23:59:50 UTC
+WF3CTE*** WF3CTE -- Version 3.7.2 (Apr-15-2024) ***
+PCTECORR PERFORM
+    23:59:55 (   0.10,   0.10) Begin CTE correction
+PCTECORR COMPLETE
+    00:01:05 (  70.00,  70.10) End CTE correction
+WF3CCD*** WF3CCD -- Version 3.7.2 (Apr-15-2024) ***
+DQICORR PERFORM
+DQICORR COMPLETE
+    00:01:07 (   2.00,  72.10) DQICORR done
+BLEVCORR PERFORM
+BLEVCORR COMPLETE
+    00:01:10 (   3.00,  75.10) BLEVCORR done
+FLSHCORR OMIT
+End      26-Apr-2024 00:01:12 UTC
+"""
+
+
+def test_parse_timing():
+    profile = parse_timing(TRAILER)
+
+    assert profile.steps == {
+        "PCTECORR": pytest.approx(75.0),
+        "DQICORR": pytest.approx(2.0),
+        "BLEVCORR": pytest.approx(3.0),
+    }
+    assert profile.total == pytest.approx(82.0)
+    assert "FLSHCORR" not in profile.steps
+    assert profile.format().splitlines()[1].startswith("PCTECORR")
+
+
+def test_trailer_and_aggregate(tmp_path):
+    trailer = tmp_path / "iaa012wdq.tra"
+    trailer.write_text(TRAILER)
+
+    collector = TimingCollector()
+    for line in TRAILER.splitlines(keepends=True):
+        collector(line)
+
+    total = aggregate_profiles([read_trailer_timing(str(trailer)), collector.profile()])
+    assert total.count == 2
+    assert total.steps["PCTECORR"] == pytest.approx(150.0)
+    assert total.fractions()["PCTECORR"] == pytest.approx(150.0 / 164.0)
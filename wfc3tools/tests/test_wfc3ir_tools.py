@@ -0,0 +1,167 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.stats import sigma_clipped_stats
+
+from wfc3tools.tests.helpers import make_multiaccum
+from wfc3tools.wfc3ir_tools import (
+    _calc_avg,
+    background_rates,
+    has_variable_background,
+    make_flattened_ramp_flt_batch,
+)
+
+# Stand-in for calwf3.e, run in the working directory: a RAW makes an IMA of
+# NSAMP reads recording the CRCORR switch of the RAW, and an FLT if CRCORR is
+# PERFORM; an IMA makes an FLT from its last read.
+SCRIPT = """
+import os, sys
+import numpy as np
+from astropy.io import fits
+input = sys.argv[-1]
+root = input[:9]
+with open(root + ".tra", "w") as f:
+    f.write(os.getcwd())
+header = fits.getheader(input)
+if header["FILENAME"] == "fail":
+    sys.exit(114)
+if input.endswith("_raw.fits"):
+    if header["CRCORR"] == "OMIT":
+        assert os.path.isfile(header["ASN_TAB"] if header["ASN_TAB"] != "NONE" else "dummy_asn.fits")
+    header["FILENAME"] = root + "_ima.fits"
+    nsamp = header["NSAMP"]
+    reads = [fits.ImageHDU(np.full((20, 20), 10.0 * (nsamp - i) + i), name="SCI", ver=i + 1) for i in range(nsamp)]
+    fits.HDUList([fits.PrimaryHDU(header=header)] + reads).writeto(root + "_ima.fits")
+if input.endswith("_raw.fits") and header["CRCORR"] == "PERFORM":
+    fits.HDUList([fits.PrimaryHDU(header=header)]).writeto(root + "_flt.fits")
+elif input.endswith("_ima.fits"):
+    with fits.open(input) as ima:
+        flt = fits.HDUList([fits.PrimaryHDU(header=ima[0].header), fits.ImageHDU(ima["SCI", 1].data, name="SCI")])
+        flt.writeto(root + "_flt.fits")
+"""
+
+
+def _make_raw(path, asn_tab="NONE", filename=None, rates=None):
+    """Write a RAW file, with reads of a background of ``rates`` counts per second if given."""
+    header = {"FILENAME": filename or os.path.basename(path), "CRCORR": "PERFORM", "ASN_TAB": asn_tab, "NSAMP": 3}
+    if rates is None:
+        return make_multiaccum(path, header=header)
+    rng = np.random.default_rng(2)
+    counts = 500 + np.cumsum(np.concatenate([[0.0], np.multiply(rates, 10.0)]))
+    sci = [rng.poisson(level, (64, 64)) for level in counts]
+    header["NSAMP"] = len(counts)
+    return make_multiaccum(path, sci, np.arange(len(counts)) * 10.0, bunit="COUNTS", dtype=np.int16, header=header)
+
+
+@pytest.fixture
+def fake_calwf3(tmp_path, monkeypatch):
+    """Put the stand-in calwf3.e on the PATH, and run from an unrelated directory."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "calwf3.e"
+    executable.write_text("#!{0}\n{1}".format(sys.executable, SCRIPT))
+    executable.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}{1}{2}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")))
+    cwd = tmp_path / "cwd"
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+
+
+def test_batch(tmp_path, fake_calwf3):
+    raws = [_make_raw(tmp_path / "ib{0}aaaaaq_raw.fits".format(i)) for i in range(3)]
+    asn = tmp_path / "ib9aaa010_asn.fits"
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(np.rec.array([("IB9AAAAAQ", "EXP-DTH", 1)]))]).writeto(asn)
+    raws.append(_make_raw(tmp_path / "ib9aaaaaq_raw.fits", asn_tab="ib9aaa010_asn.fits"))
+    raws.append(_make_raw(tmp_path / "ibfaaaaaq_raw.fits", filename="fail"))
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+
+    results = make_flattened_ramp_flt_batch(raws, max_workers=4, scratch_root=str(scratch), stats_method="mean")
+
+    assert [result.input for result in results] == raws
+    for raw, result in zip(raws[:4], results):
+        root = raw[:-9]
+        assert result.ok
+        assert result.outputs == [root + ".tra", root + "_flt.fits", root + "_ima.fits"]
+        assert fits.getval(raw, "CRCORR") == "PERFORM"
+        with fits.open(root + "_ima.fits") as ima:
+            # the first IMA was made with CRCORR off, then flattened and switched back on
+            assert ima[0].header["CRCORR"] == "PERFORM"
+            assert np.allclose([ima["SCI", i].data.mean() for i in (2, 3)], 30.0)
+    assert results[-1].error == "OPEN_FAILED"
+    assert results[-1].outputs == [str(tmp_path / "ibfaaaaaq.tra")]
+    assert not (tmp_path / "dummy_asn.fits").exists()
+    assert os.listdir(scratch) == []
+
+
+@pytest.mark.parametrize("keyword", ["CRCORR", "ASN_TAB"])
+def test_batch_bad_raw(tmp_path, fake_calwf3, keyword):
+    """A RAW that cannot be flattened fails alone, without stopping the others."""
+    good = _make_raw(tmp_path / "ib1aaaaaq_raw.fits")
+    bad = _make_raw(tmp_path / "ib2aaaaaq_raw.fits")
+    with fits.open(bad, mode="update") as hdulist:
+        del hdulist[0].header[keyword]
+
+    results = make_flattened_ramp_flt_batch([bad, good], max_workers=2, scratch_root=str(tmp_path))
+
+    assert not results[0].ok
+    assert results[0].input == bad
+    assert results[0].returncode == 2
+    assert keyword in results[0].error
+    assert results[1].ok
+    assert (tmp_path / "ib1aaaaaq_flt.fits").exists()
+
+
+def test_batch_missing_asn(tmp_path, fake_calwf3):
+    raw = _make_raw(tmp_path / "ib1aaaaaq_raw.fits", asn_tab="ib1aaa010_asn.fits")
+    with pytest.raises(IOError, match="ib1aaa010_asn.fits"):
+        make_flattened_ramp_flt_batch(raw)
+
+
+@pytest.mark.parametrize("stats_method", ["mean", "median"])
+def test_calc_avg(stats_method):
+    rng = np.random.default_rng(1)
+    cube = rng.normal(100.0, 5.0, (4, 30, 40)).astype(np.float32) + np.arange(4, dtype=np.float32)[:, None, None]
+    cube[:, 3, 5] = 1e4
+
+    plain = _calc_avg(cube, stats_method, False, None, None, None, None)
+    assert np.allclose(plain, [getattr(np, stats_method)(read) for read in cube])
+
+    clipped = _calc_avg(cube, stats_method, True, 3, None, None, 5)
+    index = 0 if stats_method == "mean" else 1
+    expected = [sigma_clipped_stats(read, sigma=3, maxiters=5)[index] for read in cube]
+    assert np.allclose(clipped, expected)
+    assert np.allclose(_calc_avg(cube, stats_method, True, None, 3, 3, 5), expected)
+
+
+def test_background_rates(tmp_path):
+    constant = _make_raw(tmp_path / "ib1aaaaaq_raw.fits", rates=[20.0] * 8)
+    times, rates, errors = background_rates(constant)
+    assert np.allclose(times, np.arange(8) * 10.0 + 5.0)
+    assert np.allclose(rates, 20.0, atol=5 * errors.max())
+    assert not has_variable_background(constant)
+
+    variable = _make_raw(tmp_path / "ib2aaaaaq_raw.fits", rates=[20.0] * 4 + [40.0] * 4)
+    assert has_variable_background(variable)
+    assert not has_variable_background(variable, rtol=2.0)
+
+
+def test_batch_check_background(tmp_path, fake_calwf3):
+    raws = [
+        _make_raw(tmp_path / "ib1aaaaaq_raw.fits", rates=[20.0] * 8),
+        _make_raw(tmp_path / "ib2aaaaaq_raw.fits", rates=[20.0] * 4 + [40.0] * 4),
+    ]
+    results = make_flattened_ramp_flt_batch(raws, scratch_root=str(tmp_path), check_background=True)
+
+    assert all(result.ok for result in results)
+    # constant background: the RAW is calibrated once, with CRCORR on
+    assert results[0].command[-1] == "ib1aaaaaq_raw.fits"
+    with fits.open(tmp_path / "ib1aaaaaq_ima.fits") as ima:
+        assert ima["SCI", 2].data.mean() == 81.0
+    assert results[1].command[-1] == "ib2aaaaaq_ima.fits"
+    with fits.open(tmp_path / "ib2aaaaaq_ima.fits") as ima:
+        assert ima["SCI", 2].data.mean() == 90.0
+    assert all((tmp_path / name).exists() for name in ("ib1aaaaaq_flt.fits", "ib2aaaaaq_flt.fits"))
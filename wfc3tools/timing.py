@@ -0,0 +1,205 @@
+"""
+Per-step timing profiles from ``calwf3`` output.
+
+With ``printtime=True`` (``calwf3``) or ``verbose=True`` (``wf3ccd``,
+``wf32d``, ``wf3ir``, ``wf3rej``) the executables add time stamps to their
+output, which also ends up in the ``.tra`` trailer file.  Each calibration
+step is reported as ``<STEP> PERFORM`` when it starts and
+``<STEP> COMPLETE`` (or ``SKIPPED``) when it ends.  The time spent in a step
+is taken as the difference between the last time stamp before it starts and
+the first time stamp after it ends, so the profile is only as fine as the
+time stamps in the output.  Without time stamps only the ``Begin`` and
+``End`` times of each task are known, and the steps get no time.
+
+Profiles of many runs can be added up with `aggregate_profiles` to find the
+steps that dominate the processing time of a batch.
+
+.. code-block:: python
+
+    >>> from wfc3tools import calwf3
+    >>> from wfc3tools.timing import TimingCollector
+    >>> collector = TimingCollector()
+    >>> calwf3('iaa012wdq_raw.fits', printtime=True, log_func=collector)
+    >>> print(collector.profile().format())
+    STEP          SECONDS  FRACTION
+    PCTECORR       412.00     0.861
+    FLATCORR        21.00     0.044
+    ...
+
+    >>> from glob import glob
+    >>> from wfc3tools.timing import aggregate_profiles, read_trailer_timing
+    >>> total = aggregate_profiles(read_trailer_timing(f) for f in glob('*.tra'))
+
+"""
+
+import re
+from dataclasses import dataclass, field
+
+__all__ = ["TimingCollector", "TimingProfile", "aggregate_profiles", "parse_timing", "read_trailer_timing"]
+
+_STEP_RE = re.compile(r"^\s*([A-Z0-9]+CORR)\s+(PERFORM|COMPLETE|SKIPPED)\b")
+_TIME_RE = re.compile(r"\b(\d{1,2}):(\d{2}):(\d{2}(?:\.\d+)?)\b")
+
+
+@dataclass
+class TimingProfile:
+    """
+    Time spent in each calibration step of one or more runs.
+
+    Attributes
+    ----------
+    steps : dict
+        Seconds spent in each step, keyed by switch name (e.g. ``"FLATCORR"``).
+    total : float
+        Seconds between the first and the last time stamp of the run(s).
+    count : int
+        Number of runs the profile covers.
+    source : str or None
+        Trailer file the profile was read from, if any.
+    """
+
+    steps: dict = field(default_factory=dict)
+    total: float = 0.0
+    count: int = 1
+    source: str = None
+
+    def fractions(self):
+        """Return the fraction of the total time spent in each step."""
+        if self.total <= 0:
+            return {step: 0.0 for step in self.steps}
+        return {step: seconds / self.total for step, seconds in self.steps.items()}
+
+    def format(self):
+        """Return the profile as a text table, most expensive step first."""
+        fractions = self.fractions()
+        lines = ["STEP          SECONDS  FRACTION"]
+        for step, seconds in sorted(self.steps.items(), key=lambda item: -item[1]):
+            lines.append("%-10s %10.2f %9.3f" % (step, seconds, fractions[step]))
+        lines.append("%-10s %10.2f" % ("TOTAL", self.total))
+        return "\n".join(lines)
+
+
+def parse_timing(lines, source=None):
+    """
+    Build a `TimingProfile` from the output of a calibration run.
+
+    Parameters
+    ----------
+    lines : str or iterable of str
+        The output of the executable, as one string or as lines.
+
+    source : str, optional
+        Name recorded as the source of the profile. Default is `None`.
+
+    Returns
+    -------
+    profile : `TimingProfile`
+        Seconds spent in each step that was performed.
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
+    steps = {}
+    started = {}  # step -> time stamp before it started
+    finished = []  # steps waiting for the next time stamp
+    first = last = None
+    offset = 0.0
+
+    for line in lines:
+        match = _STEP_RE.match(line)
+        if match:
+            step, state = match.groups()
+            if state == "PERFORM":
+                started[step] = last
+            elif step in started:
+                finished.append(step)
+            continue
+
+        match = _TIME_RE.search(line)
+        if match is None:
+            continue
+        hours, minutes, seconds = match.groups()
+        stamp = int(hours) * 3600 + int(minutes) * 60 + float(seconds) + offset
+        if last is not None and stamp < last:
+            # the run went past midnight
+            offset += 86400.0
+            stamp += 86400.0
+        if first is None:
+            first = stamp
+        last = stamp
+
+        for step in finished:
+            begin = started.pop(step)
+            if begin is not None:
+                steps[step] = steps.get(step, 0.0) + (stamp - begin)
+        finished = []
+
+    total = 0.0 if first is None else last - first
+    return TimingProfile(steps=steps, total=total, source=source)
+
+
+def read_trailer_timing(trailer):
+    """
+    Build a `TimingProfile` from a ``.tra`` trailer file.
+
+    Parameters
+    ----------
+    trailer : str
+        Name of the trailer file.
+
+    Returns
+    -------
+    profile : `TimingProfile`
+        Seconds spent in each step that was performed.
+    """
+    with open(trailer, errors="replace") as f:
+        return parse_timing(f, source=trailer)
+
+
+def aggregate_profiles(profiles):
+    """
+    Add up the profiles of many runs.
+
+    Parameters
+    ----------
+    profiles : iterable of `TimingProfile`
+        Profiles to combine.
+
+    Returns
+    -------
+    profile : `TimingProfile`
+        Total seconds per step and overall, with ``count`` set to the number
+        of runs combined.
+    """
+    combined = TimingProfile(count=0)
+    for profile in profiles:
+        for step, seconds in profile.steps.items():
+            combined.steps[step] = combined.steps.get(step, 0.0) + seconds
+        combined.total += profile.total
+        combined.count += profile.count
+    return combined
+
+
+class TimingCollector:
+    """
+    A ``log_func`` that keeps the output of a run for `parse_timing`.
+
+    Parameters
+    ----------
+    log_func : func or None
+        Also called with every line, so the output is still shown. Default is
+        `None`.
+    """
+
+    def __init__(self, log_func=None):
+        self.log_func = log_func
+        self.lines = []
+
+    def __call__(self, line):
+        self.lines.append(line)
+        if self.log_func is not None:
+            self.log_func(line)
+
+    def profile(self):
+        """Return the `TimingProfile` of the output collected so far."""
+        return parse_timing(self.lines)
@@ -15,12 +15,8 @@ more information.
 
 """
 
-import os.path
-import subprocess
-
-from stsci.tools import parseinput
-
-from .util import error_code
+from .inputs import expand_inputs
+from .runner import run_executable
 
 __all__ = ["wf32d"]
 
@@ -90,9 +86,17 @@ def wf32d(
     debug : bool, optional
         If `True`, print debugging statements. Default is `False`.
 
-    log_func : func
+    log_func : func, file, str, or `~wfc3tools.runner.LogCapture`
         By default, the print function is used for logging to facilitate
-        use in the Jupyter notebook.
+        use in the Jupyter notebook. For long runs, an open file, a file name,
+        or a `~wfc3tools.runner.LogCapture` takes the output with no Python
+        call per line. If `None`, the output is discarded.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        Summary of the run: command line, return code, wall and CPU time,
+        peak memory, and the products written.
 
     Examples
     --------
@@ -102,8 +106,44 @@ def wf32d(
 
     """
 
+    call_list = _wf32d_call_list(
+        input,
+        output=output,
+        dqicorr=dqicorr,
+        darkcorr=darkcorr,
+        flatcorr=flatcorr,
+        shadcorr=shadcorr,
+        photcorr=photcorr,
+        verbose=verbose,
+        quiet=quiet,
+        debug=debug,
+    )
+
+    result = run_executable(call_list, input=input, log_func=log_func, output=output)
+    if result.returncode:
+        ec = result.error
+        if ec is None:
+            print("Unknown return code found!")
+            ec = result.returncode
+        raise RuntimeError("wf32d.e exited with code {}".format(ec))
+
+    return result
+
+
+def _wf32d_call_list(
+    input,
+    output=None,
+    dqicorr="PERFORM",
+    darkcorr="PERFORM",
+    flatcorr="PERFORM",
+    shadcorr="PERFORM",
+    photcorr="PERFORM",
+    verbose=False,
+    quiet=True,
+    debug=False,
+):
+    """Validate the wf32d input and build the ``wf32d.e`` command line."""
     call_list = ["wf32d.e"]
-    return_code = None
 
     if verbose:
         call_list += ["-v", "-t"]
@@ -126,36 +166,17 @@ def wf32d(
     if photcorr == "PERFORM":
         call_list.append("-phot")
 
-    infiles, dummy = parseinput.parseinput(input)
+    infiles = expand_inputs(input)
     if "_asn" in input:
         raise IOError("wf32d does not accept association tables")
-    if len(parseinput.irafglob(input)) == 0:
+    if len(infiles) == 0:
         raise IOError("No valid image specified")
-    if len(parseinput.irafglob(input)) > 1:
+    if len(infiles) > 1:
         raise IOError("wf32d can only accept 1 file forinput at a time: {0}".format(infiles))
 
-    for image in infiles:
-        if not os.path.exists(image):
-            raise IOError("Input file not found: {0}".format(image))
-
     call_list.append(input)
 
     if output:
         call_list.append(str(output))
 
-    proc = subprocess.Popen(
-        call_list,
-        stderr=subprocess.STDOUT,
-        stdout=subprocess.PIPE,
-    )
-    if log_func is not None:
-        for line in proc.stdout:
-            log_func(line.decode("utf8"))
-
-    return_code = proc.wait()
-    ec = error_code(return_code)
-    if return_code:
-        if ec is None:
-            print("Unknown return code found!")
-            ec = return_code
-        raise RuntimeError("wf32d.e exited with code {}".format(ec))
+    return call_list
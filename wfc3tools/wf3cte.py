@@ -1,13 +1,14 @@
 """Run wf3cte step in calwf3."""
 
-import subprocess
-
-from stsci.tools import parseinput
+from .cache import cte_cached_run
+from .inputs import expand_inputs, member_files
+from .openmp import omp_environ
+from .runner import run_executable
 
 __all__ = ["wf3cte"]
 
 
-def wf3cte(input, parallel=True, verbose=False, log_func=print):
+def wf3cte(input, parallel=True, verbose=False, log_func=print, nthreads=None, cache=None):
     """
     Run the ``wf3cte.e`` executable as from the shell.
 
@@ -32,9 +33,27 @@ def wf3cte(input, parallel=True, verbose=False, log_func=print):
     verbose: bool, optional
         If True, print verbose time stamps. Default is `False`.
 
-    log_func : func
+    log_func : func, file, str, or `~wfc3tools.runner.LogCapture`
         By default, the print function is used for logging to facilitate
-        use in the Jupyter notebook.
+        use in the Jupyter notebook. For long runs, an open file, a file name,
+        or a `~wfc3tools.runner.LogCapture` takes the output with no Python
+        call per line. If `None`, the output is discarded.
+
+    nthreads : int, optional
+        Number of OpenMP threads used when ``parallel`` is `True`. Default is
+        `None`, which uses the OpenMP default of one thread per CPU.
+
+    cache : `~wfc3tools.cache.CTECache` or str, optional
+        If given, the ``_rac_tmp.fits`` of an input whose pixels, CTE reference
+        files and wf3cte version are unchanged is restored from the cache
+        instead of being computed again, and new ones are added to it. See
+        `wfc3tools.cache`. Default is `None`.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        Summary of the run: command line, return code, wall and CPU time,
+        peak memory, and the products written.
 
     Examples
     --------
@@ -44,6 +63,28 @@ def wf3cte(input, parallel=True, verbose=False, log_func=print):
 
     """
 
+    call_list = _wf3cte_call_list(input, parallel=parallel, verbose=verbose)
+
+    print(call_list)
+
+    env = omp_environ(nthreads) if nthreads else None
+
+    def run(infiles):
+        run_list = call_list[:-1] + [",".join(infiles)]
+        return run_executable(run_list, input=_single_input(run_list), log_func=log_func, env=env)
+
+    if cache is not None:
+        result = cte_cached_run(cache, call_list[-1].split(","), run)
+    else:
+        result = run(call_list[-1].split(","))
+    if result.returncode != 0:
+        raise RuntimeError("wf3cte.e exited with code {}".format(result.returncode))
+
+    return result
+
+
+def _wf3cte_call_list(input, parallel=True, verbose=False):
+    """Build the ``wf3cte.e`` command line."""
     call_list = ["wf3cte.e"]
 
     if verbose:
@@ -52,20 +93,13 @@ def wf3cte(input, parallel=True, verbose=False, log_func=print):
     if not parallel:
         call_list.append("-1")
 
-    infiles, dummy_out = parseinput.parseinput(input)
+    infiles = member_files(expand_inputs(input))
     call_list.append(",".join(infiles))
 
-    print(call_list)
+    return call_list
+
 
-    proc = subprocess.Popen(
-        call_list,
-        stderr=subprocess.STDOUT,
-        stdout=subprocess.PIPE,
-    )
-    if log_func is not None:
-        for line in proc.stdout:
-            log_func(line.decode("utf8"))
-
-    return_code = proc.wait()
-    if return_code != 0:
-        raise RuntimeError("wf3cte.e exited with code {}".format(return_code))
+def _single_input(call_list):
+    """Return the input file of a ``wf3cte.e`` command line if there is only one."""
+    infiles = call_list[-1]
+    return None if "," in infiles else infiles
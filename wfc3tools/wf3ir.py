@@ -24,12 +24,8 @@ more information.
 
 """
 
-import os.path
-import subprocess
-
-from stsci.tools import parseinput
-
-from .util import error_code
+from .inputs import expand_inputs
+from .runner import run_executable
 
 __all__ = ["wf3ir"]
 
@@ -62,9 +58,17 @@ def wf3ir(input, output=None, verbose=False, quiet=True, log_func=print):
         If `True`, print messages only to trailer file.
         Default is `True`.
 
-    log_func : func
+    log_func : func, file, str, or `~wfc3tools.runner.LogCapture`
         By default, the print function is used for logging to facilitate
-        use in the Jupyter notebook.
+        use in the Jupyter notebook. For long runs, an open file, a file name,
+        or a `~wfc3tools.runner.LogCapture` takes the output with no Python
+        call per line. If `None`, the output is discarded.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        Summary of the run: command line, return code, wall and CPU time,
+        peak memory, and the products written.
 
     Examples
     --------
@@ -74,42 +78,42 @@ def wf3ir(input, output=None, verbose=False, quiet=True, log_func=print):
 
     """
 
+    call_list = _wf3ir_call_list(
+        input,
+        output=output,
+        verbose=verbose,
+        quiet=quiet,
+    )
+
+    result = run_executable(call_list, input=input, log_func=log_func, output=output)
+    if result.returncode:
+        ec = result.error
+        if ec is None:
+            print("Unknown return code found!")
+            ec = result.returncode
+        raise RuntimeError("wf3ir.e exited with code {}".format(ec))
+
+    return result
+
+
+def _wf3ir_call_list(input, output=None, verbose=False, quiet=True):
+    """Validate the wf3ir input and build the ``wf3ir.e`` command line."""
     call_list = ["wf3ir.e"]
-    return_code = None
 
     if verbose:
         call_list += ["-v", "-t"]
 
-    infiles, dummy = parseinput.parseinput(input)
+    infiles = expand_inputs(input)
     if "_asn" in input:
         raise IOError("wf3ir does not accept association tables")
-    if len(parseinput.irafglob(input)) == 0:
+    if len(infiles) == 0:
         raise IOError("No valid image specified")
-    if len(parseinput.irafglob(input)) > 1:
+    if len(infiles) > 1:
         raise IOError("wf3ir can only accept 1 file forinput at a time: {0}".format(infiles))
 
-    for image in infiles:
-        if not os.path.exists(image):
-            raise IOError("Input file not found: {0}".format(image))
-
     call_list.append(input)
 
     if output:
         call_list.append(str(output))
 
-    proc = subprocess.Popen(
-        call_list,
-        stderr=subprocess.STDOUT,
-        stdout=subprocess.PIPE,
-    )
-    if log_func is not None:
-        for line in proc.stdout:
-            log_func(line.decode("utf8"))
-
-    return_code = proc.wait()
-    ec = error_code(return_code)
-    if return_code:
-        if ec is None:
-            print("Unknown return code found!")
-            ec = return_code
-        raise RuntimeError("wf3ir.e exited with code {}".format(ec))
+    return call_list
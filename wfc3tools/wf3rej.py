@@ -1,11 +1,9 @@
 """Run wf3rej step in calwf3."""
 
 import os.path
-import subprocess
 
-from stsci.tools import parseinput
-
-from .util import error_code
+from .inputs import expand_inputs, member_files
+from .runner import run_executable
 
 __all__ = ["wf3rej"]
 
@@ -91,9 +89,17 @@ def wf3rej(
     verbose : bool, optional
         If `True`, print verbose time stamps. Default is `False`.
 
-    log_func : func
+    log_func : func, file, str, or `~wfc3tools.runner.LogCapture`
         By default, the print function is used for logging to facilitate
-        use in the Jupyter notebook.
+        use in the Jupyter notebook. For long runs, an open file, a file name,
+        or a `~wfc3tools.runner.LogCapture` takes the output with no Python
+        call per line. If `None`, the output is discarded.
+
+    Returns
+    -------
+    result : `~wfc3tools.runner.RunResult`
+        Summary of the run: command line, return code, wall and CPU time,
+        peak memory, and the products written.
 
     Examples
     --------
@@ -106,10 +112,51 @@ def wf3rej(
     >>> wf3rej("@input.lst", "output.fits", verbose=True)
     """
 
+    call_list = _wf3rej_call_list(
+        input,
+        output,
+        crrejtab=crrejtab,
+        scalense=scalense,
+        initgues=initgues,
+        skysub=skysub,
+        crsigmas=crsigmas,
+        crradius=crradius,
+        crthresh=crthresh,
+        badinpdq=badinpdq,
+        crmask=crmask,
+        shadcorr=shadcorr,
+        verbose=verbose,
+    )
+
+    result = run_executable(call_list, log_func=log_func, output=output)
+    if result.returncode:
+        ec = result.error
+        if ec is None:
+            raise RuntimeError(f"wf3rej.e exited with unknown return code {result.returncode}.")
+        raise RuntimeError(f"wf3rej.e exited with return code {ec}.")
+
+    return result
+
+
+def _wf3rej_call_list(
+    input,
+    output,
+    crrejtab="",
+    scalense=0.0,
+    initgues="",
+    skysub="",
+    crsigmas="",
+    crradius=0.0,
+    crthresh=0.0,
+    badinpdq=0,
+    crmask=False,
+    shadcorr=False,
+    verbose=False,
+):
+    """Validate the wf3rej inputs and build the ``wf3rej.e`` command line."""
     call_list = ["wf3rej.e"]
-    return_code = None
 
-    infiles, dummy = parseinput.parseinput(input)
+    infiles = member_files(expand_inputs(input))
 
     for image in infiles:
         if not os.path.exists(image):
@@ -172,18 +219,4 @@ def wf3rej(
     else:
         raise ValueError("Invalid DQ value specified")
 
-    proc = subprocess.Popen(
-        call_list,
-        stderr=subprocess.STDOUT,
-        stdout=subprocess.PIPE,
-    )
-    if log_func is not None:
-        for line in proc.stdout:
-            log_func(line.decode("utf8"))
-
-    return_code = proc.wait()
-    ec = error_code(return_code)
-    if return_code:
-        if ec is None:
-            raise RuntimeError(f"wf3rej.e exited with unknown return code {return_code}.")
-        raise RuntimeError(f"wf3rej.e exited with return code {ec}.")
+    return call_list
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from astropy.io import fits
@@ -6,10 +7,17 @@ from astropy.stats import sigma_clipped_stats
 
 from wfc3tools import calwf3
 
-__all__ = ["make_flattened_ramp_flt"]
+from .batch import _expand_inputs
+from .calwf3 import _calwf3_call_list
+from .headers import update_header
+from .multiaccum import MultiAccumCube
+from .runner import RunResult, run_executable
+from .staging import ScratchDir, default_scratch_root, staged_inputs
 
+__all__ = ["background_rates", "has_variable_background", "make_flattened_ramp_flt", "make_flattened_ramp_flt_batch"]
 
-def _reprocess_raw_crcorr(raw_file):
+
+def _reprocess_raw_crcorr(raw_file, run=calwf3, workdir=""):
     """Utilize calwf3 to make IMA from RAW, turning CRCORR switch off.
 
     Output FLT, FLC, and TRA are deleted after calwf3 completes.
@@ -19,6 +27,11 @@ def _reprocess_raw_crcorr(raw_file):
     ----------
     raw_file : str
         RAW file to process.
+    run : func
+        Runs calwf3 on a file, raising `RuntimeError` if it fails. Defaults to `calwf3`.
+    workdir : str
+        Directory where calwf3 writes its products, and where the dummy ASN is written.
+        Defaults to the working directory.
 
     Returns
     -------
@@ -27,62 +40,221 @@ def _reprocess_raw_crcorr(raw_file):
     """
     rootname = os.path.basename(raw_file)[0:9]
 
-    with fits.open(raw_file, mode="update") as raw_hdu:
-        orig_crcorr = raw_hdu[0].header["CRCORR"]
-        raw_hdu[0].header["CRCORR"] = "OMIT"
-        asn_tab = raw_hdu[0].header["ASN_TAB"]
+    raw_header = fits.getheader(raw_file)
+    orig_crcorr = raw_header["CRCORR"]
+    asn_tab = raw_header["ASN_TAB"]
+    raw_header["CRCORR"] = "OMIT"
 
-        # TODO: Remove this block to make dummy ASN when calwf3 is patched.
-        if asn_tab == "NONE":
-            asn_tab = "dummy_asn.fits"
-            new_asn_tab = np.rec.array([(rootname, "EXP-DTH", 1)], formats="S14,S14,i1", names="MEMNAME,MEMTYPE,MEMPRSNT")
-            hdu_1 = fits.BinTableHDU(new_asn_tab)
-            none_hdu_list = fits.HDUList([raw_hdu[0], hdu_1])
-            none_hdu_list.writeto(asn_tab, overwrite=True)
+    # TODO: Remove this block to make dummy ASN when calwf3 is patched.
+    if asn_tab == "NONE":
+        asn_tab = "dummy_asn.fits"
+        new_asn_tab = np.rec.array([(rootname, "EXP-DTH", 1)], formats="S14,S14,i1", names="MEMNAME,MEMTYPE,MEMPRSNT")
+        hdu_1 = fits.BinTableHDU(new_asn_tab)
+        none_hdu_list = fits.HDUList([fits.PrimaryHDU(header=raw_header), hdu_1])
+        none_hdu_list.writeto(os.path.join(workdir, asn_tab), overwrite=True)
 
     # If part of an association, assert ASN is in same directory as RAW
     # so we can catch error now because IMA cannot run though the pipeline without the ASN.
-    if not os.path.isfile(asn_tab):
+    if not os.path.isfile(os.path.join(workdir, asn_tab)):
         raise OSError(f"{asn_tab} must be in same directory as RAW file.")
 
     # Remove any outputs from previous run so calwf3 does not crash.
     for ext in ("flt", "flc", "ima"):
-        f = f"{rootname}_{ext}.fits"
+        f = os.path.join(workdir, f"{rootname}_{ext}.fits")
         if os.path.isfile(f):
             os.remove(f)
 
-    # Run calwf3
-    calwf3(raw_file)
+    # Run calwf3, with CRCORR switched off by editing only the header blocks of the RAW
+    update_header(raw_file, {"CRCORR": "OMIT"})
+    try:
+        run(raw_file)
+    finally:
+        # Restore original CRCORR
+        update_header(raw_file, {"CRCORR": orig_crcorr})
 
     # Removing resulting FL? and TRA, we just want IMA generated with CRCORR off
     for ext in ("flt", "flc"):
-        f = f"{rootname}_{ext}.fits"
+        f = os.path.join(workdir, f"{rootname}_{ext}.fits")
         if os.path.isfile(f):
             os.remove(f)
-    f = f"{rootname}.tra"
+    f = os.path.join(workdir, f"{rootname}.tra")
     if os.path.isfile(f):
         os.remove(f)
 
-    # Restore original CRCORR
-    with fits.open(raw_file, mode="update") as raw_hdu:
-        raw_hdu[0].header["CRCORR"] = orig_crcorr
-
-    return f"{rootname}_ima.fits"
+    return os.path.join(workdir, f"{rootname}_ima.fits")
 
 
 def _calc_avg(data, stats_method, sigma_clip, sigma, sigma_upper, sigma_lower, iters):
-    """Returns a mean or median from an array, with optional sigma clipping."""
+    """Returns the mean or median of each read of a (nsamp, ny, nx) cube, with optional sigma clipping.
+
+    All reads are clipped together, each against its own statistics, in one call.
+    """
     if not sigma_clip:
         if stats_method == "median":
-            return np.median(data)
-        return np.mean(data)
+            return np.median(data, axis=(1, 2))
+        return np.mean(data, axis=(1, 2))
     else:
-        mean, med, s = sigma_clipped_stats(data, sigma=sigma, sigma_lower=sigma_lower, sigma_upper=sigma_upper, iters=iters)
+        # sigma is only unset when both sigma_lower and sigma_upper are given, and then unused
+        mean, med, s = sigma_clipped_stats(
+            data,
+            sigma=3.0 if sigma is None else sigma,
+            sigma_lower=sigma_lower,
+            sigma_upper=sigma_upper,
+            maxiters=iters,
+            axis=(1, 2),
+        )
         if stats_method == "median":
             return med
         return mean
 
 
+def _stats_slices(sci_header, stats_subregion):
+    """Return the (y, x) slices of the statistics region of a read."""
+    # Default to whole image minus the 5 overscan pixels
+    if stats_subregion is None:
+        xmin = ymin = 5
+        xmax = sci_header["NAXIS1"]
+        ymax = sci_header["NAXIS2"]
+    else:  # ((xmin, xmax), (ymin, ymax))
+        xmin = stats_subregion[0][0]
+        xmax = stats_subregion[0][1]
+        ymin = stats_subregion[1][0]
+        ymax = stats_subregion[1][1]
+    return slice(ymin, ymax), slice(xmin, xmax)
+
+
+def background_rates(filename, stats_subregion=None):
+    """Measure the background count rate between successive reads of a RAW or IMA file.
+
+    The rate of each interval is the median of the difference of the two reads over
+    the statistics region, divided by the time between them, so sources cancel out.
+
+    Parameters
+    ----------
+    filename : str
+        RAW or IMA file.
+    stats_subregion : tuple or None
+        Tuple of ``((xmin, xmax), (ymin, ymax))`` to specify the region used.
+        Defaults to whole image, excluding the 5-pixel overscan region.
+
+    Returns
+    -------
+    times : array
+        Mid time of each interval in seconds, in increasing order.
+    rates : array
+        Background rate in each interval, in units of BUNIT per second
+        (BUNIT times seconds for IMA files, whose reads are count rates).
+    errors : array
+        Statistical uncertainty of each rate.
+    """
+    with MultiAccumCube(filename) as cube:
+        sly, slx = _stats_slices(cube.index.header("SCI", 1), stats_subregion)
+        samptime = cube.samptime
+        reads = cube.to_counts(cube.sci[:, sly, slx])
+
+    # reads are stored last first
+    order = np.argsort(samptime)
+    samptime = samptime[order]
+    reads = reads[order]
+    keep = np.diff(samptime) > 0
+    dt = np.diff(samptime)[keep]
+    diffs = np.diff(reads, axis=0)[keep].reshape(keep.sum(), -1)
+
+    medians = np.median(diffs, axis=1)
+    mad_std = 1.4826 * np.median(np.abs(diffs - medians[:, None]), axis=1)
+    times = (samptime[:-1][keep] + samptime[1:][keep]) / 2
+    return times, medians / dt, 1.253 * mad_std / np.sqrt(diffs.shape[1]) / dt
+
+
+def has_variable_background(filename, stats_subregion=None, nsigma=5.0, rtol=0.05):
+    """Test whether the background of a RAW or IMA file varies over the ramp.
+
+    The background is variable when the rate of some interval between reads (see
+    `background_rates`) differs from the median rate both by more than ``nsigma``
+    times its uncertainty and by more than ``rtol`` times the median rate.
+
+    Parameters
+    ----------
+    filename : str
+        RAW or IMA file.
+    stats_subregion : tuple or None
+        Region used, see `background_rates`.
+    nsigma : float
+        Significance threshold. Defaults to 5.
+    rtol : float
+        Smallest relative variation considered. Defaults to 0.05.
+
+    Returns
+    -------
+    variable : bool
+        `True` if the background rate is not consistent with a constant.
+    """
+    times, rates, errors = background_rates(filename, stats_subregion=stats_subregion)
+    reference = np.median(rates)
+    deviation = np.abs(rates - reference)
+    return bool(np.any((deviation > nsigma * errors) & (deviation > rtol * abs(reference))))
+
+
+def _check_stats_options(stats_method, sigma_clip, sigma, sigma_upper, sigma_lower):
+    """Check the statistics options of `make_flattened_ramp_flt`."""
+    if stats_method not in ("median", "mean"):
+        raise ValueError("stats_method must be mean or median")
+
+    if sigma_clip and not sigma and (not sigma_upper or not sigma_lower):
+        raise ValueError("Must set sigma, or both sigma_upper and sigma_lower.")
+
+
+def _flatten(
+    raw_file,
+    run,
+    workdir,
+    stats_subregion,
+    stats_method,
+    sigma_clip,
+    sigma,
+    sigma_upper,
+    sigma_lower,
+    iters,
+    check_background=False,
+):
+    """Make the flattened IMA and FLT of ``raw_file`` in ``workdir``, running calwf3 with ``run``.
+
+    Returns `False` if ``check_background`` found the background constant, and calwf3
+    was only run once, as usual.
+    """
+    if check_background and not has_variable_background(raw_file, stats_subregion=stats_subregion):
+        rootname = os.path.basename(raw_file)[0:9]
+        for ext in ("flt", "flc", "ima"):
+            f = os.path.join(workdir, f"{rootname}_{ext}.fits")
+            if os.path.isfile(f):
+                os.remove(f)
+        run(raw_file)
+        return False
+
+    # Run calwf3 without CRCORR to make IMA
+    ima_file = _reprocess_raw_crcorr(raw_file, run=run, workdir=workdir)
+
+    # Update the new flattened IMA
+    with MultiAccumCube(ima_file, mode="update") as ima:
+        sly, slx = _stats_slices(ima.index.header("SCI", 1), stats_subregion)
+
+        # Subtract per-read median countrate scalar and add back in full exposure countrate
+        # to preserve pixel statistics. The statistics region of every read is read into
+        # one (nsamp, ny, nx) cube so that the statistics of all reads take a single pass.
+        averages = _calc_avg(ima.sci[:, sly, slx], stats_method, sigma_clip, sigma, sigma_upper, sigma_lower, iters)
+        total_countrate = averages[0]
+
+        for i in range(1, ima.nsamp):
+            ima.sci[i] += total_countrate - averages[i]
+
+        # Turn on ramp fitting
+        ima.header["CRCORR"] = "PERFORM"
+
+    # Run calwf3 on modified IMA
+    run(ima_file)
+    return True
+
+
 def make_flattened_ramp_flt(
     raw_file,
     stats_subregion=None,
@@ -92,13 +264,16 @@ def make_flattened_ramp_flt(
     sigma_upper=None,
     sigma_lower=None,
     iters=None,
+    check_background=False,
 ):
     """
     Corrects for non-variable background and produce a 'flattened' FLT and IMA.
 
     This function must run in the working directory with data files.
     CRCORR value in RAW will be temporarily changed; if you are worried about the
-    integrity of RAW contents, please keep a pristine copy elsewhere.
+    integrity of RAW contents, please keep a pristine copy elsewhere. To process
+    several RAW files at once, or without changing them, use
+    `make_flattened_ramp_flt_batch`.
 
     Users supply a RAW file, which is used to create an IMA file with calwf3 with the CRCORR
     switch set to OMIT. Then, the average background level from each read of the IMA is
@@ -113,6 +288,11 @@ def make_flattened_ramp_flt(
     will default to the median over the whole image excluding the 5 pixel overscan
     region on the border.
 
+    With ``check_background=True``, the background rate of the RAW reads is tested
+    first (see `has_variable_background`). If it is consistent with a constant, the
+    RAW is calibrated once as usual, with its own CRCORR switch, and the IMA and FLT
+    are not flattened; this saves the second calwf3 run for most exposures.
+
     The following output files will be created:
 
     * ``dummy_asn.fits`` (if dummy ASN is needed for processing)
@@ -146,51 +326,167 @@ def make_flattened_ramp_flt(
         limit. This is ignored when ``sigma_clip=False``. If `None` when
         ``sigma_clip=True``, then the value of ``sigma`` is used. Defaults to `None`.
     iters : int or None
-        The number of iterations to perform sigma clipping. This is ignored when
-        ``sigma_clip=False`` and must be set to a number if ``sigma_clip=True``.
-        Defaults to `None`.
-    """
-    if stats_method not in ("median", "mean"):
-        raise ValueError("stats_method must be mean or median")
-
-    if sigma_clip and not sigma and (not sigma_upper or not sigma_lower):
-        raise ValueError("Must set sigma, or both sigma_upper and sigma_lower.")
-
-    # Run calwf3 without CRCORR to make IMA
-    ima_file = _reprocess_raw_crcorr(raw_file)
-
-    # Update the new flattened IMA
-    with fits.open(ima_file, mode="update") as ima_hdu:
-        sci_1_header = ima_hdu["SCI", 1].header
-        naxis1 = sci_1_header["NAXIS1"]
-        naxis2 = sci_1_header["NAXIS2"]
-
-        # Default to whole image minus the 5 overscan pixels
-        if stats_subregion is None:
-            xmin = ymin = 5
-            xmax = naxis1
-            ymax = naxis2
-        else:  # ((xmin, xmax), (ymin, ymax))
-            xmin = stats_subregion[0][0]
-            xmax = stats_subregion[0][1]
-            ymin = stats_subregion[1][0]
-            ymax = stats_subregion[1][1]
-        slx = slice(xmin, xmax)
-        sly = slice(ymin, ymax)
+        The maximum number of sigma clipping iterations (``maxiters`` of
+        `~astropy.stats.sigma_clipped_stats`). This is ignored when
+        ``sigma_clip=False``. If `None`, clipping iterates until no more pixels
+        are rejected. Defaults to `None`.
+    check_background : bool
+        If `True`, skip the flattening when the background does not vary over the
+        ramp. Defaults to `False`.
 
-        # Subtract per-read median countrate scalar and add back in full exposure countrate
-        # to preserve pixel statistics
-        total_countrate = _calc_avg(
-            ima_hdu["SCI", 1].data[sly, slx], stats_method, sigma_clip, sigma, sigma_upper, sigma_lower, iters
-        )
+    Returns
+    -------
+    flattened : bool
+        `False` if ``check_background`` found a constant background, and the
+        products were not flattened.
+    """
+    _check_stats_options(stats_method, sigma_clip, sigma, sigma_upper, sigma_lower)
+    return _flatten(
+        raw_file,
+        calwf3,
+        "",
+        stats_subregion,
+        stats_method,
+        sigma_clip,
+        sigma,
+        sigma_upper,
+        sigma_lower,
+        iters,
+        check_background=check_background,
+    )
+
+
+def _flatten_job(raw_file, scratch_root, products, log_func, flatten_options):
+    """Flatten one RAW file in its own scratch directory and move the products back next to it."""
+    dest_dir = os.path.dirname(os.path.abspath(raw_file))
+    # a missing ASN_TAB fails this job alone, in _flatten
+    asn_tab = fits.getheader(raw_file).get("ASN_TAB", "NONE")
+    results = []
+
+    with ScratchDir(scratch_root) as scratch:
+
+        def run(filename):
+            name = os.path.basename(filename)
+            path = os.path.join(scratch.path, name)
+            # validated where it is, but given to calwf3.e relative to the scratch directory,
+            # where the dummy ASN is written
+            call_list = _calwf3_call_list(input=path)
+            call_list[-1] = name
+            result = run_executable(call_list, input=path, log_func=log_func, cwd=scratch.path)
+            results.append(result)
+            if not result.ok:
+                raise RuntimeError("calwf3.e exited with code {}".format(result.error or result.returncode))
+            return result
+
+        # A private copy of the RAW, as its CRCORR switch is changed during the run
+        local_raw = scratch.stage(raw_file, link=False)
+        for filename in staged_inputs(raw_file)[1:]:
+            scratch.stage(filename)
+        if asn_tab != "NONE":
+            scratch.stage(os.path.join(dest_dir, asn_tab))
+
+        try:
+            _flatten(local_raw, run, scratch.path, **flatten_options)
+        except (RuntimeError, OSError, KeyError) as e:
+            if results and not results[-1].ok:
+                result = results[-1]
+            else:
+                # failed outside of calwf3.e, e.g. a missing header keyword
+                command = results[-1].command if results else []
+                result = RunResult(input=raw_file, command=command, returncode=2, error=str(e) or type(e).__name__)
+            result.outputs = scratch.collect(dest_dir, products=["tra"])
+        else:
+            result = results[-1]
+            result.outputs = scratch.collect(dest_dir, products=products)
+        result.input = raw_file
+
+    return result
+
+
+def make_flattened_ramp_flt_batch(
+    inputs,
+    max_workers=None,
+    scratch_root=None,
+    products=("ima", "flt", "flc", "tra"),
+    log_func=None,
+    stats_subregion=None,
+    stats_method="median",
+    sigma_clip=False,
+    sigma=None,
+    sigma_upper=None,
+    sigma_lower=None,
+    iters=None,
+    check_background=False,
+):
+    """
+    Make flattened FLT and IMA files for many RAW files at once.
 
-        for i in range(2, ima_hdu[0].header["NSAMP"] + 1):
-            ext = ("SCI", i)
-            avg = _calc_avg(ima_hdu[ext].data[sly, slx], stats_method, sigma_clip, sigma, sigma_upper, sigma_lower, iters)
-            ima_hdu[ext].data += total_countrate - avg
+    Each RAW file is processed as by `make_flattened_ramp_flt`, but in its own
+    scratch directory, with a private copy of the RAW, its SPT and ASN files,
+    and its own dummy ASN if needed. The RAW files are not modified, the
+    working directory does not matter, and several RAW files in the same
+    directory can be processed at the same time. The products are moved back
+    next to each RAW file, each with an atomic rename.
 
-        # Turn on ramp fitting
-        ima_hdu[0].header["CRCORR"] = "PERFORM"
+    Parameters
+    ----------
+    inputs : str or list
+        RAW files, as a single filename, a Python list of filenames, a partial
+        filename with wildcards (``*raw.fits``), or an at-file (``@input``).
+    max_workers : int or None
+        Maximum number of RAW files processed at once. Defaults to the number of CPUs.
+    scratch_root : str or None
+        Directory in which the scratch directories are created. Defaults to
+        ``/dev/shm`` if usable, else the system temporary directory.
+    products : tuple of str
+        Product suffixes to move back. Defaults to ``("ima", "flt", "flc", "tra")``.
+        Only the trailer is moved back when a calwf3 run fails.
+    log_func : func or None
+        Called with every line of output of every calwf3 run. Defaults to `None`,
+        which discards the output.
+    stats_subregion, stats_method, sigma_clip, sigma, sigma_upper, sigma_lower, iters, check_background
+        As for `make_flattened_ramp_flt`.
 
-    # Run calwf3 on modified IMA
-    calwf3(ima_file)
+    Returns
+    -------
+    results : list of `~wfc3tools.runner.RunResult`
+        For each RAW file, in input order, the result of its last calwf3 run,
+        with ``input`` the RAW file and ``outputs`` the products moved back.
+        A RAW file that fails outside of calwf3 (e.g. a missing header keyword)
+        has a result with ``returncode`` 2 and ``error`` the error message.
+
+    Raises
+    ------
+    IOError
+        If an input does not exist, or the ASN file of an input is not in the
+        same directory. This is checked for all inputs before any processing starts.
+    """
+    _check_stats_options(stats_method, sigma_clip, sigma, sigma_upper, sigma_lower)
+    infiles = _expand_inputs(inputs)
+    if len(infiles) == 0:
+        raise IOError("No valid image specified")
+    for raw_file in infiles:
+        asn_tab = fits.getheader(raw_file).get("ASN_TAB", "NONE")
+        if asn_tab != "NONE" and not os.path.isfile(os.path.join(os.path.dirname(raw_file), asn_tab)):
+            raise IOError(f"{asn_tab} must be in same directory as RAW file.")
+
+    if scratch_root is None:
+        scratch_root = default_scratch_root()
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    flatten_options = dict(
+        stats_subregion=stats_subregion,
+        stats_method=stats_method,
+        sigma_clip=sigma_clip,
+        sigma=sigma,
+        sigma_upper=sigma_upper,
+        sigma_lower=sigma_lower,
+        iters=iters,
+        check_background=check_background,
+    )
+
+    def job(raw_file):
+        return _flatten_job(raw_file, scratch_root, products, log_func, flatten_options)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(job, infiles))